@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+# pylint: disable=W0212
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import tensorflow as tf
+import cv2
+
+from utils import visualization_utils_color as vis_util
+from utils.benchmark import SyntheticVideoSource, StageTimer
+from inference_usbCam_face import TensoflowFaceDector, PATH_TO_CKPT, get_category_index
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'opencv_threads': cv2.getNumThreads(),
+        'tensorflow': tf.__version__,
+        'omp_num_threads': os.environ.get('OMP_NUM_THREADS'),
+    }
+
+
+def open_source(args):
+    if args.source == 'synthetic':
+        return SyntheticVideoSource(width=args.width, height=args.height,
+                                    num_frames=args.warmup + args.frames)
+    return cv2.VideoCapture(args.source)
+
+
+def run_once(tDetector, args, timer, out_path):
+    """Runs warm-up and timed frames through every stage once.
+
+    return the number of timed frames and their total wall time
+    """
+
+    cap = open_source(args)
+    out = None
+    frames = 0
+    elapsed = 0.0
+    try:
+        for index in range(args.warmup + args.frames):
+            timer.enabled = index >= args.warmup
+            start_time = time.time()
+
+            with timer.time('decode'):
+                ret, image = cap.read()
+            if not ret:
+                break
+
+            with timer.time('color_conversion'):
+                image_batch = tDetector._preprocess(image)
+
+            with timer.time('inference'):
+                (boxes, scores, classes, num_detections) = tDetector._run_inference(image_batch)
+
+            with timer.time('postprocess'):
+                boxes = np.squeeze(boxes)
+                classes = np.squeeze(classes).astype(np.int32)
+                scores = np.squeeze(scores)
+
+            with timer.time('drawing'):
+                vis_util.visualize_boxes_and_labels_on_image_array(
+                    image,
+                    boxes,
+                    classes,
+                    scores,
+                    get_category_index(),
+                    use_normalized_coordinates=True,
+                    line_thickness=4,
+                    renderer=args.renderer)
+
+            with timer.time('encoding'):
+                if out is None:
+                    [h, w] = image.shape[:2]
+                    out = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*'MJPG'), 25.0, (w, h))
+                out.write(image)
+
+            frame_time = time.time() - start_time
+            timer.add('total', frame_time)
+            if timer.enabled:
+                frames += 1
+                elapsed += frame_time
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+    return frames, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Per-stage benchmark of the face detection pipeline.')
+    parser.add_argument('--source', default='synthetic',
+                        help='"synthetic" or the path of a local clip (default: %(default)s)')
+    parser.add_argument('--width', type=int, default=1280,
+                        help='synthetic frame width (default: %(default)s)')
+    parser.add_argument('--height', type=int, default=720,
+                        help='synthetic frame height (default: %(default)s)')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='timed frames per repetition (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='untimed frames before each repetition (default: %(default)s)')
+    parser.add_argument('--repetitions', type=int, default=3,
+                        help='number of repetitions (default: %(default)s)')
+    parser.add_argument('--renderer', choices=('pil', 'cv2'), default='pil',
+                        help='box renderer (default: %(default)s)')
+    parser.add_argument('--intra-op-threads', type=int, default=0,
+                        help='tensorflow intra op threads, 0 for automatic')
+    parser.add_argument('--inter-op-threads', type=int, default=0,
+                        help='tensorflow inter op threads, 0 for automatic')
+    parser.add_argument('--model', default=PATH_TO_CKPT,
+                        help='frozen graph (default: %(default)s)')
+    parser.add_argument('--output', default=None,
+                        help='write the results as json to this file instead of stdout')
+    args = parser.parse_args()
+
+    tDetector = TensoflowFaceDector(args.model,
+                                    warmup_runs=0,
+                                    intra_op_threads=args.intra_op_threads,
+                                    inter_op_threads=args.inter_op_threads)
+
+    timer = StageTimer()
+    repetition_fps = []
+    work_dir = tempfile.mkdtemp(prefix='face_benchmark_')
+    try:
+        for repetition in range(args.repetitions):
+            frames, elapsed = run_once(tDetector, args, timer,
+                                       os.path.join(work_dir, 'out.avi'))
+            repetition_fps.append(frames / elapsed if elapsed > 0 else 0.0)
+            sys.stderr.write('repetition {}: {} frames, {:.2f} fps\n'.format(
+                repetition, frames, repetition_fps[-1]))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'environment': environment(),
+        'config': vars(args),
+        'stages_ms': timer.summary(),
+        'fps': {
+            'repetitions': repetition_fps,
+            'mean': float(np.mean(repetition_fps)) if repetition_fps else 0.0,
+        },
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
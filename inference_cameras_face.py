@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+import os
+import argparse
+import asyncio
+import logging
+import threading
+
+from concurrent import futures
+
+from utils import metrics
+from utils.camera_orchestrator import CameraOrchestrator, CameraSource
+from utils.crop_export import CropExporter
+from utils.detection_sinks import open_sink
+from inference_usbCam_face import TensoflowFaceDector, PATH_TO_CKPT
+
+# Frames waiting for crop export at most; beyond it the crops of new frames
+# are skipped rather than holding more frames in memory.
+MAX_PENDING_CROP_FRAMES = 16
+
+
+def parse_source(spec, max_fps):
+    """'name=url', or just 'url', into a CameraSource; digits are camera ids."""
+
+    name, sep, url = spec.partition('=')
+    if not sep:
+        name, url = spec, spec
+    try:
+        url = int(url)
+    except ValueError:
+        pass
+    return CameraSource(name, url, max_fps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Detect faces in many live cameras (usb ids, rtsp urls) from one '
+                    'process and one shared model, e.g. '
+                    '%(prog)s door=rtsp://10.0.0.5/stream hall=0')
+    parser.add_argument('sources', nargs='+', help='cameras as name=url or url')
+    parser.add_argument('--max-fps', type=float, default=None,
+                        help='process at most this many frames per second per camera')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='maximum frames per inference call (default: %(default)s)')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help='longest wait for more cameras to fill a batch, in '
+                             'milliseconds (default: %(default)s)')
+    parser.add_argument('--no-reconnect', action='store_true',
+                        help='stop reading a camera once it fails, instead of reopening it')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='stop after this many seconds')
+    parser.add_argument('--detections-dir', default=None,
+                        help='write the detections of each camera to <name>.jsonl '
+                             'in this directory')
+    parser.add_argument('--crops-dir', default=None,
+                        help='write the detected faces of each camera as jpg crops '
+                             'to <name>/ in this directory, skipping near-duplicates')
+    parser.add_argument('--min-score', type=float, default=.7,
+                        help='minimum score of the written detections and crops '
+                             '(default: %(default)s)')
+    parser.add_argument('--report-interval', type=float, default=10.0,
+                        help='seconds between per-camera fps and lag reports '
+                             '(default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve prometheus metrics on this local port')
+    parser.add_argument('--metrics-file', default=None,
+                        help='write prometheus metrics to this file periodically')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stop_metrics = metrics.start_exporters(args.metrics_port, args.metrics_file)
+
+    sources = [parse_source(spec, args.max_fps) for spec in args.sources]
+    sinks = {}
+    if args.detections_dir is not None:
+        if not os.path.isdir(args.detections_dir):
+            os.makedirs(args.detections_dir)
+        for source in sources:
+            sinks[source.name] = open_sink(
+                os.path.join(args.detections_dir, '{}.jsonl'.format(source.name)),
+                min_score_thresh=args.min_score)
+
+    crop_exporters = {}
+    if args.crops_dir is not None:
+        for source in sources:
+            crop_exporters[source.name] = CropExporter(
+                os.path.join(args.crops_dir, source.name),
+                min_score_thresh=args.min_score)
+    # Cutting, hashing and queueing the crops may block, so it runs off the
+    # event loop; a single thread keeps the frames of each camera in order.
+    crop_executor = futures.ThreadPoolExecutor(1)
+    crop_slots = threading.BoundedSemaphore(MAX_PENDING_CROP_FRAMES)
+    skipped_crop_frames = [0]
+
+    def export_crops(crop_exporter, sequence, image, detections):
+        try:
+            crop_exporter.add(sequence, image, detections)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('crop export failed')
+        finally:
+            crop_slots.release()
+
+    def on_detections(name, sequence, timestamp, image, detections):
+        if name in sinks:
+            sinks[name].write(sequence, timestamp, detections)
+        if name in crop_exporters:
+            if crop_slots.acquire(False):
+                crop_executor.submit(export_crops, crop_exporters[name],
+                                     sequence, image, detections)
+            else:
+                skipped_crop_frames[0] += 1
+
+    tDetector = TensoflowFaceDector(PATH_TO_CKPT)
+    orchestrator = CameraOrchestrator(tDetector, sources,
+                                      on_detections=on_detections,
+                                      batch_size=args.batch_size,
+                                      max_wait=args.max_wait_ms / 1000.0,
+                                      reconnect=not args.no_reconnect,
+                                      report_interval=args.report_interval)
+    try:
+        asyncio.run(orchestrator.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sink in sinks.values():
+            sink.close()
+        crop_executor.shutdown(wait=True)
+        for crop_exporter in crop_exporters.values():
+            crop_exporter.close()
+        stop_metrics()
+    for s in orchestrator.stats():
+        print('{source}: {frames_processed} frames processed, {frames_dropped} dropped, '
+              '{reconnects} reconnects'.format(**s))
+    if crop_exporters:
+        print('crops skipped on {} frames while the export fell behind'.format(
+            skipped_crop_frames[0]))
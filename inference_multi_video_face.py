@@ -0,0 +1,40 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+import argparse
+import logging
+
+from utils.stream_supervisor import StreamSupervisor
+from inference_usbCam_face import TensoflowFaceDector, PATH_TO_CKPT
+from inference_video_face import render
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Detect faces in several videos with one shared model. '
+                    'Each output is written next to its input as <name>_out.avi.')
+    parser.add_argument('inputs', nargs='+', help='input videos')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='worker threads sharing the model (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=4,
+                        help='frames taken from one stream per turn (default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='decoded frames buffered per stream (default: %(default)s)')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='stop each stream after this many frames')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    tDetector = TensoflowFaceDector(PATH_TO_CKPT)
+
+    supervisor = StreamSupervisor(tDetector, args.inputs, render,
+                                  num_workers=args.workers,
+                                  batch_size=args.batch_size,
+                                  queue_size=args.queue_size,
+                                  max_frames=args.max_frames)
+    for p in supervisor.run():
+        print('{}: wrote {} frames to {} ({:.1f} fps)'.format(
+            p['input'], p['frames_written'], p['output'], p['fps']))
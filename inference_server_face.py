@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+import argparse
+import logging
+
+from utils.inference_server import make_server
+from utils.micro_batcher import MicroBatcher
+from inference_usbCam_face import TensoflowFaceDector, PATH_TO_CKPT
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Serve face detection to local clients over HTTP. Frames sent '
+                    'concurrently by several clients are batched together into '
+                    'one inference call.')
+    parser.add_argument('--port', type=int, default=8500,
+                        help='local TCP port (default: %(default)s)')
+    parser.add_argument('--unix-socket', default=None,
+                        help='listen on this Unix domain socket instead of the port')
+    parser.add_argument('--max-batch-size', type=int, default=8,
+                        help='maximum frames per inference call (default: %(default)s)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='longest a frame waits for a batch to fill, in '
+                             'milliseconds (default: %(default)s)')
+    parser.add_argument('--letterbox', action='store_true',
+                        help='pad frames of different resolutions onto a common '
+                             'canvas instead of grouping them by resolution, fewer '
+                             'inference calls but resolution dependent detections')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    tDetector = TensoflowFaceDector(PATH_TO_CKPT)
+    batcher = MicroBatcher(tDetector,
+                           max_batch_size=args.max_batch_size,
+                           max_wait=args.max_wait_ms / 1000.0,
+                           letterbox=args.letterbox)
+    server = make_server(batcher, port=args.port, unix_socket=args.unix_socket)
+    logging.info('serving on %s', args.unix_socket or 'port {}'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
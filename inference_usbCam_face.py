@@ -4,12 +4,16 @@
 # pylint: disable=E1101
 
 import sys
-import time
+import collections
+import threading
 import numpy as np
 import tensorflow as tf
 import cv2
 
 from utils import label_map_util
+from utils import metrics
+from utils import model_artifact
+from utils.detections import Detections
 from utils import visualization_utils_color as vis_util
 
 # Path to frozen detection graph. This is the actual model that is used for the object detection.
@@ -20,15 +24,51 @@ PATH_TO_LABELS = './protos/face_label_map.pbtxt'
 
 NUM_CLASSES = 2
 
-label_map = label_map_util.load_labelmap(PATH_TO_LABELS)
-categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=NUM_CLASSES, use_display_name=True)
-category_index = label_map_util.create_category_index(categories)
+# Input buffers kept per thread, for this many distinct frame sizes at most.
+MAX_BUFFER_SHAPES = 4
+
+def get_category_index():
+    """Returns the category index of the label map, parsed on first use."""
+
+    return label_map_util.load_category_index(PATH_TO_LABELS, NUM_CLASSES, use_display_name=True)
+
+
+INFERENCE_SECONDS = metrics.histogram('face_inference_seconds', 'Wall time of one detector sess.run.')
+INFERENCE_FRAMES = metrics.counter('face_inference_frames_total', 'Frames sent through the detector.')
+
+
+def bgr_to_rgb_into(image, out):
+    """Writes the rgb version of a bgr image into the preallocated array out,
+    which may be a view into a larger buffer, without allocating a new frame.
+    """
+
+    result = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=out)
+    if not np.may_share_memory(result, out):
+        # Older OpenCV bindings do not write into strided views.
+        np.copyto(out, result)
+
 
 class TensoflowFaceDector(object):
-    def __init__(self, PATH_TO_CKPT):
+    def __init__(self, PATH_TO_CKPT, warmup_runs=1, warmup_shape=(480, 640),
+                 intra_op_threads=0, inter_op_threads=0, use_optimized=True):
         """Tensorflow detector
+
+        warmup_runs: number of inferences on a dummy frame run at construction,
+            so that the one-time graph optimization cost is not paid by the
+            first real frame.
+        warmup_shape: (h, w) of the dummy frame, ideally the resolution of the
+            frames that will follow.
+        intra_op_threads, inter_op_threads: tensorflow thread pool sizes,
+            0 lets tensorflow pick.
+        use_optimized: load the graph optimized by prepare_model_face.py
+            instead, when it is fresh.
         """
 
+        if use_optimized:
+            PATH_TO_CKPT = model_artifact.resolve_model_path(PATH_TO_CKPT)
+        # The graph actually loaded, e.g. for fingerprinting cached results.
+        self.model_path = PATH_TO_CKPT
+
         self.detection_graph = tf.Graph()
         with self.detection_graph.as_default():
             od_graph_def = tf.GraphDef()
@@ -41,83 +81,332 @@ class TensoflowFaceDector(object):
         with self.detection_graph.as_default():
             config = tf.ConfigProto()
             config.gpu_options.allow_growth = True
+            config.intra_op_parallelism_threads = intra_op_threads
+            config.inter_op_parallelism_threads = inter_op_threads
             self.sess = tf.Session(graph=self.detection_graph, config=config)
             self.windowNotSet = True
 
+            # Resolve the tensors once, and compile the fetch / feed
+            # signature into a session callable instead of building it per frame.
+            self.image_tensor = self.detection_graph.get_tensor_by_name('image_tensor:0')
+            # Each box represents a part of the image where a particular object was detected.
+            # Each score represent how level of confidence for each of the objects.
+            # Score is shown on the result image, together with the class label.
+            self.output_tensors = [
+                self.detection_graph.get_tensor_by_name(name)
+                for name in ('detection_boxes:0', 'detection_scores:0',
+                             'detection_classes:0', 'num_detections:0')]
+            self._run_callable = self.sess.make_callable(
+                self.output_tensors, feed_list=[self.image_tensor])
+
+        # Input buffers by (h, w), per thread since threads may share the detector.
+        self._buffers = threading.local()
+
+        if warmup_runs > 0:
+            dummy = np.zeros((1,) + tuple(warmup_shape) + (3,), dtype=np.uint8)
+            for _ in range(warmup_runs):
+                self._run_callable(dummy)
+
 
     def run(self, image):
         """image: bgr image
         return (boxes, scores, classes, num_detections)
         """
 
-        image_np = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # the array based representation of the image will be used later in order to prepare the
-        # result image with boxes and labels on it.
-        # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-        image_np_expanded = np.expand_dims(image_np, axis=0)
-        image_tensor = self.detection_graph.get_tensor_by_name('image_tensor:0')
-        # Each box represents a part of the image where a particular object was detected.
-        boxes = self.detection_graph.get_tensor_by_name('detection_boxes:0')
-        # Each score represent how level of confidence for each of the objects.
-        # Score is shown on the result image, together with the class label.
-        scores = self.detection_graph.get_tensor_by_name('detection_scores:0')
-        classes = self.detection_graph.get_tensor_by_name('detection_classes:0')
-        num_detections = self.detection_graph.get_tensor_by_name('num_detections:0')
+        return self._run_inference(self._preprocess(image))
+
+
+    def _preprocess(self, image):
+        """image: bgr image
+        return the image as an rgb batch of shape [1, H, W, 3], the shape the
+        model expects, held in a buffer reused for every frame of that size
+        """
+
+        [h, w] = image.shape[:2]
+        batch = self._get_batch_buffer(1, h, w)
+        bgr_to_rgb_into(image, batch[0])
+        return batch
+
+
+    def detect(self, image, min_score_thresh=.5, max_detections=None):
+        """image: bgr image
+        return the faces scoring above min_score_thresh as a Detections,
+        best first, at most max_detections of them
+        """
+
+        return Detections.from_raw(self.run(image), min_score_thresh, max_detections)
+
+
+    def run_batch(self, frames, batch_size=16, letterbox=False):
+        """frames: list of bgr images
+        return a list of (boxes, scores, classes, num_detections), one per frame,
+        each shaped like the output of run()
+
+        Frames are copied into a preallocated [batch_size, H, W, 3] buffer and
+        sent through a single sess.run per batch. Frames of different
+        resolutions are grouped by shape, or, with letterbox=True, padded onto
+        one common canvas so that they can share a batch.
+        """
+
+        results = [None] * len(frames)
+        if not frames:
+            return results
+
+        if letterbox:
+            canvas_h = max(frame.shape[0] for frame in frames)
+            canvas_w = max(frame.shape[1] for frame in frames)
+            groups = {(canvas_h, canvas_w): list(range(len(frames)))}
+        else:
+            groups = {}
+            for i, frame in enumerate(frames):
+                groups.setdefault(frame.shape[:2], []).append(i)
+
+        for (h, w), indices in groups.items():
+            # Sized for the largest chunk of this group, not for batch_size.
+            batch = self._get_batch_buffer(min(batch_size, len(indices)), h, w)
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                for j, i in enumerate(chunk):
+                    [fh, fw] = frames[i].shape[:2]
+                    if (fh, fw) != (h, w):
+                        batch[j].fill(0)
+                    # bgr -> rgb straight into the batch slot, no intermediate copy.
+                    bgr_to_rgb_into(frames[i], batch[j, :fh, :fw])
+
+                (boxes, scores, classes, num_detections) = self._run_inference(batch[:len(chunk)])
+
+                for j, i in enumerate(chunk):
+                    frame_boxes = boxes[j:j + 1]
+                    [fh, fw] = frames[i].shape[:2]
+                    if (fh, fw) != (h, w):
+                        # Map normalized canvas coordinates back onto the frame.
+                        frame_boxes = frame_boxes * np.array(
+                            [h / float(fh), w / float(fw), h / float(fh), w / float(fw)],
+                            dtype=frame_boxes.dtype)
+                        np.clip(frame_boxes, 0.0, 1.0, out=frame_boxes)
+                    results[i] = (frame_boxes,
+                                  scores[j:j + 1],
+                                  classes[j:j + 1],
+                                  num_detections[j:j + 1])
+
+        return results
+
+
+    def _get_batch_buffer(self, batch_size, h, w):
+        """Returns a reusable uint8 buffer of shape [batch_size, h, w, 3].
+
+        The buffer is a view of one buffer per frame size, grown when a larger
+        batch is requested. Only the MAX_BUFFER_SHAPES most recently used frame
+        sizes are kept.
+        """
+
+        buffers = getattr(self._buffers, 'by_shape', None)
+        if buffers is None:
+            buffers = self._buffers.by_shape = collections.OrderedDict()
+        batch = buffers.pop((h, w), None)
+        if batch is None or batch.shape[0] < batch_size:
+            batch = np.zeros((batch_size, h, w, 3), dtype=np.uint8)
+        buffers[(h, w)] = batch
+        while len(buffers) > MAX_BUFFER_SHAPES:
+            buffers.popitem(last=False)
+        return batch[:batch_size]
+
+
+    def _run_inference(self, image_batch):
+        """image_batch: rgb uint8 array of shape [N, H, W, 3]
+        return (boxes, scores, classes, num_detections) for the whole batch
+        """
+
         # Actual detection.
-        start_time = time.time()
-        (boxes, scores, classes, num_detections) = self.sess.run(
-            [boxes, scores, classes, num_detections],
-            feed_dict={image_tensor: image_np_expanded})
-        elapsed_time = time.time() - start_time
-        print('inference time cost: {}'.format(elapsed_time))
+        with INFERENCE_SECONDS.time():
+            (boxes, scores, classes, num_detections) = self._run_callable(image_batch)
+        INFERENCE_FRAMES.inc(len(image_batch))
 
         return (boxes, scores, classes, num_detections)
 
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 2:
-        print ("usage:%s (cameraID | filename) Detect faces\
- in the video example:%s 0"%(sys.argv[0], sys.argv[0]))
-        exit(1)
+    import argparse
+    import logging
+    import multiprocessing
+    import time
+    from utils.adaptive import AdaptiveQualityController
+    from utils.capture import LatestFrameCapture
+    from utils.crop_export import CropExporter
+    from utils.frame_ring import FrameRing, run_capture
+    from utils.tracking import TrackingDetector
+    from utils.motion_gate import MotionGatedDetector
+    from utils.tiling import TiledDetector
+
+    parser = argparse.ArgumentParser(
+        description='Detect faces in the video of a usb camera or a file, '
+                    'example: %(prog)s 0')
+    parser.add_argument('camera', help='camera id or video file name')
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='run the detector on overlapping tiles of this '
+                             'size in pixels, for small faces in 4K frames')
+    parser.add_argument('--tile-overlap', type=int, default=128,
+                        help='with --tile-size, overlap between tiles in pixels '
+                             '(default: %(default)s)')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='run the detector on every K-th frame and track '
+                             'the faces in between (default: %(default)s)')
+    parser.add_argument('--motion-threshold', type=float, default=None,
+                        help='skip inference while the mean frame difference '
+                             'stays below this gray level, e.g. 3')
+    parser.add_argument('--refresh-every', type=int, default=150,
+                        help='with --motion-threshold, still run the detector '
+                             'every N frames (default: %(default)s)')
+    parser.add_argument('--target-fps', type=float, default=None,
+                        help='lower the input resolution, detection rate and boxes '
+                             'drawn as needed to sustain this frame rate')
+    parser.add_argument('--target-p95-ms', type=float, default=None,
+                        help='same, to keep the 95th percentile detection latency '
+                             'under this many milliseconds')
+    parser.add_argument('--capture-process', action='store_true',
+                        help='decode the camera in a separate process, handing '
+                             'frames over through shared memory')
+    parser.add_argument('--async-capture', action='store_true',
+                        help='capture on a background thread and always process '
+                             'the newest frame, dropping stale ones, for the '
+                             'lowest latency on a live camera')
+    parser.add_argument('--crops-dir', default=None,
+                        help='write the detected faces as jpg crops to this '
+                             'directory, skipping near-duplicates of recent crops')
+    parser.add_argument('--crop-margin', type=float, default=.2,
+                        help='margin added around each crop, as a fraction of the '
+                             'box size (default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve prometheus metrics on this local port')
+    parser.add_argument('--metrics-file', default=None,
+                        help='write prometheus metrics to this file periodically')
+    args = parser.parse_args()
+    if args.capture_process and args.async_capture:
+        parser.error('--capture-process and --async-capture are exclusive')
+
+    logging.basicConfig(level=logging.INFO)
+
+    stop_metrics = metrics.start_exporters(args.metrics_port, args.metrics_file)
+    frames_in = metrics.counter('face_frames_in_total', 'Frames read from the input.')
+    detections = metrics.counter('face_detections_total', 'Faces drawn above the score threshold.')
+    stage_seconds = dict(
+        (stage, metrics.histogram('face_stage_seconds', 'Wall time per pipeline stage.',
+                                  labels={'stage': stage}))
+        for stage in ('decode', 'detect', 'render', 'display'))
+    glass_to_glass = metrics.histogram('face_glass_to_glass_seconds',
+                                       'Time from capturing a frame to displaying it.')
 
     try:
-    	camID = int(sys.argv[1])
+    	camID = int(args.camera)
     except:
-    	camID = sys.argv[1]
+    	camID = args.camera
     
     tDetector = TensoflowFaceDector(PATH_TO_CKPT)
+    if args.tile_size is not None:
+        tDetector = TiledDetector(tDetector,
+                                  tile_size=(args.tile_size, args.tile_size),
+                                  overlap=args.tile_overlap)
+    if args.detect_every > 1:
+        tDetector = TrackingDetector(tDetector, detect_every=args.detect_every)
+    motion_gate = None
+    if args.motion_threshold is not None:
+        motion_gate = tDetector = MotionGatedDetector(tDetector,
+                                                      threshold=args.motion_threshold,
+                                                      refresh_every=args.refresh_every)
+    quality = None
+    if args.target_fps is not None or args.target_p95_ms is not None:
+        quality = AdaptiveQualityController(
+            tDetector,
+            target_fps=args.target_fps,
+            target_p95=args.target_p95_ms / 1000.0 if args.target_p95_ms else None)
+        tDetector = quality
+
+    crop_exporter = None
+    if args.crops_dir is not None:
+        crop_exporter = CropExporter(args.crops_dir, margin=args.crop_margin)
 
-    cap = cv2.VideoCapture(camID)
+    ring = None
+    if args.capture_process:
+        ring = FrameRing(num_slots=4)
+        capture = multiprocessing.Process(target=run_capture, args=(ring, camID))
+        capture.daemon = True
+        capture.start()
+    elif args.async_capture:
+        cap = LatestFrameCapture(camID)
+    else:
+        cap = cv2.VideoCapture(camID)
     windowNotSet = True
-    while True:
-        ret, image = cap.read()
-        if ret == 0:
-            break
+    # Mirrored frame, reused from frame to frame.
+    mirrored = None
+    frame_index = 0
+    try:
+        while True:
+            with stage_seconds['decode'].time():
+                if ring is not None:
+                    frame = ring.get()
+                    ret = frame is not None
+                    if ret:
+                        image = frame.image
+                        captured_at = frame.timestamp
+                elif args.async_capture:
+                    ret, image, captured_at = cap.read()
+                else:
+                    ret, image = cap.read()
+                    captured_at = time.time()
+            if ret == 0:
+                break
+            frames_in.inc()
 
-        [h, w] = image.shape[:2]
-        print (h, w)
-        image = cv2.flip(image, 1)
-
-        (boxes, scores, classes, num_detections) = tDetector.run(image)
-
-        vis_util.visualize_boxes_and_labels_on_image_array(
-            image,
-            np.squeeze(boxes),
-            np.squeeze(classes).astype(np.int32),
-            np.squeeze(scores),
-            category_index,
-            use_normalized_coordinates=True,
-            line_thickness=4)
-
-        if windowNotSet is True:
-            cv2.namedWindow("tensorflow based (%d, %d)" % (w, h), cv2.WINDOW_NORMAL)
-            windowNotSet = False
-
-        cv2.imshow("tensorflow based (%d, %d)" % (w, h), image)
-        k = cv2.waitKey(1) & 0xff
-        if k == ord('q') or k == 27:
-            break
-
-    cap.release()
+            [h, w] = image.shape[:2]
+            if mirrored is None or mirrored.shape != image.shape:
+                mirrored = np.empty_like(image)
+            cv2.flip(image, 1, dst=mirrored)
+            image = mirrored
+            if ring is not None:
+                # The flip copied the frame out of its slot, hand the slot back.
+                ring.release(frame)
+
+            with stage_seconds['detect'].time():
+                faces = Detections.from_raw(tDetector.run(image), min_score_thresh=.7,
+                                            max_detections=quality.max_boxes if quality else 20)
+            if crop_exporter is not None:
+                # Before drawing, the boxes would end up in the crops.
+                crop_exporter.add(frame_index, image, faces)
+            frame_index += 1
+
+            with stage_seconds['render'].time():
+                detections.inc(len(faces))
+                vis_util.visualize_detections_on_image_array(
+                    image,
+                    faces,
+                    get_category_index(),
+                    line_thickness=4)
+
+            if windowNotSet is True:
+                cv2.namedWindow("tensorflow based (%d, %d)" % (w, h), cv2.WINDOW_NORMAL)
+                windowNotSet = False
+
+            with stage_seconds['display'].time():
+                cv2.imshow("tensorflow based (%d, %d)" % (w, h), image)
+                k = cv2.waitKey(1) & 0xff
+            glass_to_glass.observe(time.time() - captured_at)
+            if k == ord('q') or k == 27:
+                break
+    finally:
+        if ring is None:
+            cap.release()
+        else:
+            capture.terminate()
+            capture.join()
+            frame = None
+            ring.close()
+        if crop_exporter is not None:
+            # Write the crops queued so far, also on errors and Ctrl-C.
+            crop_exporter.close()
+        stop_metrics()
+    if crop_exporter is not None:
+        print('crops: {}'.format(crop_exporter.stats()))
+    if motion_gate is not None:
+        print('motion gate: {}'.format(motion_gate.stats()))
+    if args.async_capture:
+        print('dropped {} stale frames'.format(cap.dropped))
@@ -4,98 +4,162 @@
 # pylint: disable=E1101
 
 import sys
-import time
-import numpy as np
-import tensorflow as tf
-import cv2
+import argparse
+import functools
+import logging
 
 sys.path.append("..")
 
-from utils import label_map_util
+from utils import metrics
 from utils import visualization_utils_color as vis_util
+from utils.video_pipeline import VideoPipeline
+from utils.detection_sinks import open_sink
+from utils.crop_export import CropExporter
+from utils.detections import Detections
+from utils.detection_cache import CachedDetector, DetectionCache, entries_for_size
+from utils.fingerprint import model_fingerprint
+from utils.tracking import TrackingDetector
+from utils.motion_gate import MotionGatedDetector
+from utils.tiling import TiledDetector
 
 
 # Path to frozen detection graph. This is the actual model that is used for the object detection.
 PATH_TO_CKPT = './model/frozen_inference_graph_face.pb'
 
-# List of the strings that is used to add correct label for each box.
-PATH_TO_LABELS = './protos/face_label_map.pbtxt'
-
-NUM_CLASSES = 2
-
-label_map = label_map_util.load_labelmap(PATH_TO_LABELS)
-categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=NUM_CLASSES, use_display_name=True)
-category_index = label_map_util.create_category_index(categories)
-
-def load_image_into_numpy_array(image):
-  (im_width, im_height) = image.size
-  return np.array(image.getdata()).reshape(
-      (im_height, im_width, 3)).astype(np.uint8)
-
-cap = cv2.VideoCapture("./media/test.mp4")
-out = None
-
-detection_graph = tf.Graph()
-with detection_graph.as_default():
-    od_graph_def = tf.GraphDef()
-    with tf.gfile.GFile(PATH_TO_CKPT, 'rb') as fid:
-        serialized_graph = fid.read()
-        od_graph_def.ParseFromString(serialized_graph)
-        tf.import_graph_def(od_graph_def, name='')
-
-with detection_graph.as_default():
-  config = tf.ConfigProto()
-  config.gpu_options.allow_growth = True
-  with tf.Session(graph=detection_graph, config=config) as sess:
-    frame_num = 1490;
-    while frame_num:
-      frame_num -= 1
-      ret, image = cap.read()
-      if ret == 0:
-          break
-
-      if out is None:
-          [h, w] = image.shape[:2]
-          out = cv2.VideoWriter("./media/test_out.avi", 0, 25.0, (w, h))
-
-
-      image_np = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-      # the array based representation of the image will be used later in order to prepare the
-      # result image with boxes and labels on it.
-      # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-      image_np_expanded = np.expand_dims(image_np, axis=0)
-      image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-      # Each box represents a part of the image where a particular object was detected.
-      boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
-      # Each score represent how level of confidence for each of the objects.
-      # Score is shown on the result image, together with the class label.
-      scores = detection_graph.get_tensor_by_name('detection_scores:0')
-      classes = detection_graph.get_tensor_by_name('detection_classes:0')
-      num_detections = detection_graph.get_tensor_by_name('num_detections:0')
-      # Actual detection.
-      start_time = time.time()
-      (boxes, scores, classes, num_detections) = sess.run(
-          [boxes, scores, classes, num_detections],
-          feed_dict={image_tensor: image_np_expanded})
-      elapsed_time = time.time() - start_time
-      print('inference time cost: {}'.format(elapsed_time))
-      #print(boxes.shape, boxes)
-      #print(scores.shape,scores)
-      #print(classes.shape,classes)
-      #print(num_detections)
-      # Visualization of the results of a detection.
-      vis_util.visualize_boxes_and_labels_on_image_array(
-#          image_np,
-          image,
-          np.squeeze(boxes),
-          np.squeeze(classes).astype(np.int32),
-          np.squeeze(scores),
-          category_index,
-          use_normalized_coordinates=True,
-          line_thickness=4)
-      out.write(image)
-
-
-    cap.release()
-    out.release()
+DETECTIONS = metrics.counter('face_detections_total', 'Faces drawn above the score threshold.')
+
+
+def render(image, detections, renderer='pil', min_score_thresh=.7):
+    """Draws the detections of one frame onto the bgr image, in place."""
+
+    # Imported here, so that importing render() does not import tensorflow.
+    from inference_usbCam_face import get_category_index
+
+    faces = Detections.from_raw(detections, min_score_thresh, max_detections=20)
+    DETECTIONS.inc(len(faces))
+    # Visualization of the results of a detection.
+    vis_util.visualize_detections_on_image_array(
+        image,
+        faces,
+        get_category_index(),
+        min_score_thresh=min_score_thresh,
+        line_thickness=4,
+        renderer=renderer)
+
+
+if __name__ == "__main__":
+    # Loaded here, so that importing render() does not import tensorflow.
+    from inference_usbCam_face import TensoflowFaceDector
+
+    parser = argparse.ArgumentParser(description='Detect faces in a video file.')
+    parser.add_argument('input', nargs='?', default='./media/test.mp4',
+                        help='input video (default: %(default)s)')
+    parser.add_argument('output', nargs='?', default='./media/test_out.avi',
+                        help='output video (default: %(default)s)')
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help='stop after this many frames')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='frames per inference call (default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help='capacity of each pipeline queue (default: %(default)s)')
+    parser.add_argument('--render-workers', type=int, default=2,
+                        help='number of render threads (default: %(default)s)')
+    parser.add_argument('--renderer', choices=('pil', 'cv2'), default='pil',
+                        help='box renderer, cv2 draws all boxes in one pass '
+                             'without PIL copies (default: %(default)s)')
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='run the detector on overlapping tiles of this '
+                             'size in pixels, for small faces in 4K frames')
+    parser.add_argument('--tile-overlap', type=int, default=128,
+                        help='with --tile-size, overlap between tiles in pixels '
+                             '(default: %(default)s)')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='run the detector on every K-th frame and track '
+                             'the faces in between (default: %(default)s)')
+    parser.add_argument('--motion-threshold', type=float, default=None,
+                        help='skip inference while the mean frame difference '
+                             'stays below this gray level, e.g. 3')
+    parser.add_argument('--refresh-every', type=int, default=150,
+                        help='with --motion-threshold, still run the detector '
+                             'every N frames (default: %(default)s)')
+    parser.add_argument('--headless', action='store_true',
+                        help='skip drawing and encoding, only write detections '
+                             'and/or crops (requires --detections or --crops-dir)')
+    parser.add_argument('--detections', default=None,
+                        help='write the detections to this file, .jsonl for json '
+                             'lines, any other extension for the binary format')
+    parser.add_argument('--min-score', type=float, default=.7,
+                        help='minimum score of the drawn and written detections '
+                             '(default: %(default)s)')
+    parser.add_argument('--crops-dir', default=None,
+                        help='write the detected faces as jpg crops to this '
+                             'directory, skipping near-duplicates of recent crops')
+    parser.add_argument('--crop-margin', type=float, default=.2,
+                        help='margin added around each crop, as a fraction of the '
+                             'box size (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='cache the raw detections of every frame in this '
+                             'directory, re-runs over the same media skip inference')
+    parser.add_argument('--cache-size-mb', type=float, default=1024,
+                        help='size limit of the detection cache (default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve prometheus metrics on this local port')
+    parser.add_argument('--metrics-file', default=None,
+                        help='write prometheus metrics to this file periodically')
+    args = parser.parse_args()
+    if args.headless and args.detections is None and args.crops_dir is None:
+        parser.error('--headless requires --detections or --crops-dir')
+
+    logging.basicConfig(level=logging.INFO)
+    stop_metrics = metrics.start_exporters(args.metrics_port, args.metrics_file)
+
+    tDetector = TensoflowFaceDector(PATH_TO_CKPT)
+    cache = None
+    if args.cache_dir is not None:
+        cache = DetectionCache(args.cache_dir,
+                               max_entries=entries_for_size(args.cache_size_mb * 2 ** 20))
+        tDetector = CachedDetector(tDetector, cache, model_fingerprint(tDetector.model_path))
+    if args.tile_size is not None:
+        tDetector = TiledDetector(tDetector,
+                                  tile_size=(args.tile_size, args.tile_size),
+                                  overlap=args.tile_overlap)
+    if args.detect_every > 1:
+        tDetector = TrackingDetector(tDetector, detect_every=args.detect_every)
+    if args.motion_threshold is not None:
+        tDetector = MotionGatedDetector(tDetector,
+                                        threshold=args.motion_threshold,
+                                        refresh_every=args.refresh_every)
+
+    sink = None
+    if args.detections is not None:
+        sink = open_sink(args.detections, min_score_thresh=args.min_score)
+    crop_exporter = None
+    if args.crops_dir is not None:
+        crop_exporter = CropExporter(args.crops_dir, min_score_thresh=args.min_score,
+                                     margin=args.crop_margin)
+
+    if args.headless:
+        output, render_fn = None, None
+    else:
+        output, render_fn = args.output, functools.partial(
+            render, renderer=args.renderer, min_score_thresh=args.min_score)
+
+    pipeline = VideoPipeline(tDetector, args.input, output, render_fn,
+                             sink=sink,
+                             crop_exporter=crop_exporter,
+                             max_frames=args.max_frames,
+                             queue_size=args.queue_size,
+                             batch_size=args.batch_size,
+                             num_render_workers=args.render_workers)
+    try:
+        frames = pipeline.run()
+    finally:
+        if cache is not None:
+            cache.close()
+        stop_metrics()
+    print('processed {} frames, output: {}, detections: {}'.format(
+        frames, output, args.detections))
+    if args.motion_threshold is not None:
+        print('motion gate: {}'.format(tDetector.stats()))
+    if crop_exporter is not None:
+        print('crops: {}'.format(crop_exporter.stats()))
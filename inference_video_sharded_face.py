@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+import os
+import argparse
+import functools
+import logging
+import multiprocessing
+import cv2
+
+from utils.detection_sinks import open_sink
+from utils.sharding import ShardCheckpoint, plan_shards, shard_path, merge_videos, merge_files
+from utils.video_pipeline import VideoPipeline
+
+
+# Path to frozen detection graph. This is the actual model that is used for the object detection.
+PATH_TO_CKPT = './model/frozen_inference_graph_face.pb'
+
+# Detector of the current worker process, loaded once by init_worker.
+worker_detector = None
+
+
+def init_worker(model_path, threads):
+    """Loads the detector once per worker process."""
+
+    global worker_detector
+    from inference_usbCam_face import TensoflowFaceDector
+    worker_detector = TensoflowFaceDector(model_path,
+                                          intra_op_threads=threads,
+                                          inter_op_threads=1)
+
+
+def process_shard(task):
+    """Processes the frames [start, end) of the input into the shard's files.
+
+    Outputs are written under temporary names and only renamed once the whole
+    shard is done, so a shard interrupted half way is simply redone.
+    return (shard_id, number of frames processed)
+    """
+
+    from inference_video_face import render
+
+    (shard_id, start, end, args) = task
+    outputs = []
+    video_path = None
+    if not args.headless:
+        video_path = shard_path(args.work_dir, shard_id, '.partial.avi')
+        outputs.append((video_path, shard_path(args.work_dir, shard_id, '.avi')))
+    sink = None
+    if args.detections is not None:
+        suffix = detections_suffix(args.detections)
+        detections_path = shard_path(args.work_dir, shard_id, '.partial' + suffix)
+        sink = open_sink(detections_path, min_score_thresh=args.min_score,
+                         sink_format='jsonl' if suffix == '.jsonl' else 'binary')
+        outputs.append((detections_path, shard_path(args.work_dir, shard_id, suffix)))
+
+    render_fn = None
+    if not args.headless:
+        render_fn = functools.partial(render, renderer=args.renderer,
+                                      min_score_thresh=args.min_score)
+    pipeline = VideoPipeline(worker_detector, args.input, video_path, render_fn,
+                             sink=sink,
+                             start_frame=start,
+                             exact_seek=args.exact_seek,
+                             max_frames=end - start,
+                             batch_size=args.batch_size,
+                             report_interval=None)
+    frames = pipeline.run()
+    for partial_path, final_path in outputs:
+        # A shard past the real end of the input (the frame count reported by
+        # the container can be too high) decodes nothing and writes no video.
+        if os.path.exists(partial_path):
+            os.rename(partial_path, final_path)
+    return shard_id, frames
+
+
+def detections_suffix(path):
+    return os.path.splitext(path)[1].lower() or '.bin'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Detect faces in a long video with parallel worker processes, '
+                    'each processing its own range of frames. Progress is '
+                    'checkpointed per shard, re-running the same command resumes.')
+    parser.add_argument('input', help='input video')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='output video (default: <input>_out.avi)')
+    parser.add_argument('--work-dir', default=None,
+                        help='directory for shard outputs and the checkpoint '
+                             '(default: <input>_shards)')
+    parser.add_argument('--shard-frames', type=int, default=1000,
+                        help='frames per shard (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='worker processes (default: %(default)s)')
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help='tensorflow threads per worker (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='frames per inference call (default: %(default)s)')
+    parser.add_argument('--renderer', choices=('pil', 'cv2'), default='pil',
+                        help='box renderer (default: %(default)s)')
+    parser.add_argument('--headless', action='store_true',
+                        help='skip drawing and encoding, only write detections '
+                             '(requires --detections)')
+    parser.add_argument('--detections', default=None,
+                        help='write the detections to this file, .jsonl for json '
+                             'lines, any other extension for the binary format')
+    parser.add_argument('--min-score', type=float, default=.7,
+                        help='minimum score of the drawn and written detections '
+                             '(default: %(default)s)')
+    parser.add_argument('--exact-seek', action='store_true',
+                        help='reach the first frame of each shard by decoding from '
+                             'the start of the input, for codecs whose seeking is not '
+                             'frame accurate (slower)')
+    parser.add_argument('--model', default=PATH_TO_CKPT,
+                        help='frozen graph (default: %(default)s)')
+    args = parser.parse_args()
+    if args.headless and args.detections is None:
+        parser.error('--headless requires --detections')
+
+    logging.basicConfig(level=logging.INFO)
+
+    root = os.path.splitext(args.input)[0]
+    if args.output is None:
+        args.output = root + '_out.avi'
+    if args.work_dir is None:
+        args.work_dir = root + '_shards'
+
+    cap = cv2.VideoCapture(args.input)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    cap.release()
+
+    checkpoint = ShardCheckpoint(args.work_dir, {
+        'input': os.path.abspath(args.input),
+        'total_frames': total_frames,
+        'shard_frames': args.shard_frames,
+        'headless': args.headless,
+        'detections_suffix': detections_suffix(args.detections) if args.detections else None,
+        'min_score': args.min_score,
+        'exact_seek': args.exact_seek,
+    })
+    shards = plan_shards(total_frames, args.shard_frames)
+    pending = [(shard_id, start, end, args) for shard_id, start, end in shards
+               if not checkpoint.is_completed(shard_id)]
+    logging.info('%d frames in %d shards, %d already done',
+                 total_frames, len(shards), len(shards) - len(pending))
+
+    if pending:
+        pool = multiprocessing.Pool(min(args.workers, len(pending)),
+                                    initializer=init_worker,
+                                    initargs=(args.model, args.threads_per_worker))
+        try:
+            for shard_id, frames in pool.imap_unordered(process_shard, pending):
+                checkpoint.mark_completed(shard_id)
+                logging.info('shard %d done (%d frames), %d/%d shards complete',
+                             shard_id, frames, len(checkpoint.completed), len(shards))
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+    shard_ids = [shard_id for shard_id, _, _ in shards]
+    if not args.headless:
+        merge_videos([shard_path(args.work_dir, i, '.avi') for i in shard_ids],
+                     args.output, fps=fps)
+        print('wrote {}'.format(args.output))
+    if args.detections is not None:
+        suffix = detections_suffix(args.detections)
+        merge_files([shard_path(args.work_dir, i, suffix) for i in shard_ids],
+                    args.detections)
+        print('wrote {}'.format(args.detections))
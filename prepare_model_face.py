@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+import argparse
+import os
+
+from utils import model_artifact
+
+
+# Path to frozen detection graph. This is the actual model that is used for the object detection.
+PATH_TO_CKPT = './model/frozen_inference_graph_face.pb'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Strip the frozen graph down to the detection outputs and fold '
+                    'its constants, once. The detector then loads the optimized '
+                    'graph for as long as it is fresh.')
+    parser.add_argument('model', nargs='?', default=PATH_TO_CKPT,
+                        help='frozen graph (default: %(default)s)')
+    args = parser.parse_args()
+
+    output = model_artifact.optimized_path(args.model)
+    metadata = model_artifact.prepare(args.model, output)
+    print('{}: {} nodes, {:.1f} MB -> {}: {} nodes, {:.1f} MB'.format(
+        args.model, metadata['source_nodes'], os.path.getsize(args.model) / 1e6,
+        output, metadata['artifact_nodes'], os.path.getsize(output) / 1e6))
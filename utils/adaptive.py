@@ -0,0 +1,191 @@
+"""Adaptive quality control against a frame rate or latency target.
+
+The cost of a frame depends on the input resolution, on how often the
+detector runs and on how many boxes are drawn.  AdaptiveQualityController
+walks a ladder of quality levels, from full quality to cheapest, watching the
+recent frame timings: it steps down one level while the target is missed and
+steps back up once there is enough headroom, waiting for a full window of
+fresh measurements after each change.  A level that missed the target is
+only retried after a back-off that doubles every time it misses again, so
+that the controller does not oscillate between two neighbouring levels.
+Every change is logged.
+
+Two targets are supported, alone or together:
+
+  target_fps  the mean interval between consecutive frames, i.e. the whole
+              loop including drawing and display, stays under 1 / target_fps.
+  target_p95  the 95th percentile of the time spent in run() stays under
+              this many seconds.
+"""
+
+import collections
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from utils import metrics
+
+
+# (downscale factor, detection interval, maximum boxes drawn), best first.
+DEFAULT_LEVELS = (
+    (1.0, 1, 20),
+    (0.75, 1, 20),
+    (0.75, 2, 20),
+    (0.5, 2, 10),
+    (0.5, 3, 10),
+    (0.35, 4, 5),
+)
+
+_QUALITY_LEVEL = metrics.gauge('face_quality_level',
+                               'Current adaptive quality level, 0 is best.')
+
+
+class AdaptiveQualityController(object):
+  """Wraps a detector, trading quality for speed to meet a target.
+
+  run() keeps the interface of TensoflowFaceDector.run.  Frames are
+  downscaled before inference (boxes are normalized, so they still apply to
+  the full frame), the detector only runs on every detect_every-th frame
+  with the previous detections reused in between, and max_boxes tells the
+  caller how many boxes to draw.
+  """
+
+  def __init__(self,
+               detector,
+               target_fps=None,
+               target_p95=None,
+               levels=DEFAULT_LEVELS,
+               window=30,
+               headroom=.7,
+               max_backoff_windows=64):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible run().
+      target_fps: frame rate to sustain, or None.
+      target_p95: 95th percentile of the run() latency to stay under, in
+        seconds, or None.
+      levels: sequence of (downscale, detect_every, max_boxes) quality levels,
+        best first.
+      window: number of frames measured before each decision.
+      headroom: quality is only raised when the measurements are below this
+        fraction of the targets.
+      max_backoff_windows: longest wait, in windows, before retrying a level
+        that missed the target.
+
+    Raises:
+      ValueError: if neither target is given.
+    """
+    if target_fps is None and target_p95 is None:
+      raise ValueError('Either target_fps or target_p95 is required.')
+    self._detector = detector
+    self._target_period = 1.0 / target_fps if target_fps else None
+    self._target_p95 = target_p95
+    self._levels = tuple(levels)
+    self._window = window
+    self._headroom = headroom
+    self._max_backoff = max_backoff_windows * window
+
+    self._level = 0
+    self._periods = collections.deque(maxlen=window)
+    self._latencies = collections.deque(maxlen=window)
+    self._last_start = None
+    self._frames_since_detection = 0
+    self._detections = None
+    self._resized = None
+    self._frame_count = 0
+    # Per level: back-off in frames, and the frame count it may be retried at.
+    self._backoff = {}
+    self._retry_at = {}
+    _QUALITY_LEVEL.set(0)
+
+  @property
+  def level(self):
+    return self._level
+
+  @property
+  def downscale(self):
+    return self._levels[self._level][0]
+
+  @property
+  def detect_every(self):
+    return self._levels[self._level][1]
+
+  @property
+  def max_boxes(self):
+    """Maximum number of boxes the caller should draw at the current level."""
+    return self._levels[self._level][2]
+
+  def run(self, image):
+    """image: bgr image
+    return (boxes, scores, classes, num_detections)
+    """
+    start = time.time()
+    self._frame_count += 1
+    if self._last_start is not None:
+      self._periods.append(start - self._last_start)
+    self._last_start = start
+
+    if (self._detections is None or
+        self._frames_since_detection + 1 >= self.detect_every):
+      self._detections = self._detector.run(self._downscaled(image))
+      self._frames_since_detection = 0
+    else:
+      self._frames_since_detection += 1
+    detections = self._detections
+
+    self._latencies.append(time.time() - start)
+    if len(self._latencies) >= self._window:
+      self._adjust()
+    return detections
+
+  def run_batch(self, frames, batch_size=None):
+    """Runs run() on each frame in order."""
+    del batch_size  # Each frame is measured and decided on individually.
+    return [self.run(frame) for frame in frames]
+
+  def _downscaled(self, image):
+    scale = self.downscale
+    if scale >= 1.0:
+      return image
+    [h, w] = image.shape[:2]
+    size = (max(int(w * scale), 1), max(int(h * scale), 1))
+    if self._resized is None or self._resized.shape[:2] != (size[1], size[0]):
+      self._resized = np.empty((size[1], size[0]) + image.shape[2:],
+                               dtype=image.dtype)
+    cv2.resize(image, size, dst=self._resized, interpolation=cv2.INTER_AREA)
+    return self._resized
+
+  def _adjust(self):
+    """Steps the quality level down or up according to the last window."""
+    ratios = []
+    if self._target_period is not None and self._periods:
+      ratios.append(np.mean(self._periods) / self._target_period)
+    if self._target_p95 is not None:
+      ratios.append(np.percentile(self._latencies, 95) / self._target_p95)
+    if not ratios:
+      return
+    load = max(ratios)
+    if load > 1.0 and self._level + 1 < len(self._levels):
+      backoff = min(self._backoff.get(self._level, self._window // 2) * 2,
+                    self._max_backoff)
+      self._backoff[self._level] = backoff
+      self._retry_at[self._level] = self._frame_count + backoff
+      self._set_level(self._level + 1, load)
+    elif (load < self._headroom and self._level > 0 and
+          self._frame_count >= self._retry_at.get(self._level - 1, 0)):
+      self._set_level(self._level - 1, load)
+
+  def _set_level(self, level, load):
+    logging.info('quality level %d -> %d (load %.2f of target): downscale '
+                 '%.2f, detect every %d frames, at most %d boxes',
+                 self._level, level, load, *self._levels[level])
+    self._level = level
+    _QUALITY_LEVEL.set(level)
+    # Judge the new level on fresh measurements only.
+    self._periods.clear()
+    self._latencies.clear()
+    self._frames_since_detection = 0
+    self._detections = None
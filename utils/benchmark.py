@@ -0,0 +1,131 @@
+"""Helpers for reproducible per-stage benchmarks.
+
+SyntheticVideoSource produces a deterministic stream of frames with moving
+face-like blobs, so that benchmarks can run offline without any media.
+StageTimer collects per-stage wall times and summarizes them as percentiles.
+"""
+
+import collections
+import time
+
+import cv2
+import numpy as np
+
+
+class SyntheticVideoSource(object):
+  """Deterministic, cv2.VideoCapture-like source of synthetic frames.
+
+  Frames are pre-rendered once and stored JPEG encoded, read() decodes them
+  again, so that the decode stage of a benchmark does real work comparable
+  to decoding a compressed video.
+  """
+
+  def __init__(self, width=1280, height=720, num_frames=300, num_faces=4,
+               num_distinct_frames=30, seed=0):
+    """Constructor.
+
+    Args:
+      width: frame width in pixels.
+      height: frame height in pixels.
+      num_frames: number of frames returned before read() reports the end.
+      num_faces: number of moving skin colored ellipses per frame.
+      num_distinct_frames: number of distinct frames rendered, the stream
+        cycles over them.
+      seed: seed of the random generator, for reproducible frames.
+    """
+    rng = np.random.RandomState(seed)
+    positions = rng.uniform([0.1, 0.1], [0.9, 0.9], size=(num_faces, 2))
+    velocities = rng.uniform(-0.01, 0.01, size=(num_faces, 2))
+    sizes = rng.uniform(0.04, 0.12, size=num_faces) * min(width, height)
+    background = rng.randint(0, 256, size=(height // 8 + 1, width // 8 + 1, 3))
+    background = cv2.resize(background.astype(np.uint8), (width, height))
+
+    self._encoded = []
+    for i in range(num_distinct_frames):
+      frame = background.copy()
+      centers = (positions + i * velocities) % 1.0
+      for (cy, cx), size in zip(centers, sizes):
+        cv2.ellipse(frame, (int(cx * width), int(cy * height)),
+                    (int(size * 0.75), int(size)), 0, 0, 360,
+                    (120, 160, 220), -1)
+      self._encoded.append(cv2.imencode('.jpg', frame)[1])
+    self._num_frames = num_frames
+    self._index = 0
+
+  def read(self):
+    if self._index >= self._num_frames:
+      return False, None
+    encoded = self._encoded[self._index % len(self._encoded)]
+    self._index += 1
+    return True, cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+  def release(self):
+    pass
+
+
+def percentile_summary(samples, percentiles=(50, 90, 95, 99)):
+  """Summarizes durations in seconds as milliseconds.
+
+  Returns:
+    a dict with count, mean, std, min, max and the requested percentiles
+    ('p50', ...), all in milliseconds.
+  """
+  samples_ms = np.asarray(samples, dtype=np.float64) * 1000.
+  if not samples_ms.size:
+    return {'count': 0}
+  summary = collections.OrderedDict([
+      ('count', int(samples_ms.size)),
+      ('mean', float(samples_ms.mean())),
+      ('std', float(samples_ms.std())),
+      ('min', float(samples_ms.min())),
+      ('max', float(samples_ms.max())),
+  ])
+  for p, value in zip(percentiles, np.percentile(samples_ms, percentiles)):
+    summary['p{}'.format(p)] = float(value)
+  return summary
+
+
+class StageTimer(object):
+  """Collects wall times per named stage.
+
+  Usage:
+    timer = StageTimer()
+    with timer.time('inference'):
+      ...
+  """
+
+  def __init__(self):
+    self._samples = collections.OrderedDict()
+    self.enabled = True
+
+  def time(self, stage):
+    return _StageContext(self, stage)
+
+  def add(self, stage, seconds):
+    if self.enabled:
+      self._samples.setdefault(stage, []).append(seconds)
+
+  def reset(self):
+    self._samples.clear()
+
+  def summary(self):
+    """Returns an ordered dict of stage -> percentile_summary()."""
+    return collections.OrderedDict(
+        (stage, percentile_summary(samples))
+        for stage, samples in self._samples.items())
+
+
+class _StageContext(object):
+
+  def __init__(self, timer, stage):
+    self._timer = timer
+    self._stage = stage
+    self._start = None
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self._timer.add(self._stage, time.time() - self._start)
+    return False
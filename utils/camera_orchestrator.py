@@ -0,0 +1,331 @@
+"""Asyncio orchestration of many live cameras around one shared detector.
+
+One process per camera loads one model per camera and leaves the cameras
+competing for the CPU without any notion of fairness.  CameraOrchestrator
+instead runs every capture as a coroutine of one event loop (the blocking
+OpenCV calls run on a thread pool) and feeds a single detector:
+
+  - every source keeps only its newest frame, so a camera that cannot be
+    served in time drops frames instead of accumulating lag;
+  - a source can be rate limited to max_fps; the frames in between are
+    grabbed but not decoded;
+  - a source that fails to open or stops delivering is reopened, with an
+    exponential back-off between attempts;
+  - the detector takes at most one frame per source per batch, oldest
+    capture first, so every camera gets its turn and the frame closest to
+    missing its deadline goes first.  When fewer frames than batch_size are
+    ready, it waits up to max_wait for more to fill the batch.
+
+The per-source frame rate, lag (capture to detections) and dropped frames
+are logged periodically and exported as metrics.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+from concurrent import futures
+
+import cv2
+
+from utils import metrics
+
+
+CameraSource = collections.namedtuple('CameraSource', ['name', 'url', 'max_fps'])
+CameraSource.__new__.__defaults__ = (None,)
+
+
+class _SourceState(object):
+  """Newest frame and statistics of one source."""
+
+  def __init__(self, source):
+    self.source = source
+    self.image = None
+    self.timestamp = None
+    self.sequence = -1
+    self.fresh = False
+    self.ended = False
+    self.connected = False
+
+    self.frames_captured = 0
+    self.frames_processed = 0
+    self.frames_dropped = 0
+    self.reconnects = 0
+    self.fps = 0.0
+    self.lag = 0.0
+    self.max_lag = 0.0
+
+    self._window_frames = 0
+    self._window_lag = 0.0
+    self._window_max_lag = 0.0
+
+    labels = {'source': source.name}
+    self._dropped_counter = metrics.counter(
+        'face_source_frames_dropped_total',
+        'Frames of a source replaced by a newer one before being detected.',
+        labels=labels)
+    self._lag_histogram = metrics.histogram(
+        'face_source_lag_seconds',
+        'Time from capturing a frame to having its detections.',
+        labels=labels)
+    self._fps_gauge = metrics.gauge('face_source_fps',
+                                    'Frames processed per second.',
+                                    labels=labels)
+    metrics.gauge('face_source_connected', 'Whether the source is open.',
+                  labels=labels).set_function(lambda: float(self.connected))
+
+  def publish(self, image, timestamp):
+    if self.fresh:
+      self.frames_dropped += 1
+      self._dropped_counter.inc()
+    self.image = image
+    self.timestamp = timestamp
+    self.sequence += 1
+    self.fresh = True
+    self.frames_captured += 1
+
+  def take(self):
+    """Returns the newest (image, timestamp, sequence) and marks it taken."""
+    self.fresh = False
+    return self.image, self.timestamp, self.sequence
+
+  def record(self, lag):
+    self.frames_processed += 1
+    self._window_frames += 1
+    self._window_lag += lag
+    self._window_max_lag = max(self._window_max_lag, lag)
+    self._lag_histogram.observe(lag)
+
+  def close_window(self, seconds):
+    """Turns the measurements since the last call into fps and lag."""
+    self.fps = self._window_frames / seconds if seconds > 0 else 0.0
+    self.lag = (self._window_lag / self._window_frames
+                if self._window_frames else 0.0)
+    self.max_lag = self._window_max_lag
+    self._fps_gauge.set(self.fps)
+    self._window_frames = 0
+    self._window_lag = 0.0
+    self._window_max_lag = 0.0
+
+  def stats(self):
+    return {
+        'source': self.source.name,
+        'connected': self.connected,
+        'fps': self.fps,
+        'lag': self.lag,
+        'max_lag': self.max_lag,
+        'frames_captured': self.frames_captured,
+        'frames_processed': self.frames_processed,
+        'frames_dropped': self.frames_dropped,
+        'reconnects': self.reconnects,
+    }
+
+
+def _release_capture(opening):
+  """Releases the capture opened by a cv2.VideoCapture future, if any."""
+  if not opening.cancelled() and opening.exception() is None:
+    opening.result().release()
+
+
+class CameraOrchestrator(object):
+  """Runs many camera captures concurrently into one shared detector."""
+
+  def __init__(self,
+               detector,
+               sources,
+               on_detections=None,
+               batch_size=8,
+               max_wait=.01,
+               reconnect=True,
+               reconnect_delay=1.0,
+               max_reconnect_delay=30.0,
+               report_interval=10.0):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible
+        run_batch().
+      sources: CameraSource tuples (name, url, max_fps); url is anything
+        cv2.VideoCapture opens, max_fps None means no rate limit.
+      on_detections: called on the event loop as on_detections(name,
+        sequence, timestamp, image, detections) for every processed frame;
+        it must not block.
+      batch_size: maximum number of frames per inference call.
+      max_wait: seconds to wait for more sources to fill a batch.
+      reconnect: reopen sources that fail or end.  If False, a source that
+        ends is finished, and run() returns once all sources are.
+      reconnect_delay: first delay before reopening a source, doubled after
+        every failed attempt.
+      max_reconnect_delay: longest delay between reopening attempts.
+      report_interval: seconds between per-source reports in the log, None
+        disables them.
+
+    Raises:
+      ValueError: if two sources have the same name.
+    """
+    names = [source.name for source in sources]
+    if len(set(names)) != len(names):
+      raise ValueError('Source names must be unique.')
+    self._detector = detector
+    self._states = [_SourceState(source) for source in sources]
+    self._on_detections = on_detections
+    self._batch_size = batch_size
+    self._max_wait = max_wait
+    self._reconnect = reconnect
+    self._reconnect_delay = reconnect_delay
+    self._max_reconnect_delay = max_reconnect_delay
+    self._report_interval = report_interval
+    self._stopping = False
+    self._frame_ready = None
+    self._window_start = None
+
+  def stats(self):
+    """Returns a list of per-source statistics dicts."""
+    return [state.stats() for state in self._states]
+
+  def stop(self):
+    """Makes run() return; safe to call from the event loop only."""
+    self._stopping = True
+    if self._frame_ready is not None:
+      self._frame_ready.set()
+
+  async def run(self, duration=None):
+    """Captures and detects until stopped, duration elapses, or all sources end.
+
+    Returns:
+      the per-source statistics, see stats(); fps and lag cover the time since
+      the last report.
+    """
+    self._frame_ready = asyncio.Event()
+    self._window_start = time.time()
+    capture_executor = futures.ThreadPoolExecutor(max(len(self._states), 1))
+    inference_executor = futures.ThreadPoolExecutor(1)
+    captures = [
+        asyncio.ensure_future(self._capture(state, capture_executor))
+        for state in self._states]
+    detect = asyncio.ensure_future(self._detect(inference_executor))
+    report = None
+    if self._report_interval:
+      report = asyncio.ensure_future(self._report())
+    try:
+      await asyncio.wait([detect], timeout=duration)
+    finally:
+      self.stop()
+      for task in captures + ([report] if report else []):
+        task.cancel()
+      await asyncio.gather(*(captures + [detect] + ([report] if report else [])),
+                           return_exceptions=True)
+      capture_executor.shutdown(wait=False)
+      inference_executor.shutdown(wait=True)
+      self._close_windows()
+    return self.stats()
+
+  async def _capture(self, state, executor):
+    source = state.source
+    interval = 1.0 / source.max_fps if source.max_fps else 0.0
+    delay = self._reconnect_delay
+    try:
+      while not self._stopping:
+        opening = executor.submit(cv2.VideoCapture, source.url)
+        try:
+          cap = await asyncio.wrap_future(opening)
+        except asyncio.CancelledError:
+          # The source may still finish opening after the cancellation.
+          opening.add_done_callback(_release_capture)
+          raise
+        # The last blocking call on cap, which may outlive a cancellation.
+        call = None
+        try:
+          if cap.isOpened():
+            state.connected = True
+            logging.info('%s: connected', source.name)
+            next_due = 0.0
+            while not self._stopping:
+              if time.time() < next_due:
+                # Rate limited: keep the stream drained without decoding.
+                call = executor.submit(cap.grab)
+                if not await asyncio.wrap_future(call):
+                  break
+                continue
+              call = executor.submit(cap.read)
+              ret, image = await asyncio.wrap_future(call)
+              if not ret:
+                break
+              now = time.time()
+              next_due = now + interval
+              delay = self._reconnect_delay
+              state.publish(image, now)
+              self._frame_ready.set()
+        finally:
+          # Always release the source, also when cancelled (e.g. at shutdown),
+          # but not while a read is still running on it.
+          if call is None:
+            cap.release()
+          else:
+            call.add_done_callback(lambda unused_call, cap=cap: cap.release())
+        state.connected = False
+        if self._stopping or not self._reconnect:
+          break
+        state.reconnects += 1
+        logging.warning('%s: no frames, reconnecting in %.1fs',
+                        source.name, delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, self._max_reconnect_delay)
+    finally:
+      state.connected = False
+      state.ended = True
+      self._frame_ready.set()
+
+  def _ready(self):
+    return [state for state in self._states if state.fresh]
+
+  async def _detect(self, executor):
+    loop = asyncio.get_event_loop()
+    while not self._stopping:
+      # Check before waiting: the event may have been consumed by a batch
+      # that finished after the last source ended.
+      ready = self._ready()
+      if not ready:
+        if all(state.ended for state in self._states):
+          return
+        await self._frame_ready.wait()
+        self._frame_ready.clear()
+        continue
+      if len(ready) < min(self._batch_size, len(self._states)):
+        # Give the other cameras a moment to join the batch.
+        await asyncio.sleep(self._max_wait)
+        ready = self._ready()
+      # Oldest capture first: fair, since a source has at most one frame.
+      ready.sort(key=lambda state: state.timestamp)
+      batch = ready[:self._batch_size]
+      if len(ready) > len(batch):
+        self._frame_ready.set()
+      taken = [state.take() for state in batch]
+      detections = await loop.run_in_executor(
+          executor, self._detector.run_batch,
+          [image for image, _, _ in taken], self._batch_size)
+      done = time.time()
+      for state, (image, timestamp, sequence), frame_detections in zip(
+          batch, taken, detections):
+        state.record(done - timestamp)
+        if self._on_detections is not None:
+          self._on_detections(state.source.name, sequence, timestamp, image,
+                              frame_detections)
+
+  def _close_windows(self):
+    now = time.time()
+    for state in self._states:
+      state.close_window(now - self._window_start)
+    self._window_start = now
+
+  async def _report(self):
+    while True:
+      await asyncio.sleep(self._report_interval)
+      self._close_windows()
+      for state in self._states:
+        logging.info('%s: %.1f fps, lag %.0f ms (max %.0f ms), %d dropped, '
+                     '%d reconnects%s', state.source.name, state.fps,
+                     1000 * state.lag, 1000 * state.max_lag,
+                     state.frames_dropped, state.reconnects,
+                     '' if state.connected else ', disconnected')
@@ -0,0 +1,186 @@
+"""Tests for utils.camera_orchestrator, with fake cameras."""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from unittest import mock
+import numpy as np
+
+from utils import camera_orchestrator
+from utils import capture  # pylint: disable=unused-import
+from utils import metrics
+from utils.camera_orchestrator import CameraOrchestrator, CameraSource
+from utils.detections import Detections
+
+
+class _FakeCamera(object):
+  """Delivers num_frames frames filled with value, one every interval.
+
+  num_frames None fails to open, -1 never ends.
+  """
+
+  def __init__(self, value, num_frames, interval):
+    self.value = value
+    self.num_frames = num_frames
+    self.interval = interval
+    self.frames_read = 0
+    self.grabs = 0
+    self.released = False
+
+  def isOpened(self):  # pylint: disable=invalid-name
+    return self.num_frames is not None
+
+  def _next(self):
+    delivered = self.frames_read + self.grabs
+    if self.num_frames != -1 and delivered >= self.num_frames:
+      return False
+    time.sleep(self.interval)
+    return True
+
+  def grab(self):
+    if not self._next():
+      return False
+    self.grabs += 1
+    return True
+
+  def read(self):
+    if not self._next():
+      return False, None
+    self.frames_read += 1
+    return True, np.full((4, 6, 3), self.value, dtype=np.uint8)
+
+  def release(self):
+    self.released = True
+
+
+class _FakeCameras(object):
+  """Stands in for cv2.VideoCapture; every url opens as scripted in order."""
+
+  def __init__(self, scripts, interval=.005):
+    self._scripts = dict((url, list(attempts))
+                         for url, attempts in scripts.items())
+    self._interval = interval
+    self._lock = threading.Lock()
+    self.opened = []
+
+  def __call__(self, url):
+    with self._lock:
+      attempts = self._scripts[url]
+      num_frames = attempts.pop(0) if len(attempts) > 1 else attempts[0]
+      camera = _FakeCamera(url, num_frames, self._interval)
+      self.opened.append(camera)
+    return camera
+
+  def wait_released(self, timeout=2.):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      if all(camera.released for camera in self.opened):
+        return True
+      time.sleep(.01)
+    return False
+
+
+class _FakeDetector(object):
+
+  def __init__(self):
+    self.batches = []
+
+  def run_batch(self, frames, batch_size=None):
+    self.batches.append([int(frame[0, 0, 0]) for frame in frames])
+    time.sleep(.01)
+    return [Detections([], [], []).to_raw() for _ in frames]
+
+
+class CameraOrchestratorTest(unittest.TestCase):
+
+  def _run(self, cameras, sources, duration=None, **kwargs):
+    detector = _FakeDetector()
+    detections = []
+    orchestrator = CameraOrchestrator(
+        detector, sources,
+        on_detections=lambda *args: detections.append(args[:2]),
+        report_interval=None, **kwargs)
+    with mock.patch.object(camera_orchestrator.cv2, 'VideoCapture', cameras):
+      stats = asyncio.run(orchestrator.run(duration))
+    return detector, detections, dict((s['source'], s) for s in stats)
+
+  def test_sources_end(self):
+    cameras = _FakeCameras({1: [20], 2: [10]})
+    detector, detections, stats = self._run(
+        cameras, [CameraSource('a', 1), CameraSource('b', 2)],
+        duration=10., batch_size=4, reconnect=False)
+    for batch in detector.batches:
+      # At most one frame per source and batch.
+      self.assertEqual(len(batch), len(set(batch)))
+    for name, num_frames in (('a', 20), ('b', 10)):
+      s = stats[name]
+      self.assertEqual(s['frames_captured'], num_frames)
+      self.assertEqual(s['frames_processed'] + s['frames_dropped'],
+                       num_frames)
+      self.assertFalse(s['connected'])
+      sequences = [seq for source, seq in detections if source == name]
+      self.assertEqual(sequences, sorted(sequences))
+      self.assertEqual(len(sequences), s['frames_processed'])
+    self.assertTrue(cameras.wait_released())
+
+  def test_slow_detector_drops_frames(self):
+    cameras = _FakeCameras({1: [60]}, interval=.001)
+    _, _, stats = self._run(cameras, [CameraSource('a', 1)], duration=10.,
+                            reconnect=False)
+    self.assertGreater(stats['a']['frames_dropped'], 0)
+    self.assertEqual(stats['a']['frames_processed'] +
+                     stats['a']['frames_dropped'], 60)
+
+  def test_reconnects_after_failures(self):
+    cameras = _FakeCameras({1: [None, 3, None, 0]})
+    _, detections, stats = self._run(cameras, [CameraSource('a', 1)],
+                                     duration=.5, reconnect_delay=.01,
+                                     max_reconnect_delay=.02)
+    self.assertGreaterEqual(stats['a']['reconnects'], 3)
+    self.assertEqual(stats['a']['frames_captured'], 3)
+    self.assertEqual(len(detections), stats['a']['frames_processed'])
+    self.assertTrue(cameras.wait_released())
+
+  def test_duration_stops_live_sources(self):
+    cameras = _FakeCameras({1: [-1], 2: [-1]})
+    start = time.time()
+    _, detections, stats = self._run(
+        cameras, [CameraSource('a', 1), CameraSource('b', 2)], duration=.3)
+    self.assertLess(time.time() - start, 2.)
+    self.assertGreater(len(detections), 0)
+    self.assertGreater(stats['a']['frames_processed'], 0)
+    self.assertGreater(stats['b']['frames_processed'], 0)
+    # Also the captures whose read was still running at the cancellation.
+    self.assertTrue(cameras.wait_released())
+
+  def test_max_fps_grabs_without_decoding(self):
+    cameras = _FakeCameras({1: [-1]}, interval=.002)
+    _, _, stats = self._run(cameras, [CameraSource('a', 1, max_fps=10)],
+                            duration=.5)
+    self.assertLessEqual(stats['a']['frames_captured'], 7)
+    self.assertGreater(cameras.opened[0].grabs, 0)
+
+  def test_unique_names(self):
+    with self.assertRaises(ValueError):
+      CameraOrchestrator(_FakeDetector(), [CameraSource('a', 1),
+                                           CameraSource('a', 2)])
+
+  def test_metrics_are_labeled_by_source(self):
+    cameras = _FakeCameras({1: [5]})
+    self._run(cameras, [CameraSource('metrics-a', 1)], duration=10.,
+              reconnect=False)
+    lines = metrics.REGISTRY.exposition().splitlines()
+    source_lines = [line for line in lines
+                    if line.startswith('face_source_frames_dropped_total')]
+    self.assertTrue(source_lines)
+    self.assertTrue(all('source="' in line for line in source_lines))
+    # The latest-frame capture counts its drops in a family of its own.
+    self.assertEqual([line.split()[0] for line in lines
+                      if line.startswith('face_frames_dropped_total')],
+                     ['face_frames_dropped_total'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,111 @@
+"""Latest-frame-wins capture of a live camera on a background thread.
+
+When the consumer is slower than the camera, reading frames synchronously
+lets the driver's buffer fill up, and every frame shown is as old as that
+buffer is long.  LatestFrameCapture decodes on its own thread as fast as the
+camera delivers and keeps only the newest frame; read() returns that frame,
+and frames overwritten before anyone read them are counted as dropped.  The
+consumer always works on the most recent picture, at the price of skipping
+frames.  Meant for live sources: on a video file it skips ahead at decoding
+speed.
+
+Frames cycle through three buffers (being decoded, newest, held by the
+consumer), allocated on the first frames, so steady-state capture allocates
+nothing.
+"""
+
+import threading
+import time
+
+import cv2
+
+from utils import metrics
+
+
+_FRAMES_DROPPED = metrics.counter(
+    'face_frames_dropped_total',
+    'Captured frames replaced by a newer one before being read.')
+
+
+class LatestFrameCapture(object):
+  """Reads a camera on a background thread, keeping only the newest frame."""
+
+  def __init__(self, source):
+    """Constructor, opens the source and starts capturing.
+
+    Args:
+      source: camera id or video file name, as for cv2.VideoCapture.
+    """
+    self._cap = cv2.VideoCapture(source)
+    # Ask the driver not to queue frames behind our back, where supported.
+    self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    self._condition = threading.Condition()
+    self._back = None
+    self._latest = None
+    self._front = None
+    self._timestamp = None
+    self._fresh = False
+    self._ended = False
+    self._stopped = False
+    self._dropped = 0
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  @property
+  def dropped(self):
+    """Number of frames dropped so far."""
+    return self._dropped
+
+  def read(self, timeout=None):
+    """Returns the newest frame not returned yet.
+
+    Blocks until a new frame is captured.  The image is only valid until the
+    next call to read(), whose buffer it shares.
+
+    Args:
+      timeout: seconds to wait for a new frame, None waits forever.
+
+    Returns:
+      (ret, image, timestamp): ret is False once the stream has ended (or on
+      timeout), timestamp is the time.time() at which the frame was captured.
+    """
+    with self._condition:
+      if not self._condition.wait_for(
+          lambda: self._fresh or self._ended, timeout):
+        return False, None, None
+      if not self._fresh:
+        return False, None, None
+      self._latest, self._front = self._front, self._latest
+      self._fresh = False
+      return True, self._front, self._timestamp
+
+  def release(self):
+    """Stops the capture thread and closes the source."""
+    self._stopped = True
+    self._thread.join()
+    self._cap.release()
+
+  def _run(self):
+    while not self._stopped:
+      # Decode into the spare buffer; the binding allocates a new array
+      # instead on the first frames, or when the resolution changes.
+      if self._back is None:
+        ret, image = self._cap.read()
+      else:
+        ret, image = self._cap.read(self._back)
+      timestamp = time.time()
+      if not ret:
+        break
+      with self._condition:
+        if self._fresh:
+          self._dropped += 1
+          _FRAMES_DROPPED.inc()
+        # The new frame becomes the newest, the one it replaces the spare.
+        self._back, self._latest = self._latest, image
+        self._timestamp = timestamp
+        self._fresh = True
+        self._condition.notify()
+    with self._condition:
+      self._ended = True
+      self._condition.notify_all()
@@ -0,0 +1,149 @@
+"""Tests for utils.capture."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+import cv2
+import numpy as np
+from six.moves import queue
+
+from utils import capture
+
+
+def _frame(value, shape=(4, 6, 3)):
+  return np.full(shape, value, dtype=np.uint8)
+
+
+class _FakeCapture(object):
+  """A camera delivering the frames put into it; None ends the stream."""
+
+  def __init__(self):
+    self.frames = queue.Queue()
+    self.reads = 0
+    self.reads_into_out = 0
+    self.released = False
+    self._read_started = threading.Condition()
+
+  def set(self, unused_property, unused_value):
+    return True
+
+  def read(self, out=None):
+    with self._read_started:
+      self.reads += 1
+      self._read_started.notify_all()
+    frame = self.frames.get()
+    if frame is None:
+      self.frames.put(None)
+      return False, None
+    if out is None or out.shape != frame.shape:
+      return True, frame.copy()
+    self.reads_into_out += 1
+    np.copyto(out, frame)
+    return True, out
+
+  def wait_for_reads(self, reads):
+    """Waits until read() was called that many times."""
+    with self._read_started:
+      return self._read_started.wait_for(lambda: self.reads >= reads, 5)
+
+  def release(self):
+    self.released = True
+
+
+class LatestFrameCaptureTest(unittest.TestCase):
+
+  def setUp(self):
+    self.camera = _FakeCapture()
+    with mock.patch.object(capture.cv2, 'VideoCapture',
+                           lambda source: self.camera):
+      self.capture = capture.LatestFrameCapture(0)
+    self.addCleanup(self.capture.release)
+    self.addCleanup(self.camera.frames.put, None)
+    self.assertTrue(self.camera.wait_for_reads(1))
+
+  def _deliver(self, *values):
+    """Hands frames to the capture thread and waits until it took them all."""
+    reads = self.camera.reads
+    for value in values:
+      self.camera.frames.put(_frame(value))
+    # Published once the thread asks for the next frame.
+    self.assertTrue(self.camera.wait_for_reads(reads + len(values)))
+
+  def test_keeps_only_the_newest_frame(self):
+    self._deliver(1, 2, 3)
+    ret, image, timestamp = self.capture.read(timeout=5)
+    self.assertTrue(ret)
+    self.assertEqual(int(image[0, 0, 0]), 3)
+    self.assertLessEqual(timestamp, time.time())
+    self.assertEqual(self.capture.dropped, 2)
+
+  def test_read_waits_for_a_new_frame(self):
+    self._deliver(1)
+    self.assertEqual(int(self.capture.read(timeout=5)[1][0, 0, 0]), 1)
+    self.assertEqual(self.capture.read(timeout=.05), (False, None, None))
+    self._deliver(2)
+    self.assertEqual(int(self.capture.read(timeout=5)[1][0, 0, 0]), 2)
+    self.assertEqual(self.capture.dropped, 0)
+
+  def test_held_frame_is_not_overwritten(self):
+    self._deliver(1)
+    _, held, _ = self.capture.read(timeout=5)
+    self._deliver(2, 3, 4, 5)
+    self.assertEqual(int(held[0, 0, 0]), 1)
+    _, image, _ = self.capture.read(timeout=5)
+    self.assertEqual(int(image[0, 0, 0]), 5)
+    self.assertIsNot(image, held)
+
+  def test_reuses_buffers(self):
+    self._deliver(*range(10))
+    # Three buffers in rotation, allocated on the first frames.
+    self.assertGreaterEqual(self.camera.reads_into_out, 7)
+
+  def test_resolution_change(self):
+    self._deliver(1, 2)
+    reads = self.camera.reads
+    self.camera.frames.put(_frame(3, (2, 3, 3)))
+    self.assertTrue(self.camera.wait_for_reads(reads + 1))
+    _, image, _ = self.capture.read(timeout=5)
+    self.assertEqual(image.shape, (2, 3, 3))
+
+  def test_end_of_stream(self):
+    self._deliver(1)
+    self.camera.frames.put(None)
+    # The last frame is still returned, then the end.
+    self.assertTrue(self.capture.read(timeout=5)[0])
+    self.assertEqual(self.capture.read(timeout=5), (False, None, None))
+
+  def test_release(self):
+    self.camera.frames.put(None)
+    self.capture.release()
+    self.assertTrue(self.camera.released)
+
+
+class VideoFileTest(unittest.TestCase):
+
+  def test_every_frame_is_read_or_dropped(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25.,
+                             (32, 24))
+    for i in range(30):
+      writer.write(_frame(i * 8, (24, 32, 3)))
+    writer.release()
+    video = capture.LatestFrameCapture(path)
+    self.addCleanup(video.release)
+    read = 0
+    while video.read(timeout=5)[0]:
+      read += 1
+    self.assertGreater(read, 0)
+    self.assertEqual(read + video.dropped, 30)
+
+
+if __name__ == '__main__':
+  unittest.main()
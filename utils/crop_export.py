@@ -0,0 +1,256 @@
+"""Export of face crops for downstream recognition.
+
+CropExporter cuts the detected faces out of each frame, with a margin around
+the box, and hands them to a pool of background threads that encode and
+write them in batches, so that disk I/O does not stall the detection loop.
+
+A face standing in front of the camera yields nearly the same crop in every
+frame.  Each crop is fingerprinted with a difference hash (dHash: the signs
+of the horizontal gradients of a tiny gray thumbnail), and a crop is skipped
+when its hash is within max_distance bits of a crop seen in the last
+history_frames frames.  Skipped crops stay in the history, so a face that
+does not change is written once, not once every history_frames frames.
+
+Crops are written as <prefix><frame index>_<face index>.<format>, the face
+index being the rank of the face by decreasing score, as in the detection
+sinks when the same min_score_thresh is used.
+"""
+
+import collections
+import os
+import threading
+
+from concurrent import futures
+
+import cv2
+import numpy as np
+
+from utils import metrics
+from utils.detections import as_detections
+
+
+_CROPS_WRITTEN = metrics.counter('face_crops_written_total',
+                                 'Face crops written to disk.')
+_CROPS_SUPPRESSED = metrics.counter(
+    'face_crops_suppressed_total',
+    'Face crops skipped as near-duplicates of a recent crop.')
+
+
+def crop_box(box, height, width, margin):
+  """Returns the pixel (y0, x0, y1, x1) of a normalized box grown by margin.
+
+  Args:
+    box: normalized (ymin, xmin, ymax, xmax).
+    height: image height in pixels.
+    width: image width in pixels.
+    margin: fraction of the box height and width added on every side.
+  """
+  ymin, xmin, ymax, xmax = [float(v) for v in box]
+  dy = (ymax - ymin) * margin
+  dx = (xmax - xmin) * margin
+  y0 = int(max(np.floor((ymin - dy) * height), 0))
+  x0 = int(max(np.floor((xmin - dx) * width), 0))
+  y1 = int(min(np.ceil((ymax + dy) * height), height))
+  x1 = int(min(np.ceil((xmax + dx) * width), width))
+  return y0, x0, y1, x1
+
+
+def difference_hash(image, hash_size=8):
+  """Returns the dHash of an image as a packed uint8 array of hash_size**2 bits.
+
+  Args:
+    image: bgr or gray image.
+    hash_size: the thumbnail is hash_size rows by hash_size + 1 columns.
+  """
+  if image.ndim == 3:
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+  thumbnail = cv2.resize(image, (hash_size + 1, hash_size),
+                         interpolation=cv2.INTER_AREA)
+  return np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1])
+
+
+def hamming_distances(hashes, hash_value):
+  """Returns the number of differing bits between each of hashes and hash_value.
+
+  Args:
+    hashes: [N, B] uint8 array of packed hashes.
+    hash_value: [B] uint8 packed hash.
+  """
+  return np.unpackbits(np.bitwise_xor(hashes, hash_value), axis=-1).sum(axis=-1)
+
+
+class CropExporter(object):
+  """Writes the detected faces of a stream of frames as image files."""
+
+  def __init__(self,
+               output_dir,
+               min_score_thresh=.7,
+               margin=.2,
+               image_format='jpg',
+               prefix='',
+               hash_size=8,
+               max_distance=6,
+               history_frames=5,
+               batch_size=16,
+               num_workers=2,
+               max_pending_batches=8):
+    """Constructor, creates output_dir if needed.
+
+    Args:
+      output_dir: directory the crops are written to.
+      min_score_thresh: faces scoring at or below this are not exported.
+      margin: fraction of the box height and width added on every side.
+      image_format: 'jpg' or 'png'.
+      prefix: prepended to every file name, e.g. a camera name.
+      hash_size: dHash thumbnail size, the hash has hash_size**2 bits.
+      max_distance: crops whose hash differs from a recent one by at most this
+        many bits are skipped; negative disables the suppression.
+      history_frames: number of previous frames a crop is compared with.
+      batch_size: number of crops encoded and written per background task.
+      num_workers: number of background writer threads.
+      max_pending_batches: add() blocks while this many batches wait to be
+        written, so memory stays bounded when the disk cannot keep up.
+
+    Raises:
+      ValueError: if image_format is not supported.
+    """
+    if image_format not in ('jpg', 'png'):
+      raise ValueError('Unsupported crop format: {}'.format(image_format))
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+    self._output_dir = output_dir
+    self._min_score_thresh = min_score_thresh
+    self._margin = margin
+    self._extension = '.' + image_format
+    self._prefix = prefix
+    self._hash_size = hash_size
+    self._max_distance = max_distance
+    self._history = collections.deque(maxlen=history_frames)
+    self._batch_size = batch_size
+    self._executor = futures.ThreadPoolExecutor(num_workers)
+    self._slots = threading.BoundedSemaphore(max_pending_batches)
+    self._pending = []
+    self._lock = threading.Lock()
+    self._futures = set()
+    self._error = None
+    self.written = 0
+    self.suppressed = 0
+
+  def stats(self):
+    """Returns a dict with the number of exported and suppressed crops."""
+    return {'written': self.written, 'suppressed': self.suppressed}
+
+  def add(self, frame_index, image, detections):
+    """Cuts the faces of one frame out and queues them for writing.
+
+    Must be called before anything is drawn onto image.  The crops are
+    copied, so image may be reused as soon as add() returns.
+
+    Args:
+      frame_index: index of the frame, used in the file names.
+      image: the bgr frame.
+      detections: a utils.detections.Detections, or a (boxes, scores, classes,
+        num_detections) tuple as returned by TensoflowFaceDector.run.
+
+    Returns:
+      the number of crops queued.
+
+    Raises:
+      the first error raised by a background write.
+    """
+    self._raise_error()
+    faces = as_detections(detections, self._min_score_thresh)
+    [h, w] = image.shape[:2]
+    hashes = []
+    queued = 0
+    for index, box in enumerate(faces.boxes):
+      y0, x0, y1, x1 = crop_box(box, h, w, self._margin)
+      if y1 <= y0 or x1 <= x0:
+        continue
+      crop = image[y0:y1, x0:x1]
+      hash_value = difference_hash(crop, self._hash_size)
+      duplicate = self._is_duplicate(hash_value)
+      hashes.append(hash_value)
+      if duplicate:
+        self.suppressed += 1
+        _CROPS_SUPPRESSED.inc()
+        continue
+      name = '{}{:08d}_{:02d}{}'.format(self._prefix, frame_index, index,
+                                        self._extension)
+      self._pending.append((os.path.join(self._output_dir, name), crop.copy()))
+      queued += 1
+    self._history.append(np.array(hashes, dtype=np.uint8).reshape(
+        (len(hashes), (self._hash_size ** 2 + 7) // 8)))
+    if len(self._pending) >= self._batch_size:
+      self.flush(wait=False)
+    return queued
+
+  def flush(self, wait=True):
+    """Submits the queued crops for writing.
+
+    Args:
+      wait: also wait until everything submitted so far is written.
+
+    Raises:
+      the first error raised by a background write.
+    """
+    if self._pending:
+      self._slots.acquire()
+      batch, self._pending = self._pending, []
+      future = self._executor.submit(self._write_batch, batch)
+      with self._lock:
+        self._futures.add(future)
+      future.add_done_callback(self._on_done)
+    if wait:
+      with self._lock:
+        submitted = list(self._futures)
+      futures.wait(submitted)
+    self._raise_error()
+
+  def close(self):
+    """Writes the remaining crops and stops the writer threads."""
+    try:
+      self.flush(wait=True)
+    finally:
+      self._executor.shutdown(wait=True)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+    return False
+
+  def _is_duplicate(self, hash_value):
+    if self._max_distance < 0:
+      return False
+    for hashes in self._history:
+      if (len(hashes) and
+          hamming_distances(hashes, hash_value).min() <= self._max_distance):
+        return True
+    return False
+
+  def _write_batch(self, batch):
+    for path, crop in batch:
+      ok, encoded = cv2.imencode(self._extension, crop)
+      if not ok:
+        raise IOError('Could not encode crop {}'.format(path))
+      with open(path, 'wb') as f:
+        f.write(encoded.tobytes())
+    return len(batch)
+
+  def _on_done(self, future):
+    error = future.exception()
+    with self._lock:
+      self._futures.discard(future)
+      if error is None:
+        self.written += future.result()
+      elif self._error is None:
+        self._error = error
+    self._slots.release()
+    if error is None:
+      _CROPS_WRITTEN.inc(future.result())
+
+  def _raise_error(self):
+    if self._error is not None:
+      raise self._error
@@ -0,0 +1,110 @@
+"""Tests for utils.crop_export."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils import crop_export
+from utils.detections import Detections
+
+
+def _textured_image(seed, shape=(64, 64, 3)):
+  return np.random.RandomState(seed).randint(0, 256, shape).astype(np.uint8)
+
+
+class CropBoxTest(unittest.TestCase):
+
+  def test_adds_the_margin(self):
+    self.assertEqual(crop_export.crop_box([.4, .2, .6, .4], 100, 200, .5),
+                     (30, 20, 70, 100))
+
+  def test_clips_to_the_image(self):
+    self.assertEqual(crop_export.crop_box([0., .9, .5, 1.], 100, 100, .2),
+                     (0, 88, 60, 100))
+
+  def test_rounds_outwards(self):
+    self.assertEqual(crop_export.crop_box([.105, .105, .2, .2], 10, 10, 0.),
+                     (1, 1, 2, 2))
+
+
+class DifferenceHashTest(unittest.TestCase):
+
+  def test_size(self):
+    self.assertEqual(crop_export.difference_hash(_textured_image(0)).shape,
+                     (8,))
+    self.assertEqual(
+        crop_export.difference_hash(_textured_image(0), hash_size=4).shape,
+        (2,))
+
+  def test_near_duplicates_are_close(self):
+    image = _textured_image(0)
+    hash_value = crop_export.difference_hash(image)
+    brighter = crop_export.difference_hash(
+        np.clip(image.astype(np.int32) + 10, 0, 255).astype(np.uint8))
+    other = crop_export.difference_hash(_textured_image(1))
+    hashes = np.stack([brighter, other])
+    distances = crop_export.hamming_distances(hashes, hash_value)
+    self.assertLessEqual(distances[0], 6)
+    self.assertGreater(distances[1], 6)
+
+  def test_hamming_distances(self):
+    hashes = np.array([[0, 0], [255, 1]], dtype=np.uint8)
+    distances = crop_export.hamming_distances(
+        hashes, np.array([0, 0], dtype=np.uint8))
+    self.assertEqual(distances.tolist(), [0, 9])
+
+
+class CropExporterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_skips_near_duplicates(self):
+    faces = Detections([[.25, .25, .75, .75]], [.9], [1])
+    image = _textured_image(0, (128, 128, 3))
+    with crop_export.CropExporter(self.directory, margin=0.,
+                                  history_frames=2,
+                                  batch_size=1) as exporter:
+      self.assertEqual(exporter.add(0, image, faces), 1)
+      self.assertEqual(exporter.add(1, image, faces), 0)
+      self.assertEqual(exporter.add(2, _textured_image(1, (128, 128, 3)),
+                                    faces), 1)
+      # Frames without faces, and low scores, only age the history.
+      exporter.add(3, image, Detections([[.25, .25, .75, .75]], [.1], [1]))
+      exporter.add(4, image, Detections([], [], []))
+      self.assertEqual(exporter.add(5, image, faces), 1)
+    self.assertEqual(exporter.stats(), {'written': 3, 'suppressed': 1})
+    self.assertEqual(sorted(os.listdir(self.directory)),
+                     ['00000000_00.jpg', '00000002_00.jpg', '00000005_00.jpg'])
+
+  def test_without_suppression(self):
+    faces = Detections([[.25, .25, .75, .75]], [.9], [1])
+    image = _textured_image(0, (128, 128, 3))
+    with crop_export.CropExporter(self.directory, image_format='png',
+                                  prefix='cam_',
+                                  max_distance=-1) as exporter:
+      exporter.add(0, image, faces)
+      exporter.add(1, image, faces)
+    self.assertEqual(sorted(os.listdir(self.directory)),
+                     ['cam_00000000_00.png', 'cam_00000001_00.png'])
+
+  def test_write_errors_are_raised(self):
+    exporter = crop_export.CropExporter(self.directory, batch_size=1)
+    shutil.rmtree(self.directory)
+    exporter.add(0, _textured_image(0, (128, 128, 3)),
+                 Detections([[.25, .25, .75, .75]], [.9], [1]))
+    with self.assertRaises(IOError):
+      exporter.close()
+    os.makedirs(self.directory)
+
+  def test_unsupported_format(self):
+    with self.assertRaises(ValueError):
+      crop_export.CropExporter(self.directory, image_format='gif')
+
+
+if __name__ == '__main__':
+  unittest.main()
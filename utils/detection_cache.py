@@ -0,0 +1,236 @@
+"""Content-addressed on-disk cache of raw detections.
+
+Reprocessing an archived clip with a different score threshold does not need
+new inferences: the raw detector output (the top-100 boxes, scores and
+classes) only depends on the decoded frame and on the model.  The cache keys
+every frame by a fast hash of its pixels together with a fingerprint of the
+model file, and stores the raw output in fixed-size slots of memory-mapped
+arrays, so that a warm re-run costs little more than decoding and a lookup;
+thresholds are applied afterwards, when drawing or writing detections.
+
+The store holds at most max_entries frames (see entries_for_size() to derive
+it from a size budget).  Once full, the least recently used slot is reused.
+The key index only reaches disk on flush(), but every slot also records a
+digest of the key it holds, so an index left stale by a crash never serves
+the detections of another frame.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from utils import metrics
+
+
+_HITS = metrics.counter('face_detection_cache_hits_total',
+                        'Frames served from the detection cache.')
+_MISSES = metrics.counter('face_detection_cache_misses_total',
+                          'Frames not found in the detection cache.')
+
+_INDEX_FILE = 'index.json'
+
+# Bytes of the key digest stored with every slot.
+_KEY_DIGEST_BYTES = 16
+
+
+def entries_for_size(size_bytes, max_detections=100):
+  """Returns how many frames a store of size_bytes on disk can hold."""
+  return max(int(size_bytes // (max_detections * 24 + 4 + _KEY_DIGEST_BYTES)),
+             1)
+
+
+def frame_key(image, fingerprint):
+  """Returns the cache key of a decoded frame for a given model."""
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(fingerprint.encode('ascii'))
+  digest.update(np.asarray(image.shape, dtype=np.int64).tobytes())
+  digest.update(np.ascontiguousarray(image).data)
+  return digest.hexdigest()
+
+
+def _key_digest(key):
+  digest = hashlib.blake2b(key.encode('utf-8'),
+                           digest_size=_KEY_DIGEST_BYTES).digest()
+  return np.frombuffer(digest, dtype=np.uint8)
+
+
+class DetectionCache(object):
+  """Memory-mapped store of raw detections keyed by frame_key()."""
+
+  def __init__(self, directory, max_entries=100000, max_detections=100,
+               flush_every=1000):
+    """Constructor.
+
+    Args:
+      directory: directory holding the store, created if needed.  Reopening
+        the same directory reuses the cached detections.
+      max_entries: maximum number of cached frames, i.e. the size limit of
+        the store: each entry takes max_detections * 24 + 20 bytes on disk.
+      max_detections: number of detections stored per frame.
+      flush_every: flush the arrays and the key index to disk after this many
+        new entries, so that a crash loses at most that many.
+
+    Raises:
+      ValueError: if the directory holds a store of a different size.
+    """
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self._directory = directory
+    self._max_entries = max_entries
+    self._max_detections = max_detections
+    self._flush_every = flush_every
+    self._puts_since_flush = 0
+    self._lock = threading.Lock()
+
+    # Maps key -> slot, least recently used first.
+    self._slots = collections.OrderedDict()
+    index_path = os.path.join(directory, _INDEX_FILE)
+    if os.path.exists(index_path):
+      with open(index_path) as f:
+        index = json.load(f)
+      if (index['max_entries'] != max_entries or
+          index['max_detections'] != max_detections):
+        raise ValueError('{} holds a cache of a different size.'.format(
+            directory))
+      self._slots.update((key, slot) for key, slot in index['slots'])
+    # Slots never used yet start at _next_slot; _free_slots are those whose
+    # key turned out to be stale.
+    self._next_slot = max(self._slots.values()) + 1 if self._slots else 0
+    self._free_slots = sorted(set(range(self._next_slot)) -
+                              set(self._slots.values()))
+
+    self._boxes = self._open_array('boxes.f32', np.float32,
+                                   (max_entries, max_detections, 4))
+    self._scores = self._open_array('scores.f32', np.float32,
+                                    (max_entries, max_detections))
+    self._classes = self._open_array('classes.f32', np.float32,
+                                     (max_entries, max_detections))
+    self._num_detections = self._open_array('num_detections.f32', np.float32,
+                                            (max_entries,))
+    self._keys = self._open_array('keys.u8', np.uint8,
+                                  (max_entries, _KEY_DIGEST_BYTES))
+
+  def _open_array(self, name, dtype, shape):
+    path = os.path.join(self._directory, name)
+    mode = 'r+' if os.path.exists(path) else 'w+'
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+  def __len__(self):
+    return len(self._slots)
+
+  def get(self, key):
+    """Returns the cached (boxes, scores, classes, num_detections) or None.
+
+    The arrays have the shapes returned by TensoflowFaceDector.run.
+    """
+    with self._lock:
+      slot = self._slots.pop(key, None)
+      if slot is not None and not np.array_equal(self._keys[slot],
+                                                 _key_digest(key)):
+        # The slot was reused after the index was last flushed.
+        self._free_slots.append(slot)
+        slot = None
+      if slot is None:
+        _MISSES.inc()
+        return None
+      self._slots[key] = slot
+      _HITS.inc()
+      return (np.array(self._boxes[slot:slot + 1]),
+              np.array(self._scores[slot:slot + 1]),
+              np.array(self._classes[slot:slot + 1]),
+              np.array(self._num_detections[slot:slot + 1]))
+
+  def put(self, key, detections):
+    """Stores the raw (boxes, scores, classes, num_detections) of a frame."""
+    (boxes, scores, classes, num_detections) = detections
+    n = self._max_detections
+    with self._lock:
+      slot = self._slots.pop(key, None)
+      if slot is None:
+        if self._free_slots:
+          slot = self._free_slots.pop()
+        elif self._next_slot < self._max_entries:
+          slot = self._next_slot
+          self._next_slot += 1
+        else:
+          _, slot = self._slots.popitem(last=False)
+      # Invalidate the slot first, a crash while it is written leaves it
+      # matching no key.
+      self._keys[slot] = 0
+      self._boxes[slot] = 0
+      self._scores[slot] = 0
+      self._classes[slot] = 0
+      stored = min(n, np.reshape(scores, (-1,)).shape[0])
+      self._boxes[slot, :stored] = np.reshape(boxes, (-1, 4))[:stored]
+      self._scores[slot, :stored] = np.reshape(scores, (-1,))[:stored]
+      self._classes[slot, :stored] = np.reshape(classes, (-1,))[:stored]
+      self._num_detections[slot] = min(float(np.reshape(num_detections,
+                                                        (-1,))[0]), stored)
+      self._keys[slot] = _key_digest(key)
+      self._slots[key] = slot
+      self._puts_since_flush += 1
+      flush = self._puts_since_flush >= self._flush_every
+    if flush:
+      self.flush()
+
+  def flush(self):
+    """Writes the arrays and the key index to disk."""
+    with self._lock:
+      self._puts_since_flush = 0
+      for array in (self._boxes, self._scores, self._classes,
+                    self._num_detections, self._keys):
+        array.flush()
+      index_path = os.path.join(self._directory, _INDEX_FILE)
+      with open(index_path + '.tmp', 'w') as f:
+        json.dump({'max_entries': self._max_entries,
+                   'max_detections': self._max_detections,
+                   'slots': list(self._slots.items())}, f)
+      os.rename(index_path + '.tmp', index_path)
+
+  def close(self):
+    self.flush()
+
+
+class CachedDetector(object):
+  """Wraps a detector, serving frames it has already seen from a cache.
+
+  run() and run_batch() keep the interface of TensoflowFaceDector; only the
+  frames missing from the cache go through the wrapped detector.
+  """
+
+  def __init__(self, detector, cache, fingerprint):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with compatible run() and
+        run_batch() methods.
+      cache: a DetectionCache.
+      fingerprint: fingerprint.model_fingerprint() of the wrapped detector's
+        model, so that another model never reads these entries.
+    """
+    self._detector = detector
+    self._cache = cache
+    self._fingerprint = fingerprint
+
+  def run(self, image):
+    """image: bgr image
+    return (boxes, scores, classes, num_detections)
+    """
+    return self.run_batch([image])[0]
+
+  def run_batch(self, frames, batch_size=16):
+    """Runs the frames missing from the cache as one batch."""
+    keys = [frame_key(frame, self._fingerprint) for frame in frames]
+    results = [self._cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+      detections = self._detector.run_batch([frames[i] for i in missing],
+                                            batch_size=batch_size)
+      for i, frame_detections in zip(missing, detections):
+        self._cache.put(keys[i], frame_detections)
+        results[i] = frame_detections
+    return results
@@ -0,0 +1,145 @@
+"""Tests for utils.detection_cache."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils import detection_cache
+from utils.detections import Detections
+
+
+def _detections(value, num=3):
+  """Raw output of num faces whose boxes and scores are all value."""
+  return Detections(np.full((num, 4), value), np.full(num, value),
+                    np.ones(num)).to_raw()
+
+
+def _scores(detections):
+  """The scores of the faces of cached raw detections."""
+  (_, scores, _, num_detections) = detections
+  return scores[0, :int(num_detections[0])]
+
+
+class _CountingDetector(object):
+
+  def __init__(self):
+    self.frames_run = 0
+
+  def run_batch(self, frames, batch_size=None):
+    self.frames_run += len(frames)
+    return [_detections(float(frame.mean()) / 255.) for frame in frames]
+
+
+class DetectionCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_put_and_get(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=4)
+    self.assertIsNone(cache.get('a'))
+    cache.put('a', _detections(.5, num=7))
+    boxes, scores, classes, num = cache.get('a')
+    self.assertEqual(boxes.shape, (1, 100, 4))
+    self.assertEqual(scores.shape, (1, 100))
+    self.assertEqual(classes.shape, (1, 100))
+    np.testing.assert_allclose(scores[0, :7], .5)
+    np.testing.assert_allclose(scores[0, 7:], 0.)
+    np.testing.assert_allclose(boxes[0, :7], .5)
+    self.assertEqual(num.tolist(), [7.])
+
+  def test_evicts_the_least_recently_used(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    cache.put('a', _detections(.1))
+    cache.put('b', _detections(.2))
+    cache.get('a')
+    cache.put('c', _detections(.3))
+    self.assertEqual(len(cache), 2)
+    self.assertIsNone(cache.get('b'))
+    np.testing.assert_allclose(_scores(cache.get('a')), .1)
+    np.testing.assert_allclose(_scores(cache.get('c')), .3)
+
+  def test_overwrites_an_existing_key_in_place(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    cache.put('a', _detections(.1))
+    cache.put('a', _detections(.4))
+    self.assertEqual(len(cache), 1)
+    np.testing.assert_allclose(_scores(cache.get('a')), .4)
+
+  def test_pads_and_truncates_detections(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2,
+                                           max_detections=5)
+    cache.put('short', _detections(.5, num=2))
+    cache.put('long', _detections(.5, num=50))
+    _, scores, _, num = cache.get('short')
+    np.testing.assert_allclose(scores, [[.5, .5, 0., 0., 0.]])
+    self.assertEqual(num.tolist(), [2.])
+    _, scores, _, num = cache.get('long')
+    self.assertEqual(scores.shape, (1, 5))
+    self.assertEqual(num.tolist(), [5.])
+
+  def test_reopen(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    cache.put('a', _detections(.1))
+    cache.close()
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    np.testing.assert_allclose(_scores(cache.get('a')), .1)
+    with self.assertRaises(ValueError):
+      detection_cache.DetectionCache(self.directory, max_entries=3)
+
+  def test_reopen_after_a_crash(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    cache.put('a', _detections(.1))
+    cache.put('b', _detections(.2))
+    cache.flush()
+    # Evicts a; the process then dies before the index is flushed again.
+    cache.put('c', _detections(.9))
+    del cache
+    cache = detection_cache.DetectionCache(self.directory, max_entries=2)
+    self.assertIsNone(cache.get('a'))
+    self.assertIsNone(cache.get('c'))
+    np.testing.assert_allclose(_scores(cache.get('b')), .2)
+    # The slot of the stale key is reused before any live one is evicted.
+    cache.put('d', _detections(.4))
+    np.testing.assert_allclose(_scores(cache.get('b')), .2)
+    np.testing.assert_allclose(_scores(cache.get('d')), .4)
+
+  def test_entries_for_size(self):
+    self.assertEqual(detection_cache.entries_for_size(2420 * 10), 10)
+    self.assertEqual(detection_cache.entries_for_size(1), 1)
+
+
+class CachedDetectorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_only_missing_frames_are_run(self):
+    cache = detection_cache.DetectionCache(self.directory, max_entries=8)
+    detector = _CountingDetector()
+    cached = detection_cache.CachedDetector(detector, cache, 'model-a')
+    frames = [np.full((4, 4, 3), value, dtype=np.uint8)
+              for value in (10, 20, 30)]
+    first = cached.run_batch(frames[:2])
+    self.assertEqual(detector.frames_run, 2)
+    second = cached.run_batch(frames)
+    self.assertEqual(detector.frames_run, 3)
+    for a, b in zip(first, second):
+      np.testing.assert_allclose(_scores(a), _scores(b))
+
+  def test_keys_depend_on_the_model_and_the_shape(self):
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+    key = detection_cache.frame_key(image, 'model-a')
+    self.assertEqual(key, detection_cache.frame_key(image.copy(), 'model-a'))
+    self.assertNotEqual(key, detection_cache.frame_key(image, 'model-b'))
+    self.assertNotEqual(key, detection_cache.frame_key(
+        image.reshape((6, 4, 3)), 'model-a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,203 @@
+"""Streaming sinks for detections-only output.
+
+Analytics jobs only need the detections, not an annotated video.  The sinks
+below keep the faces above a score threshold and append them to a file in
+buffered bulk writes:
+
+  JsonlDetectionSink   one json object per frame, easy to consume anywhere.
+  BinaryDetectionSink  a compact columnar format, one row per face, written
+                       in chunks of contiguous little-endian numpy columns.
+                       read_binary_detections() loads it back.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from utils.detections import as_detections
+
+
+# Magic and version at the start of every chunk of a binary detection file.
+_BINARY_MAGIC = b'FDET'
+_BINARY_VERSION = 1
+_CHUNK_HEADER = struct.Struct('<4sHI')
+_BINARY_COLUMNS = (
+    ('frame_index', np.dtype('<i8'), ()),
+    ('timestamp', np.dtype('<f8'), ()),
+    ('boxes', np.dtype('<f4'), (4,)),
+    ('scores', np.dtype('<f4'), ()),
+    ('classes', np.dtype('<i4'), ()),
+)
+
+
+def filter_detections(detections, min_score_thresh):
+  """Keeps the faces of one frame scoring above min_score_thresh.
+
+  Args:
+    detections: a utils.detections.Detections, or a (boxes, scores, classes,
+      num_detections) tuple as returned by TensoflowFaceDector.run.
+    min_score_thresh: minimum score of a kept face.
+
+  Returns:
+    (boxes, scores, classes) as [K, 4] float32, [K] float32 and [K] int32
+    arrays.
+  """
+  kept = as_detections(detections, min_score_thresh)
+  return kept.boxes, kept.scores, kept.classes
+
+
+class JsonlDetectionSink(object):
+  """Writes one json line per frame: frame index, timestamp and faces."""
+
+  def __init__(self, path, min_score_thresh=.7, buffer_frames=256):
+    """Constructor.
+
+    Args:
+      path: output file path.
+      min_score_thresh: faces scoring at or below this are not written.
+      buffer_frames: number of frames buffered before a bulk write.
+    """
+    self._file = open(path, 'w')
+    self._min_score_thresh = min_score_thresh
+    self._buffer_frames = buffer_frames
+    self._lines = []
+
+  def write(self, frame_index, timestamp, detections):
+    boxes, scores, classes = filter_detections(detections,
+                                               self._min_score_thresh)
+    self._lines.append(json.dumps({
+        'frame': int(frame_index),
+        'timestamp': float(timestamp),
+        'boxes': np.round(boxes.astype(np.float64), 5).tolist(),
+        'scores': np.round(scores.astype(np.float64), 4).tolist(),
+        'classes': classes.tolist(),
+    }, separators=(',', ':')) + '\n')
+    if len(self._lines) >= self._buffer_frames:
+      self.flush()
+
+  def flush(self):
+    self._file.writelines(self._lines)
+    self._lines = []
+    self._file.flush()
+
+  def close(self):
+    self.flush()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+    return False
+
+
+class BinaryDetectionSink(object):
+  """Writes faces as chunks of contiguous columns, one row per face."""
+
+  def __init__(self, path, min_score_thresh=.7, buffer_rows=4096):
+    """Constructor.
+
+    Args:
+      path: output file path.
+      min_score_thresh: faces scoring at or below this are not written.
+      buffer_rows: number of faces buffered before a chunk is written.
+    """
+    self._file = open(path, 'wb')
+    self._min_score_thresh = min_score_thresh
+    self._buffer_rows = buffer_rows
+    self._columns = dict((name, []) for name, _, _ in _BINARY_COLUMNS)
+    self._num_rows = 0
+
+  def write(self, frame_index, timestamp, detections):
+    boxes, scores, classes = filter_detections(detections,
+                                               self._min_score_thresh)
+    if not len(scores):
+      return
+    self._columns['frame_index'].append(
+        np.full(len(scores), frame_index, dtype=np.int64))
+    self._columns['timestamp'].append(
+        np.full(len(scores), timestamp, dtype=np.float64))
+    self._columns['boxes'].append(boxes)
+    self._columns['scores'].append(scores)
+    self._columns['classes'].append(classes)
+    self._num_rows += len(scores)
+    if self._num_rows >= self._buffer_rows:
+      self.flush()
+
+  def flush(self):
+    if self._num_rows:
+      self._file.write(_CHUNK_HEADER.pack(_BINARY_MAGIC, _BINARY_VERSION,
+                                          self._num_rows))
+      for name, dtype, _ in _BINARY_COLUMNS:
+        column = np.concatenate(self._columns[name]).astype(dtype, copy=False)
+        self._file.write(np.ascontiguousarray(column).tobytes())
+        self._columns[name] = []
+      self._num_rows = 0
+    self._file.flush()
+
+  def close(self):
+    self.flush()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+    return False
+
+
+def read_binary_detections(path):
+  """Loads a file written by BinaryDetectionSink.
+
+  Returns:
+    a dict of column name -> numpy array, one row per face: frame_index [N],
+    timestamp [N], boxes [N, 4], scores [N] and classes [N].
+
+  Raises:
+    ValueError: if the file is not a binary detection file.
+  """
+  chunks = dict((name, []) for name, _, _ in _BINARY_COLUMNS)
+  with open(path, 'rb') as f:
+    data = f.read()
+  offset = 0
+  while offset < len(data):
+    magic, version, num_rows = _CHUNK_HEADER.unpack_from(data, offset)
+    if magic != _BINARY_MAGIC or version != _BINARY_VERSION:
+      raise ValueError('{} is not a binary detection file.'.format(path))
+    offset += _CHUNK_HEADER.size
+    for name, dtype, shape in _BINARY_COLUMNS:
+      count = num_rows * int(np.prod(shape))
+      column = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+      chunks[name].append(column.reshape((num_rows,) + shape))
+      offset += count * dtype.itemsize
+  columns = {}
+  for name, dtype, shape in _BINARY_COLUMNS:
+    columns[name] = (np.concatenate(chunks[name]) if chunks[name] else
+                     np.zeros((0,) + shape, dtype=dtype))
+  return columns
+
+
+def open_sink(path, min_score_thresh=.7, sink_format=None):
+  """Opens a detection sink, picking the format from the file extension.
+
+  Args:
+    path: output file path, '.jsonl' selects json lines, anything else the
+      binary format unless sink_format is given.
+    min_score_thresh: faces scoring at or below this are not written.
+    sink_format: 'jsonl' or 'binary' to override the extension.
+
+  Raises:
+    ValueError: if sink_format is unknown.
+  """
+  if sink_format is None:
+    sink_format = ('jsonl' if os.path.splitext(path)[1].lower() == '.jsonl'
+                   else 'binary')
+  if sink_format == 'jsonl':
+    return JsonlDetectionSink(path, min_score_thresh)
+  if sink_format == 'binary':
+    return BinaryDetectionSink(path, min_score_thresh)
+  raise ValueError('Unknown detection sink format: {}'.format(sink_format))
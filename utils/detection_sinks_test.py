@@ -0,0 +1,98 @@
+"""Tests for utils.detection_sinks."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils import detection_sinks
+from utils.detections import Detections
+
+
+_FRAMES = [
+    (0, 0., Detections([[.1, .2, .3, .4], [.5, .5, .6, .6]],
+                       [.95, .5], [1, 1]).to_raw()),
+    (1, .04, Detections([], [], []).to_raw()),
+    (2, .08, Detections([[.2, .2, .4, .4], [.0, .1, .2, .3]],
+                        [.8, .9], [1, 2]).to_raw()),
+]
+
+
+class DetectionSinksTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_filter_detections(self):
+    boxes, scores, classes = detection_sinks.filter_detections(
+        _FRAMES[2][2], .7)
+    np.testing.assert_allclose(scores, [.9, .8])
+    np.testing.assert_allclose(boxes, [[.0, .1, .2, .3], [.2, .2, .4, .4]])
+    self.assertEqual(classes.tolist(), [2, 1])
+
+  def test_binary_round_trip(self):
+    path = os.path.join(self.directory, 'faces.bin')
+    # A tiny buffer writes several chunks.
+    with detection_sinks.BinaryDetectionSink(path, min_score_thresh=.7,
+                                             buffer_rows=2) as sink:
+      for frame_index, timestamp, detections in _FRAMES:
+        sink.write(frame_index, timestamp, detections)
+    columns = detection_sinks.read_binary_detections(path)
+    self.assertEqual(columns['frame_index'].tolist(), [0, 2, 2])
+    np.testing.assert_allclose(columns['timestamp'], [0., .08, .08])
+    np.testing.assert_allclose(columns['boxes'], [[.1, .2, .3, .4],
+                                                  [.0, .1, .2, .3],
+                                                  [.2, .2, .4, .4]])
+    np.testing.assert_allclose(columns['scores'], [.95, .9, .8])
+    self.assertEqual(columns['classes'].tolist(), [1, 2, 1])
+
+  def test_binary_without_faces(self):
+    path = os.path.join(self.directory, 'faces.bin')
+    with detection_sinks.BinaryDetectionSink(path) as sink:
+      sink.write(0, 0., _FRAMES[1][2])
+    columns = detection_sinks.read_binary_detections(path)
+    self.assertEqual(columns['boxes'].shape, (0, 4))
+    self.assertEqual(columns['frame_index'].shape, (0,))
+
+  def test_read_binary_rejects_other_files(self):
+    path = os.path.join(self.directory, 'faces.jsonl')
+    with open(path, 'w') as f:
+      f.write('{"frame": 0, "timestamp": 0.0}\n')
+    with self.assertRaises(ValueError):
+      detection_sinks.read_binary_detections(path)
+
+  def test_jsonl(self):
+    path = os.path.join(self.directory, 'faces.jsonl')
+    with detection_sinks.JsonlDetectionSink(path, min_score_thresh=.7,
+                                            buffer_frames=2) as sink:
+      for frame_index, timestamp, detections in _FRAMES:
+        sink.write(frame_index, timestamp, detections)
+    with open(path) as f:
+      lines = [json.loads(line) for line in f]
+    self.assertEqual([line['frame'] for line in lines], [0, 1, 2])
+    self.assertEqual(lines[1]['boxes'], [])
+    self.assertEqual(lines[2]['classes'], [2, 1])
+    np.testing.assert_allclose(lines[2]['scores'], [.9, .8])
+    np.testing.assert_allclose(lines[0]['boxes'], [[.1, .2, .3, .4]])
+
+  def test_open_sink_picks_the_format(self):
+    jsonl = detection_sinks.open_sink(os.path.join(self.directory, 'a.JSONL'))
+    binary = detection_sinks.open_sink(os.path.join(self.directory, 'a.bin'))
+    forced = detection_sinks.open_sink(os.path.join(self.directory, 'b.bin'),
+                                       sink_format='jsonl')
+    for sink in (jsonl, binary, forced):
+      sink.close()
+    self.assertIsInstance(jsonl, detection_sinks.JsonlDetectionSink)
+    self.assertIsInstance(binary, detection_sinks.BinaryDetectionSink)
+    self.assertIsInstance(forced, detection_sinks.JsonlDetectionSink)
+    with self.assertRaises(ValueError):
+      detection_sinks.open_sink(os.path.join(self.directory, 'c'),
+                                sink_format='csv')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+"""Compact detection results of one frame.
+
+The detector returns four padded arrays of shape [1, 100, ...], most of
+whose rows are empty slots scoring near zero.  Detections keeps only the
+faces of interest, as contiguous columns (struct of arrays), and applies
+thresholds, top-K selection and the conversion to pixels as whole-array
+operations instead of per-box Python loops.
+"""
+
+import numpy as np
+
+
+class Detections(object):
+  """The faces of one frame as contiguous columns.
+
+  Attributes:
+    boxes: [K, 4] float32 array of normalized (ymin, xmin, ymax, xmax).
+    scores: [K] float32 array, in decreasing order when built by from_raw().
+    classes: [K] int32 array of class ids.
+  """
+
+  __slots__ = ('boxes', 'scores', 'classes')
+
+  def __init__(self, boxes, scores, classes):
+    self.boxes = np.ascontiguousarray(boxes, dtype=np.float32).reshape((-1, 4))
+    self.scores = np.ascontiguousarray(scores, dtype=np.float32).reshape((-1,))
+    self.classes = np.ascontiguousarray(classes, dtype=np.int32).reshape((-1,))
+
+  @classmethod
+  def from_raw(cls, detections, min_score_thresh=None, max_detections=None):
+    """Builds the Detections of one frame from raw detector output.
+
+    Args:
+      detections: a (boxes, scores, classes, num_detections) tuple as returned
+        by TensoflowFaceDector.run, for a single frame.
+      min_score_thresh: if given, only faces scoring above it are kept.
+      max_detections: if given, at most this many faces, the best scoring
+        ones, are kept.
+
+    Returns:
+      a Detections, sorted by decreasing score.
+    """
+    (boxes, scores, classes, _) = detections
+    boxes = np.reshape(boxes, (-1, 4))
+    scores = np.reshape(scores, (-1,))
+    classes = np.reshape(classes, (-1,))
+    if min_score_thresh is not None:
+      keep = np.flatnonzero(scores > min_score_thresh)
+    else:
+      keep = np.arange(scores.shape[0])
+    # The model already sorts by score; merged outputs (e.g. tiles) may not.
+    keep = keep[np.argsort(-scores[keep], kind='stable')]
+    if max_detections is not None:
+      keep = keep[:max_detections]
+    return cls(boxes[keep], scores[keep], classes[keep])
+
+  def __len__(self):
+    return self.scores.shape[0]
+
+  def __repr__(self):
+    return 'Detections({} faces)'.format(len(self))
+
+  def _take(self, keep):
+    return Detections(self.boxes[keep], self.scores[keep], self.classes[keep])
+
+  def filter(self, min_score_thresh):
+    """Returns the faces scoring above min_score_thresh."""
+    return self._take(self.scores > min_score_thresh)
+
+  def top_k(self, k):
+    """Returns the k best scoring faces, by decreasing score."""
+    return self._take(np.argsort(-self.scores, kind='stable')[:k])
+
+  def to_pixels(self, height, width):
+    """Returns the boxes as a [K, 4] int32 array of pixel coordinates.
+
+    Args:
+      height: image height in pixels.
+      width: image width in pixels.
+    """
+    scale = np.array([height, width, height, width], dtype=np.float32)
+    return np.rint(self.boxes * scale).astype(np.int32)
+
+  def to_raw(self):
+    """Returns the (boxes, scores, classes, num_detections) tuple layout.
+
+    The arrays are shaped like the output of TensoflowFaceDector.run, but hold
+    only the kept faces.
+    """
+    return (self.boxes[np.newaxis], self.scores[np.newaxis],
+            self.classes.astype(np.float32)[np.newaxis],
+            np.array([len(self)], dtype=np.float32))
+
+
+def as_detections(detections, min_score_thresh=None):
+  """Returns detections as Detections, converting raw detector output.
+
+  Args:
+    detections: a Detections, or a raw (boxes, scores, classes,
+      num_detections) tuple of one frame.
+    min_score_thresh: if given, only faces scoring above it are kept.
+  """
+  if isinstance(detections, Detections):
+    if min_score_thresh is None:
+      return detections
+    return detections.filter(min_score_thresh)
+  return Detections.from_raw(detections, min_score_thresh)
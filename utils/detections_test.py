@@ -0,0 +1,81 @@
+"""Tests for utils.detections."""
+
+import unittest
+
+import numpy as np
+
+from utils import detections as detections_lib
+
+
+def _raw_detections():
+  return detections_lib.Detections(
+      [[.1, .1, .2, .2], [.3, .3, .5, .5], [.6, .6, .9, .9], [0., 0., 1., 1.]],
+      [.6, .95, .8, .3], [1, 2, 1, 1]).to_raw()
+
+
+class DetectionsTest(unittest.TestCase):
+
+  def test_from_raw_sorts_and_filters(self):
+    faces = detections_lib.Detections.from_raw(_raw_detections(),
+                                               min_score_thresh=.5)
+    self.assertEqual(len(faces), 3)
+    np.testing.assert_allclose(faces.scores, [.95, .8, .6])
+    np.testing.assert_allclose(faces.boxes[0], [.3, .3, .5, .5])
+    self.assertEqual(faces.classes.tolist(), [2, 1, 1])
+    self.assertEqual(faces.boxes.dtype, np.float32)
+    self.assertEqual(faces.classes.dtype, np.int32)
+
+  def test_from_raw_max_detections(self):
+    faces = detections_lib.Detections.from_raw(_raw_detections(),
+                                               max_detections=2)
+    np.testing.assert_allclose(faces.scores, [.95, .8])
+
+  def test_from_raw_without_threshold(self):
+    faces = detections_lib.Detections.from_raw(_raw_detections())
+    np.testing.assert_allclose(faces.scores, [.95, .8, .6, .3])
+
+  def test_filter_and_top_k(self):
+    faces = detections_lib.Detections(
+        [[0, 0, 1, 1], [0, 0, .5, .5], [.5, .5, 1, 1]], [.2, .9, .5], [1, 1, 2])
+    np.testing.assert_allclose(faces.filter(.4).scores, [.9, .5])
+    top = faces.top_k(2)
+    np.testing.assert_allclose(top.scores, [.9, .5])
+    self.assertEqual(top.classes.tolist(), [1, 2])
+
+  def test_to_pixels(self):
+    faces = detections_lib.Detections([[.1, .2, .5, .75]], [.9], [1])
+    self.assertEqual(faces.to_pixels(100, 200).tolist(), [[10, 40, 50, 150]])
+
+  def test_to_raw(self):
+    faces = detections_lib.Detections.from_raw(_raw_detections(), .5)
+    boxes, scores, classes, num = faces.to_raw()
+    self.assertEqual(boxes.shape, (1, 3, 4))
+    self.assertEqual(scores.shape, (1, 3))
+    self.assertEqual(classes.dtype, np.float32)
+    self.assertEqual(num.tolist(), [3.])
+    again = detections_lib.Detections.from_raw((boxes, scores, classes, num))
+    np.testing.assert_allclose(again.boxes, faces.boxes)
+
+  def test_empty(self):
+    faces = detections_lib.Detections([], [], [])
+    self.assertEqual(len(faces), 0)
+    self.assertEqual(faces.boxes.shape, (0, 4))
+    self.assertEqual(faces.to_pixels(10, 10).shape, (0, 4))
+
+
+class AsDetectionsTest(unittest.TestCase):
+
+  def test_passes_detections_through(self):
+    faces = detections_lib.Detections.from_raw(_raw_detections(), .5)
+    self.assertIs(detections_lib.as_detections(faces), faces)
+    np.testing.assert_allclose(
+        detections_lib.as_detections(faces, .7).scores, [.95, .8])
+
+  def test_converts_raw_detections(self):
+    faces = detections_lib.as_detections(_raw_detections(), .7)
+    self.assertIsInstance(faces, detections_lib.Detections)
+    np.testing.assert_allclose(faces.scores, [.95, .8])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,12 @@
+"""Fingerprints identifying the contents of model files."""
+
+import hashlib
+
+
+def model_fingerprint(path, chunk_size=1 << 20):
+  """Returns a hex digest identifying the contents of a model file."""
+  digest = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
@@ -0,0 +1,27 @@
+"""Tests for utils.fingerprint."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import fingerprint
+
+
+class ModelFingerprintTest(unittest.TestCase):
+
+  def test_depends_on_the_contents(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, 'model.pb')
+    with open(path, 'wb') as f:
+      f.write(b'graph')
+    digest = fingerprint.model_fingerprint(path, chunk_size=2)
+    self.assertEqual(digest, fingerprint.model_fingerprint(path))
+    with open(path, 'ab') as f:
+      f.write(b'!')
+    self.assertNotEqual(digest, fingerprint.model_fingerprint(path))
+
+
+if __name__ == '__main__':
+  unittest.main()
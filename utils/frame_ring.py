@@ -0,0 +1,251 @@
+"""Shared-memory ring of frame slots between two processes.
+
+Passing decoded frames through a multiprocessing.Queue pickles every frame,
+which for 1080p costs more than the color conversion.  A FrameRing instead
+preallocates a fixed number of frame slots in one shared memory block.  The
+writer process decodes straight into a free slot (cv2.VideoCapture.read()
+accepts the output array) and publishes it; the reader process gets the slot
+as a numpy view of the same memory and releases it once done, which hands
+the slot back to the writer.  No frame is ever copied or pickled.
+
+The ring has one writer and one reader.  Slots are used round robin, so the
+reader must release frames in the order it got them.  Every published frame
+carries a sequence number, counting from 0, and a capture timestamp.
+
+A FrameRing is created by the parent process and handed to the child
+process as a multiprocessing.Process argument; the semaphores synchronizing
+the two sides can only be shared that way.  Requires Python 3.8 or later.
+"""
+
+import collections
+import multiprocessing
+import os
+import time
+
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from six.moves import queue
+
+
+# Per-slot header: sequence number, height, width, channels (int64) and the
+# capture timestamp (float64).
+_HEADER_FIELDS = 5
+_HEADER_BYTES = _HEADER_FIELDS * 8
+
+# Sequence number published by close_writer(), marks the end of the stream.
+_END_OF_STREAM = -1
+
+RingFrame = collections.namedtuple('RingFrame',
+                                   ['sequence', 'timestamp', 'image', 'slot'])
+
+
+class FrameRing(object):
+  """Fixed-size ring of uint8 frames in shared memory."""
+
+  def __init__(self, num_slots=4, max_frame_bytes=1080 * 1920 * 3):
+    """Constructor, allocates the shared memory.
+
+    Args:
+      num_slots: number of frame slots, i.e. how many frames the writer can
+        be ahead of the reader.
+      max_frame_bytes: size of one slot; frames of any resolution fitting in
+        it can be published.
+    """
+    self._num_slots = num_slots
+    self._max_frame_bytes = max_frame_bytes
+    self._shm = shared_memory.SharedMemory(
+        create=True, size=num_slots * (_HEADER_BYTES + max_frame_bytes))
+    self._owner_pid = os.getpid()
+    self._free = multiprocessing.Semaphore(num_slots)
+    self._filled = multiprocessing.Semaphore(0)
+    self._attach()
+
+  def _attach(self):
+    buf = self._shm.buf
+    headers_size = self._num_slots * _HEADER_BYTES
+    self._header = np.ndarray((self._num_slots, _HEADER_FIELDS - 1),
+                              dtype=np.int64, buffer=buf)
+    self._timestamps = np.ndarray((self._num_slots,), dtype=np.float64,
+                                  buffer=buf,
+                                  offset=(_HEADER_FIELDS - 1) * 8 *
+                                  self._num_slots)
+    self._data = np.ndarray((self._num_slots, self._max_frame_bytes),
+                            dtype=np.uint8, buffer=buf, offset=headers_size)
+    # Local cursors, the writer and the reader each only use their own.
+    self._write_count = 0
+    self._read_count = 0
+    self._release_count = 0
+    self._writing = None
+
+  def __getstate__(self):
+    return {'name': self._shm.name,
+            'num_slots': self._num_slots,
+            'max_frame_bytes': self._max_frame_bytes,
+            'free': self._free,
+            'filled': self._filled}
+
+  def __setstate__(self, state):
+    self._num_slots = state['num_slots']
+    self._max_frame_bytes = state['max_frame_bytes']
+    self._free = state['free']
+    self._filled = state['filled']
+    self._shm = shared_memory.SharedMemory(name=state['name'])
+    self._owner_pid = None
+    self._attach()
+
+  @property
+  def max_frame_bytes(self):
+    return self._max_frame_bytes
+
+  def _slot_view(self, slot, shape):
+    size = int(np.prod(shape))
+    if size > self._max_frame_bytes:
+      raise ValueError('A {} frame does not fit in a {} byte slot.'.format(
+          shape, self._max_frame_bytes))
+    return self._data[slot, :size].reshape(shape)
+
+  # Writer side.
+
+  def begin_write(self, shape, timeout=None):
+    """Returns a writable view of the next free slot.
+
+    Blocks until the reader has released a slot.  Fill the view in place,
+    then call end_write() to publish it.
+
+    Args:
+      shape: (height, width, channels) of the frame.
+      timeout: seconds to wait for a free slot, None waits forever.
+
+    Raises:
+      queue.Full: if no slot was released within timeout.
+      ValueError: if the frame does not fit in a slot.
+    """
+    if not self._free.acquire(timeout=timeout):
+      raise queue.Full
+    slot = self._write_count % self._num_slots
+    try:
+      view = self._slot_view(slot, shape)
+    except ValueError:
+      self._free.release()
+      raise
+    self._header[slot, 1:] = shape
+    self._writing = slot
+    return view
+
+  def end_write(self, timestamp=None):
+    """Publishes the slot returned by begin_write().
+
+    Args:
+      timestamp: capture time of the frame, defaults to now.
+
+    Returns:
+      the sequence number of the frame.
+    """
+    slot = self._writing
+    self._writing = None
+    sequence = self._write_count
+    self._header[slot, 0] = sequence
+    self._timestamps[slot] = time.time() if timestamp is None else timestamp
+    self._write_count += 1
+    self._filled.release()
+    return sequence
+
+  def abort_write(self):
+    """Gives back the slot returned by begin_write() without publishing."""
+    self._writing = None
+    self._free.release()
+
+  def put(self, image, timestamp=None, timeout=None):
+    """Copies an image into the next free slot and publishes it."""
+    np.copyto(self.begin_write(image.shape, timeout), image)
+    return self.end_write(timestamp)
+
+  def close_writer(self, timeout=None):
+    """Tells the reader that no more frames follow."""
+    if not self._free.acquire(timeout=timeout):
+      raise queue.Full
+    slot = self._write_count % self._num_slots
+    self._header[slot, 0] = _END_OF_STREAM
+    self._write_count += 1
+    self._filled.release()
+
+  # Reader side.
+
+  def get(self, timeout=None):
+    """Returns the next published frame as a RingFrame, or None at the end.
+
+    The frame's image is a view of the slot, valid until release().
+
+    Raises:
+      queue.Empty: if no frame was published within timeout.
+    """
+    if not self._filled.acquire(timeout=timeout):
+      raise queue.Empty
+    slot = self._read_count % self._num_slots
+    self._read_count += 1
+    sequence = int(self._header[slot, 0])
+    if sequence == _END_OF_STREAM:
+      self._release_count += 1
+      self._free.release()
+      return None
+    shape = tuple(int(d) for d in self._header[slot, 1:])
+    return RingFrame(sequence, float(self._timestamps[slot]),
+                     self._slot_view(slot, shape), slot)
+
+  def release(self, frame):
+    """Hands the slot of a frame returned by get() back to the writer."""
+    if frame.slot != self._release_count % self._num_slots:
+      raise ValueError('Frames must be released in the order they were got.')
+    self._release_count += 1
+    self._free.release()
+
+  def close(self):
+    """Detaches from the shared memory; the creator also frees it."""
+    self._header = self._timestamps = self._data = None
+    self._shm.close()
+    # A forked child inherits the creator's object, only the creator frees.
+    if self._owner_pid == os.getpid():
+      self._shm.unlink()
+
+
+def run_capture(ring, source, max_frames=None):
+  """Decodes a camera or video file into a FrameRing, until it ends.
+
+  Meant as a multiprocessing.Process target.  Frames are decoded directly
+  into the ring's slots; the end of the stream is published with
+  close_writer().
+
+  Args:
+    ring: the FrameRing, as created by the parent process.
+    source: camera id or video file name.
+    max_frames: stop after this many frames.
+  """
+  cap = cv2.VideoCapture(source)
+  try:
+    # The first frame tells the resolution the following ones are read into.
+    ret, image = cap.read()
+    if ret:
+      ring.put(image)
+      shape = image.shape
+      count = 1
+      while max_frames is None or count < max_frames:
+        view = ring.begin_write(shape)
+        ret, image = cap.read(view)
+        if not ret:
+          ring.abort_write()
+          break
+        if image is view:
+          ring.end_write()
+        else:
+          # The stream changed resolution or format: the binding allocated a
+          # new array and left the slot alone.  Publish the new array, and
+          # read into slots of its shape from now on.
+          ring.abort_write()
+          ring.put(image)
+          shape = image.shape
+        count += 1
+  finally:
+    cap.release()
+    ring.close_writer()
+    ring.close()
@@ -0,0 +1,138 @@
+"""Tests for utils.frame_ring."""
+
+import multiprocessing
+import unittest
+
+from unittest import mock
+import numpy as np
+from six.moves import queue
+
+from utils import frame_ring
+
+
+def _frame(value, shape=(4, 6, 3)):
+  return np.full(shape, value, dtype=np.uint8)
+
+
+def _write_frames(ring, num_frames):
+  for i in range(num_frames):
+    ring.put(_frame(i), timestamp=float(i))
+  ring.close_writer()
+  ring.close()
+
+
+class _FakeCapture(object):
+  """Plays frames like cv2.VideoCapture, reading into out when it fits."""
+
+  def __init__(self, frames):
+    self._frames = list(frames)
+
+  def read(self, out=None):
+    if not self._frames:
+      return False, None
+    frame = self._frames.pop(0)
+    if out is None or out.shape != frame.shape:
+      return True, frame.copy()
+    np.copyto(out, frame)
+    return True, out
+
+  def release(self):
+    pass
+
+
+class FrameRingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.ring = frame_ring.FrameRing(num_slots=2, max_frame_bytes=4 * 6 * 3)
+    self.addCleanup(self.ring.close)
+
+  def test_put_and_get(self):
+    self.assertEqual(self.ring.put(_frame(7), timestamp=1.5), 0)
+    self.assertEqual(self.ring.put(_frame(8, (2, 3, 3))), 1)
+    frame = self.ring.get(timeout=1)
+    self.assertEqual((frame.sequence, frame.timestamp), (0, 1.5))
+    np.testing.assert_array_equal(frame.image, _frame(7))
+    self.ring.release(frame)
+    frame = self.ring.get(timeout=1)
+    self.assertEqual(frame.sequence, 1)
+    np.testing.assert_array_equal(frame.image, _frame(8, (2, 3, 3)))
+    self.ring.release(frame)
+
+  def test_end_of_stream(self):
+    self.ring.put(_frame(1))
+    self.ring.close_writer()
+    self.ring.release(self.ring.get(timeout=1))
+    self.assertIsNone(self.ring.get(timeout=1))
+
+  def test_writer_waits_for_released_slots(self):
+    self.ring.put(_frame(1))
+    self.ring.put(_frame(2))
+    with self.assertRaises(queue.Full):
+      self.ring.put(_frame(3), timeout=.01)
+    self.ring.release(self.ring.get(timeout=1))
+    self.assertEqual(self.ring.put(_frame(3), timeout=1), 2)
+
+  def test_reader_timeout(self):
+    with self.assertRaises(queue.Empty):
+      self.ring.get(timeout=.01)
+
+  def test_frames_must_be_released_in_order(self):
+    self.ring.put(_frame(1))
+    self.ring.put(_frame(2))
+    self.ring.get(timeout=1)
+    second = self.ring.get(timeout=1)
+    with self.assertRaises(ValueError):
+      self.ring.release(second)
+
+  def test_oversized_frame_gives_the_slot_back(self):
+    with self.assertRaises(ValueError):
+      self.ring.put(_frame(1, (5, 6, 3)))
+    self.ring.put(_frame(1))
+    self.ring.put(_frame(2))
+
+  def test_abort_write(self):
+    self.ring.begin_write((4, 6, 3))
+    self.ring.abort_write()
+    with self.assertRaises(queue.Empty):
+      self.ring.get(timeout=.01)
+    self.ring.put(_frame(1))
+    self.ring.put(_frame(2))
+
+  def test_other_process(self):
+    process = multiprocessing.Process(target=_write_frames,
+                                      args=(self.ring, 5))
+    process.start()
+    sequences = []
+    while True:
+      frame = self.ring.get(timeout=10)
+      if frame is None:
+        break
+      self.assertEqual(int(frame.image[0, 0, 0]), frame.sequence)
+      self.assertEqual(frame.timestamp, float(frame.sequence))
+      sequences.append(frame.sequence)
+      self.ring.release(frame)
+    process.join(10)
+    self.assertEqual(process.exitcode, 0)
+    self.assertEqual(sequences, list(range(5)))
+
+
+class RunCaptureTest(unittest.TestCase):
+
+  def test_resolution_change(self):
+    frames = [_frame(1), _frame(2), _frame(3, (2, 3, 3)), _frame(4, (2, 3, 3)),
+              _frame(5)]
+    ring = frame_ring.FrameRing(num_slots=8, max_frame_bytes=4 * 6 * 3)
+    self.addCleanup(ring.close)
+    with mock.patch.object(frame_ring.cv2, 'VideoCapture',
+                           lambda source: _FakeCapture(frames)):
+      with mock.patch.object(ring, 'close'):
+        frame_ring.run_capture(ring, 'camera')
+    for expected in frames:
+      frame = ring.get(timeout=1)
+      np.testing.assert_array_equal(frame.image, expected)
+      ring.release(frame)
+    self.assertIsNone(ring.get(timeout=1))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,172 @@
+"""Local HTTP inference server around one shared detector.
+
+Clients POST single frames to /detect, either encoded (JPEG, PNG, anything
+cv2.imdecode reads) or raw bgr uint8 pixels with the frame size given in the
+X-Frame-Height and X-Frame-Width headers.  Concurrent requests are merged by
+a MicroBatcher, so one warm model serves all clients.  The response is a
+json object with the faces scoring above min_score (a query parameter,
+default .5):
+
+  {"boxes": [[ymin, xmin, ymax, xmax], ...], "scores": [...],
+   "classes": [...]}
+
+Boxes are normalized to [0, 1].  GET /metrics returns the server's metrics
+in the Prometheus text format, GET /healthz returns 200 once the model is
+loaded.  The server listens on a TCP port or on a Unix domain socket.
+"""
+
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+from utils import metrics
+from utils.detection_sinks import filter_detections
+
+
+_REQUESTS = metrics.counter('face_server_requests_total',
+                            'Detection requests received.')
+_REQUEST_ERRORS = metrics.counter('face_server_request_errors_total',
+                                  'Detection requests that failed.')
+_REQUEST_SECONDS = metrics.histogram('face_server_request_seconds',
+                                     'Wall time of one detection request.')
+
+
+class BadRequest(Exception):
+  """Raised for requests that cannot be decoded into a frame."""
+
+
+def decode_frame(body, content_type, headers):
+  """Decodes a request body into a bgr uint8 image.
+
+  Raises:
+    BadRequest: if the body cannot be decoded.
+  """
+  if content_type == 'application/octet-stream':
+    try:
+      height = int(headers['X-Frame-Height'])
+      width = int(headers['X-Frame-Width'])
+    except (KeyError, TypeError, ValueError):
+      raise BadRequest('Raw frames need X-Frame-Height and X-Frame-Width.')
+    if len(body) != height * width * 3:
+      raise BadRequest('Expected {} bytes for a {}x{} bgr frame, got {}.'.format(
+          height * width * 3, width, height, len(body)))
+    return np.frombuffer(body, dtype=np.uint8).reshape((height, width, 3))
+  image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+  if image is None:
+    raise BadRequest('Could not decode the image.')
+  return image
+
+
+class _DetectionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    path = urlparse.urlparse(self.path).path
+    if path == '/metrics':
+      self._respond(200, metrics.REGISTRY.exposition(),
+                    'text/plain; version=0.0.4')
+    elif path == '/healthz':
+      self._respond(200, 'ok\n', 'text/plain')
+    else:
+      self._respond(404, 'not found\n', 'text/plain')
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    url = urlparse.urlparse(self.path)
+    if url.path != '/detect':
+      # The body is not read, it would be parsed as the next request.
+      self._respond(404, 'not found\n', 'text/plain', close=True)
+      return
+    _REQUESTS.inc()
+    with _REQUEST_SECONDS.time():
+      try:
+        length = int(self.headers.get('Content-Length', 0))
+      except ValueError:
+        _REQUEST_ERRORS.inc()
+        self._respond(400, json.dumps({'error': 'Invalid Content-Length.'}),
+                      'application/json', close=True)
+        return
+      body = self.rfile.read(length)
+      try:
+        query = urlparse.parse_qs(url.query)
+        min_score = float(query.get('min_score', ['.5'])[0])
+        content_type = self.headers.get('Content-Type', '').split(';')[0]
+        image = decode_frame(body, content_type, self.headers)
+        detections = self.server.batcher.detect(image)
+      except (BadRequest, ValueError) as e:
+        _REQUEST_ERRORS.inc()
+        self._respond(400, json.dumps({'error': str(e)}), 'application/json')
+        return
+      except Exception as e:  # pylint: disable=broad-except
+        _REQUEST_ERRORS.inc()
+        logging.exception('detection request failed')
+        self._respond(500, json.dumps({'error': str(e)}), 'application/json')
+        return
+      boxes, scores, classes = filter_detections(detections, min_score)
+      self._respond(200, json.dumps({
+          'boxes': np.round(boxes.astype(np.float64), 5).tolist(),
+          'scores': np.round(scores.astype(np.float64), 4).tolist(),
+          'classes': classes.tolist(),
+      }), 'application/json')
+
+  def _respond(self, status, text, content_type, close=False):
+    body = text.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    if close:
+      self.send_header('Connection', 'close')
+      self.close_connection = True
+    self.end_headers()
+    self.wfile.write(body)
+
+  def address_string(self):
+    # Unix domain socket clients have no address.
+    return self.client_address[0] if self.client_address else 'unix'
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class _TCPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def get_request(self):
+    request, _ = socketserver.UnixStreamServer.get_request(self)
+    # BaseHTTPRequestHandler expects a (host, port) like client address.
+    return request, ('unix', 0)
+
+
+def make_server(batcher, port=None, address='127.0.0.1', unix_socket=None):
+  """Creates the HTTP server, call serve_forever() on it to serve.
+
+  Args:
+    batcher: a MicroBatcher wrapping the detector.
+    port: TCP port to listen on, if unix_socket is None.
+    address: address to listen on, defaults to the loopback interface.
+    unix_socket: path of a Unix domain socket to listen on instead of TCP.
+      A stale socket file at that path is removed.
+
+  Raises:
+    ValueError: if neither a port nor a unix_socket is given.
+  """
+  if unix_socket is not None:
+    if os.path.exists(unix_socket):
+      os.remove(unix_socket)
+    server = _UnixServer(unix_socket, _DetectionHandler)
+  elif port is not None:
+    server = _TCPServer((address, port), _DetectionHandler)
+  else:
+    raise ValueError('Either a port or a unix_socket is required.')
+  server.batcher = batcher
+  return server
@@ -0,0 +1,147 @@
+"""Tests for utils.inference_server, over real HTTP connections."""
+
+import json
+import socket
+import threading
+import unittest
+
+import cv2
+import numpy as np
+from six.moves import http_client
+
+from utils import inference_server
+from utils.detections import Detections
+from utils.micro_batcher import MicroBatcher
+
+
+class _FakeDetector(object):
+
+  def __init__(self):
+    self.error = None
+
+  def run_batch(self, frames, batch_size=16, letterbox=False):
+    if self.error is not None:
+      raise self.error
+    return [Detections([[.1, .2, .3, .4], [.5, .5, .6, .6]], [.9, .3],
+                       [1, 1]).to_raw() for _ in frames]
+
+
+class InferenceServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.detector = _FakeDetector()
+    batcher = MicroBatcher(self.detector, max_wait=0.)
+    self.addCleanup(batcher.close)
+    self.server = inference_server.make_server(batcher, port=0)
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.port = self.server.server_address[1]
+
+  def _connection(self):
+    connection = http_client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+    self.addCleanup(connection.close)
+    return connection
+
+  def _request(self, connection, method, path, body=None, headers=None):
+    connection.request(method, path, body, headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+  def _raw_exchange(self, request):
+    """Sends raw bytes and reads until the server closes the connection."""
+    sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+    self.addCleanup(sock.close)
+    sock.sendall(request)
+    data = b''
+    while True:
+      chunk = sock.recv(4096)
+      if not chunk:
+        return data
+      data += chunk
+
+  def test_raw_frame(self):
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+    response, body = self._request(
+        self._connection(), 'POST', '/detect?min_score=.5', image.tobytes(),
+        {'Content-Type': 'application/octet-stream', 'X-Frame-Height': '4',
+         'X-Frame-Width': '6'})
+    self.assertEqual(response.status, 200)
+    result = json.loads(body.decode('utf-8'))
+    self.assertEqual(result['boxes'], [[.1, .2, .3, .4]])
+    self.assertEqual(result['scores'], [.9])
+    self.assertEqual(result['classes'], [1])
+
+  def test_encoded_frame(self):
+    _, encoded = cv2.imencode('.png', np.zeros((4, 6, 3), dtype=np.uint8))
+    response, body = self._request(
+        self._connection(), 'POST', '/detect?min_score=.1', encoded.tobytes(),
+        {'Content-Type': 'image/png'})
+    self.assertEqual(response.status, 200)
+    self.assertEqual(len(json.loads(body.decode('utf-8'))['scores']), 2)
+
+  def test_errors_keep_the_connection_alive(self):
+    connection = self._connection()
+    response, body = self._request(
+        connection, 'POST', '/detect', b'\0' * 10,
+        {'Content-Type': 'application/octet-stream', 'X-Frame-Height': '4',
+         'X-Frame-Width': '6'})
+    self.assertEqual(response.status, 400)
+    self.assertIn('error', json.loads(body.decode('utf-8')))
+    self.assertIsNone(response.getheader('Connection'))
+    response, _ = self._request(connection, 'POST', '/detect', b'not an image',
+                                {'Content-Type': 'image/jpeg'})
+    self.assertEqual(response.status, 400)
+    self.detector.error = RuntimeError('out of memory')
+    _, encoded = cv2.imencode('.png', np.zeros((4, 6, 3), dtype=np.uint8))
+    response, body = self._request(connection, 'POST', '/detect',
+                                   encoded.tobytes(),
+                                   {'Content-Type': 'image/png'})
+    self.assertEqual(response.status, 500)
+    self.assertIn('out of memory', body.decode('utf-8'))
+    response, _ = self._request(connection, 'GET', '/nope')
+    self.assertEqual(response.status, 404)
+    response, body = self._request(connection, 'GET', '/healthz')
+    self.assertEqual((response.status, body), (200, b'ok\n'))
+
+  def test_metrics(self):
+    response, body = self._request(self._connection(), 'GET', '/metrics')
+    self.assertEqual(response.status, 200)
+    self.assertIn(b'face_server_requests_total', body)
+
+  def test_post_to_an_unknown_path_closes_the_connection(self):
+    # The unread body holds what would otherwise be taken for a second request.
+    smuggled = b'GET /healthz HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    data = self._raw_exchange(
+        b'POST /nope HTTP/1.1\r\nHost: localhost\r\n'
+        b'Content-Length: ' + str(len(smuggled)).encode('ascii') +
+        b'\r\n\r\n' + smuggled)
+    self.assertTrue(data.startswith(b'HTTP/1.1 404'))
+    self.assertIn(b'Connection: close', data)
+    self.assertEqual(data.count(b'HTTP/1.1 '), 1)
+
+  def test_invalid_content_length_closes_the_connection(self):
+    data = self._raw_exchange(
+        b'POST /detect HTTP/1.1\r\nHost: localhost\r\n'
+        b'Content-Length: abc\r\n\r\n'
+        b'GET /healthz HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    self.assertTrue(data.startswith(b'HTTP/1.1 400'))
+    self.assertIn(b'Connection: close', data)
+    self.assertEqual(data.count(b'HTTP/1.1 '), 1)
+
+
+class DecodeFrameTest(unittest.TestCase):
+
+  def test_raw_frame_needs_its_size(self):
+    with self.assertRaises(inference_server.BadRequest):
+      inference_server.decode_frame(b'\0' * 72, 'application/octet-stream', {})
+    image = inference_server.decode_frame(
+        b'\0' * 72, 'application/octet-stream',
+        {'X-Frame-Height': '4', 'X-Frame-Width': '6'})
+    self.assertEqual(image.shape, (4, 6, 3))
+
+
+if __name__ == '__main__':
+  unittest.main()
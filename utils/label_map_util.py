@@ -15,11 +15,18 @@
 
 """Label map utility functions."""
 
+import io
 import logging
+import threading
 
-import tensorflow as tf
 from google.protobuf import text_format
-from protos import string_int_label_map_pb2    
+from protos import string_int_label_map_pb2
+
+
+# Category indices by (path, max_num_classes, use_display_name), see
+# load_category_index.
+_CATEGORY_INDEX_CACHE = {}
+_CATEGORY_INDEX_LOCK = threading.Lock()
 
 
 def _validate_label_map(label_map):
@@ -113,17 +120,44 @@ def load_labelmap(path):
   Returns:
     a StringIntLabelMapProto
   """
-  with tf.gfile.GFile(path, 'r') as fid:
+  with io.open(path, 'rb') as fid:
     label_map_string = fid.read()
-    label_map = string_int_label_map_pb2.StringIntLabelMap()
-    try:
-      text_format.Merge(label_map_string, label_map)
-    except text_format.ParseError:
-      label_map.ParseFromString(label_map_string)
+  label_map = string_int_label_map_pb2.StringIntLabelMap()
+  try:
+    text_format.Merge(label_map_string.decode('utf-8'), label_map)
+  except (text_format.ParseError, UnicodeDecodeError):
+    label_map.ParseFromString(label_map_string)
   _validate_label_map(label_map)
   return label_map
 
 
+def load_category_index(path, max_num_classes, use_display_name=True):
+  """Loads a label map into a category index, once per process.
+
+  The index is built on the first call and the same dict is returned by later
+  calls with the same arguments, so that callers can look it up per frame
+  instead of parsing the label map at import time.  Treat it as read only.
+
+  Args:
+    path: path to StringIntLabelMap proto text file.
+    max_num_classes: maximum number of (consecutive) label indices to include.
+    use_display_name: see convert_label_map_to_categories.
+
+  Returns:
+    category_index: a dict of categories keyed by their 'id', see
+      create_category_index.
+  """
+  key = (path, max_num_classes, use_display_name)
+  with _CATEGORY_INDEX_LOCK:
+    category_index = _CATEGORY_INDEX_CACHE.get(key)
+    if category_index is None:
+      categories = convert_label_map_to_categories(
+          load_labelmap(path), max_num_classes, use_display_name)
+      category_index = create_category_index(categories)
+      _CATEGORY_INDEX_CACHE[key] = category_index
+  return category_index
+
+
 def get_label_map_dict(label_map_path):
   """Reads a label map and returns a dictionary of label names to id.
 
@@ -0,0 +1,334 @@
+"""Lightweight metrics for the hot path: counters, gauges and histograms.
+
+Metrics are cheap to update from any thread (a lock and an addition, no I/O)
+and are exported in the Prometheus text exposition format, either served
+from a local HTTP endpoint or written periodically to a file, e.g. for the
+node exporter textfile collector.
+
+Metrics are registered by name (and optional labels) in a registry; asking
+for the same name and labels twice returns the same metric, so modules can
+simply declare the metrics they update at import time:
+
+  INFERENCE_SECONDS = metrics.histogram('face_inference_seconds',
+                                        'Wall time of one sess.run.')
+  with INFERENCE_SECONDS.time():
+    ...
+"""
+
+import bisect
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+
+# Upper bounds, in seconds, of the default latency histogram buckets.
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .075, .1, .25, .5, 1.,
+                   2.5, 5., 10.)
+
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join('{}="{}"'.format(
+      key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in sorted(labels.items())) + '}'
+
+
+def _format_value(value):
+  if math.isinf(value):
+    return '+Inf' if value > 0 else '-Inf'
+  return repr(float(value))
+
+
+class Counter(object):
+  """A monotonically increasing count."""
+
+  type_name = 'counter'
+
+  def __init__(self, name, labels=None):
+    self.name = name
+    self.labels = labels or {}
+    self._value = 0.
+    self._lock = threading.Lock()
+
+  def inc(self, amount=1):
+    with self._lock:
+      self._value += amount
+
+  @property
+  def value(self):
+    return self._value
+
+  def samples(self):
+    yield self.name, self.labels, self._value
+
+
+class Gauge(object):
+  """A value that goes up and down, set directly or read from a callback."""
+
+  type_name = 'gauge'
+
+  def __init__(self, name, labels=None):
+    self.name = name
+    self.labels = labels or {}
+    self._value = 0.
+    self._function = None
+    self._lock = threading.Lock()
+
+  def set(self, value):
+    self._value = value
+
+  def inc(self, amount=1):
+    with self._lock:
+      self._value += amount
+
+  def dec(self, amount=1):
+    self.inc(-amount)
+
+  def set_function(self, function):
+    """Reads the value from function() at export time, e.g. a queue size."""
+    self._function = function
+
+  @property
+  def value(self):
+    if self._function is not None:
+      return self._function()
+    return self._value
+
+  def samples(self):
+    yield self.name, self.labels, self.value
+
+
+class Histogram(object):
+  """Counts observations into fixed, cumulative buckets."""
+
+  type_name = 'histogram'
+
+  def __init__(self, name, labels=None, buckets=DEFAULT_BUCKETS):
+    self.name = name
+    self.labels = labels or {}
+    self._upper_bounds = sorted(buckets)
+    # One count per bucket, plus the implicit +Inf bucket.
+    self._counts = [0] * (len(self._upper_bounds) + 1)
+    self._sum = 0.
+    self._lock = threading.Lock()
+
+  def observe(self, value):
+    index = bisect.bisect_left(self._upper_bounds, value)
+    with self._lock:
+      self._counts[index] += 1
+      self._sum += value
+
+  def time(self):
+    """Returns a context manager observing the wall time of its block."""
+    return _Timer(self)
+
+  @property
+  def count(self):
+    return sum(self._counts)
+
+  def quantile(self, q):
+    """Estimates a quantile by linear interpolation inside its bucket."""
+    with self._lock:
+      counts = list(self._counts)
+    total = sum(counts)
+    if not total:
+      return float('nan')
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+      if count and cumulative + count >= rank:
+        lower = self._upper_bounds[i - 1] if i > 0 else 0.
+        if i == len(self._upper_bounds):
+          return lower
+        upper = self._upper_bounds[i]
+        return lower + (upper - lower) * (rank - cumulative) / count
+      cumulative += count
+    return self._upper_bounds[-1]
+
+  def samples(self):
+    with self._lock:
+      counts = list(self._counts)
+      total_sum = self._sum
+    cumulative = 0
+    for upper_bound, count in zip(self._upper_bounds + [float('inf')],
+                                  counts):
+      cumulative += count
+      labels = dict(self.labels)
+      labels['le'] = _format_value(upper_bound)
+      yield self.name + '_bucket', labels, cumulative
+    yield self.name + '_sum', self.labels, total_sum
+    yield self.name + '_count', self.labels, cumulative
+
+
+class _Timer(object):
+
+  def __init__(self, histogram):
+    self._histogram = histogram
+    self._start = None
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self._histogram.observe(time.time() - self._start)
+    return False
+
+
+class Registry(object):
+  """A named collection of metrics."""
+
+  def __init__(self):
+    self._metrics = collections.OrderedDict()
+    self._help = {}
+    self._lock = threading.Lock()
+
+  def get_or_create(self, metric_class, name, help_text, labels=None,
+                    **kwargs):
+    key = (name, tuple(sorted((labels or {}).items())))
+    with self._lock:
+      metric = self._metrics.get(key)
+      if metric is None:
+        metric = metric_class(name, labels=labels, **kwargs)
+        self._metrics[key] = metric
+        self._help.setdefault(name, help_text)
+      elif not isinstance(metric, metric_class):
+        raise ValueError('Metric {} is already registered as a {}.'.format(
+            name, metric.type_name))
+    return metric
+
+  def exposition(self):
+    """Returns all metrics in the Prometheus text exposition format."""
+    with self._lock:
+      metrics = list(self._metrics.values())
+    lines = []
+    seen = set()
+    for metric in sorted(metrics, key=lambda m: m.name):
+      if metric.name not in seen:
+        seen.add(metric.name)
+        lines.append('# HELP {} {}'.format(metric.name,
+                                           self._help[metric.name]))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type_name))
+      for name, labels, value in metric.samples():
+        lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                      _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=None, registry=REGISTRY):
+  return registry.get_or_create(Counter, name, help_text, labels)
+
+
+def gauge(name, help_text, labels=None, registry=REGISTRY):
+  return registry.get_or_create(Gauge, name, help_text, labels)
+
+
+def histogram(name, help_text, labels=None, buckets=DEFAULT_BUCKETS,
+              registry=REGISTRY):
+  return registry.get_or_create(Histogram, name, help_text, labels,
+                                buckets=buckets)
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  registry = REGISTRY
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    body = self.registry.exposition().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+def start_http_server(port, address='127.0.0.1', registry=REGISTRY):
+  """Serves the metrics on http://address:port/ from a daemon thread.
+
+  Returns:
+    the HTTP server, call shutdown() on it to stop serving.
+  """
+  handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+  server = _ThreadingHTTPServer((address, port), handler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+class PeriodicFileWriter(object):
+  """Writes the metrics to a file every interval seconds from a thread.
+
+  The file is replaced atomically, so readers never see a partial write.
+  """
+
+  def __init__(self, path, interval=10., registry=REGISTRY):
+    self._path = path
+    self._interval = interval
+    self._registry = registry
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def write(self):
+    tmp_path = self._path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      f.write(self._registry.exposition())
+    os.rename(tmp_path, self._path)
+
+  def stop(self):
+    """Stops the thread, after a last write."""
+    self._stop.set()
+    self._thread.join()
+
+  def _run(self):
+    while not self._stop.wait(self._interval):
+      self._write_logged()
+    self._write_logged()
+
+  def _write_logged(self):
+    try:
+      self.write()
+    except (IOError, OSError):
+      logging.exception('failed to write metrics to %s', self._path)
+
+
+def start_exporters(port=None, path=None, interval=10.):
+  """Starts the exporters requested on a command line.
+
+  Args:
+    port: if not None, serve the metrics over HTTP on this local port.
+    path: if not None, write the metrics to this file every interval seconds.
+    interval: seconds between two file writes.
+
+  Returns:
+    a function stopping the exporters, to be called on shutdown.
+  """
+  server = start_http_server(port) if port is not None else None
+  writer = PeriodicFileWriter(path, interval) if path is not None else None
+
+  def stop():
+    if server is not None:
+      server.shutdown()
+    if writer is not None:
+      writer.stop()
+  return stop
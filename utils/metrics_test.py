@@ -0,0 +1,99 @@
+"""Tests for utils.metrics."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import metrics
+
+
+class RegistryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = metrics.Registry()
+
+  def test_same_name_and_labels_return_the_same_metric(self):
+    a = metrics.counter('a_total', 'A.', labels={'x': '1'},
+                        registry=self.registry)
+    self.assertIs(a, metrics.counter('a_total', 'A.', labels={'x': '1'},
+                                     registry=self.registry))
+    self.assertIsNot(a, metrics.counter('a_total', 'A.', labels={'x': '2'},
+                                        registry=self.registry))
+
+  def test_name_registered_with_another_type(self):
+    metrics.counter('a', 'A.', registry=self.registry)
+    with self.assertRaises(ValueError):
+      metrics.gauge('a', 'A.', registry=self.registry)
+
+  def test_exposition(self):
+    metrics.counter('frames_total', 'Frames.', labels={'stage': 'decode'},
+                    registry=self.registry).inc(3)
+    metrics.counter('frames_total', 'Frames.', labels={'stage': 'write'},
+                    registry=self.registry).inc()
+    metrics.gauge('depth', 'Queue "depth".', labels={'queue': 'a"b\\c'},
+                  registry=self.registry).set_function(lambda: 7)
+    self.assertEqual(self.registry.exposition(), '\n'.join([
+        '# HELP depth Queue "depth".',
+        '# TYPE depth gauge',
+        'depth{queue="a\\"b\\\\c"} 7.0',
+        '# HELP frames_total Frames.',
+        '# TYPE frames_total counter',
+        'frames_total{stage="decode"} 3.0',
+        'frames_total{stage="write"} 1.0',
+    ]) + '\n')
+
+  def test_histogram_exposition(self):
+    histogram = metrics.histogram('latency_seconds', 'Latency.',
+                                  labels={'stage': 'infer'},
+                                  buckets=(.1, 1.), registry=self.registry)
+    for value in (.05, .1, .5, 2.):
+      histogram.observe(value)
+    self.assertEqual(self.registry.exposition().splitlines()[2:], [
+        'latency_seconds_bucket{le="0.1",stage="infer"} 2.0',
+        'latency_seconds_bucket{le="1.0",stage="infer"} 3.0',
+        'latency_seconds_bucket{le="+Inf",stage="infer"} 4.0',
+        'latency_seconds_sum{stage="infer"} 2.65',
+        'latency_seconds_count{stage="infer"} 4.0',
+    ])
+
+
+class HistogramTest(unittest.TestCase):
+
+  def test_quantile(self):
+    histogram = metrics.Histogram('h', buckets=(1., 2., 4.))
+    self.assertNotEqual(histogram.quantile(.5), histogram.quantile(.5))
+    for value in (.5, 1.5, 1.5, 3.):
+      histogram.observe(value)
+    self.assertEqual(histogram.count, 4)
+    self.assertAlmostEqual(histogram.quantile(.5), 1.5)
+    self.assertAlmostEqual(histogram.quantile(1.), 4.)
+
+  def test_quantile_in_the_overflow_bucket(self):
+    histogram = metrics.Histogram('h', buckets=(1.,))
+    histogram.observe(10.)
+    self.assertEqual(histogram.quantile(.99), 1.)
+
+  def test_time(self):
+    histogram = metrics.Histogram('h')
+    with histogram.time():
+      pass
+    self.assertEqual(histogram.count, 1)
+
+
+class FileWriterTest(unittest.TestCase):
+
+  def test_write(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    registry = metrics.Registry()
+    metrics.counter('c_total', 'C.', registry=registry).inc()
+    path = os.path.join(directory, 'face.prom')
+    writer = metrics.PeriodicFileWriter(path, interval=60., registry=registry)
+    writer.stop()
+    with open(path) as f:
+      self.assertEqual(f.read(), registry.exposition())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,125 @@
+"""Dynamic micro-batching of concurrent detection requests.
+
+Callers from many threads submit single frames.  A single worker thread
+collects them into a batch until either max_batch_size frames are waiting or
+the oldest frame has waited max_wait seconds, then runs the whole batch
+through the detector's run_batch.  Under load this amortizes the per-call
+session overhead over the batch, while max_wait bounds the latency added to
+a lone request.
+"""
+
+import threading
+import time
+
+from concurrent import futures
+from six.moves import queue
+
+from utils import metrics
+
+
+_BATCH_SIZE = metrics.histogram('face_micro_batch_size',
+                                'Number of requests per micro-batch.',
+                                buckets=(1, 2, 4, 8, 16, 32, 64))
+_QUEUE_SECONDS = metrics.histogram(
+    'face_micro_batch_queue_seconds',
+    'Time a request waits before its batch is run.')
+
+
+class MicroBatcher(object):
+  """Collects concurrently submitted frames into detector batches."""
+
+  def __init__(self,
+               detector,
+               max_batch_size=8,
+               max_wait=.005,
+               max_queue_size=256,
+               letterbox=False):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible
+        run_batch().
+      max_batch_size: maximum number of frames per batch.
+      max_wait: maximum number of seconds the first frame of a batch waits
+        for more frames to arrive.
+      max_queue_size: maximum number of waiting frames, submit() blocks
+        beyond it.
+      letterbox: pad frames of different resolutions onto a common canvas, so
+        that every batch is a single sess.run.  The detections of a frame then
+        depend on the resolutions of the frames batched with it, and small
+        faces shrink with the canvas, so by default the detector groups frames
+        by resolution instead.
+    """
+    self._detector = detector
+    self._max_batch_size = max_batch_size
+    self._max_wait = max_wait
+    self._letterbox = letterbox
+    self._requests = queue.Queue(maxsize=max_queue_size)
+    self._closed = False
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, image):
+    """Queues a bgr image.
+
+    Returns:
+      a concurrent.futures.Future resolving to the frame's
+      (boxes, scores, classes, num_detections).
+
+    Raises:
+      RuntimeError: if the batcher is closed.
+    """
+    if self._closed:
+      raise RuntimeError('MicroBatcher is closed.')
+    future = futures.Future()
+    self._requests.put((time.time(), image, future))
+    return future
+
+  def detect(self, image, timeout=None):
+    """Submits a bgr image and waits for its detections."""
+    return self.submit(image).result(timeout)
+
+  def close(self):
+    """Stops accepting frames, finishes the queued ones and stops."""
+    self._closed = True
+    self._requests.put(None)
+    self._thread.join()
+
+  def _run(self):
+    closing = False
+    while not closing:
+      request = self._requests.get()
+      if request is None:
+        break
+      batch = [request]
+      deadline = request[0] + self._max_wait
+      while len(batch) < self._max_batch_size:
+        timeout = deadline - time.time()
+        try:
+          request = (self._requests.get(timeout=timeout) if timeout > 0 else
+                     self._requests.get_nowait())
+        except queue.Empty:
+          break
+        if request is None:
+          closing = True
+          break
+        batch.append(request)
+      self._run_batch(batch)
+
+  def _run_batch(self, batch):
+    now = time.time()
+    for submitted, _, _ in batch:
+      _QUEUE_SECONDS.observe(now - submitted)
+    _BATCH_SIZE.observe(len(batch))
+    try:
+      results = self._detector.run_batch(
+          [image for _, image, _ in batch],
+          batch_size=self._max_batch_size,
+          letterbox=self._letterbox)
+    except Exception as e:  # pylint: disable=broad-except
+      for _, _, future in batch:
+        future.set_exception(e)
+      return
+    for (_, _, future), result in zip(batch, results):
+      future.set_result(result)
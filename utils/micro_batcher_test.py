@@ -0,0 +1,183 @@
+"""Tests for utils.micro_batcher."""
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from utils import micro_batcher
+from utils.detections import Detections
+
+try:
+  import inference_usbCam_face
+except ImportError:  # TensorFlow is not installed.
+  inference_usbCam_face = None
+
+
+def _frame(value, shape=(4, 6, 3)):
+  return np.full(shape, value, dtype=np.uint8)
+
+
+class _FakeDetector(object):
+  """Scores every frame by its first pixel, recording the batches it runs.
+
+  With a gate, run_batch() blocks until the gate is set; entered is set as
+  soon as a batch arrives.
+  """
+
+  def __init__(self, gate=None):
+    self.gate = gate
+    self.entered = threading.Event()
+    self.error = None
+    self.batches = []
+    self.letterbox = []
+
+  def run_batch(self, frames, batch_size=16, letterbox=False):
+    self.batches.append([int(frame[0, 0, 0]) for frame in frames])
+    self.letterbox.append(letterbox)
+    self.entered.set()
+    if self.gate is not None:
+      self.gate.wait()
+    if self.error is not None:
+      raise self.error
+    return [Detections([[0., 0., .5, .5]], [frame[0, 0, 0] / 255.],
+                       [1]).to_raw() for frame in frames]
+
+
+def _score(detections):
+  return int(round(detections[1][0, 0] * 255))
+
+
+class MicroBatcherTest(unittest.TestCase):
+
+  def _batcher(self, detector, **kwargs):
+    batcher = micro_batcher.MicroBatcher(detector, **kwargs)
+    self.addCleanup(batcher.close)
+    return batcher
+
+  def test_lone_request_waits_at_most_max_wait(self):
+    detector = _FakeDetector()
+    batcher = self._batcher(detector, max_wait=.05)
+    start = time.time()
+    self.assertEqual(_score(batcher.detect(_frame(7), timeout=5)), 7)
+    self.assertLess(time.time() - start, 1.)
+    self.assertEqual(detector.batches, [[7]])
+
+  def test_requests_within_max_wait_share_a_batch(self):
+    detector = _FakeDetector()
+    batcher = self._batcher(detector, max_wait=.5)
+    results = [batcher.submit(_frame(value)) for value in (1, 2)]
+    self.assertEqual([_score(r.result(5)) for r in results], [1, 2])
+    self.assertEqual(detector.batches, [[1, 2]])
+
+  def test_full_batch_does_not_wait(self):
+    detector = _FakeDetector()
+    batcher = self._batcher(detector, max_batch_size=2, max_wait=30.)
+    results = [batcher.submit(_frame(value)) for value in (1, 2)]
+    self.assertEqual([_score(r.result(5)) for r in results], [1, 2])
+
+  def test_max_batch_size(self):
+    gate = threading.Event()
+    detector = _FakeDetector(gate)
+    batcher = self._batcher(detector, max_batch_size=4, max_wait=0.)
+    results = [batcher.submit(_frame(1))]
+    self.assertTrue(detector.entered.wait(5))
+    results.extend(batcher.submit(_frame(value)) for value in range(2, 7))
+    gate.set()
+    self.assertEqual([_score(r.result(5)) for r in results],
+                     list(range(1, 7)))
+    self.assertEqual(detector.batches, [[1], [2, 3, 4, 5], [6]])
+
+  def test_submit_blocks_while_the_queue_is_full(self):
+    gate = threading.Event()
+    detector = _FakeDetector(gate)
+    batcher = self._batcher(detector, max_wait=0., max_queue_size=1)
+    results = [batcher.submit(_frame(1))]
+    self.assertTrue(detector.entered.wait(5))
+    results.append(batcher.submit(_frame(2)))
+    blocked = threading.Thread(
+        target=lambda: results.append(batcher.submit(_frame(3))))
+    blocked.start()
+    blocked.join(.2)
+    self.assertTrue(blocked.is_alive())
+    gate.set()
+    blocked.join(5)
+    self.assertEqual([_score(r.result(5)) for r in results], [1, 2, 3])
+
+  def test_detector_errors_fail_the_batch_only(self):
+    detector = _FakeDetector()
+    batcher = self._batcher(detector, max_batch_size=2, max_wait=.5)
+    detector.error = RuntimeError('out of memory')
+    results = [batcher.submit(_frame(value)) for value in (1, 2)]
+    for result in results:
+      with self.assertRaises(RuntimeError):
+        result.result(5)
+    detector.error = None
+    self.assertEqual(_score(batcher.detect(_frame(3), timeout=5)), 3)
+
+  def test_groups_by_resolution_unless_letterboxing(self):
+    detector = _FakeDetector()
+    self._batcher(detector, max_wait=0.).detect(_frame(1), timeout=5)
+    self._batcher(detector, max_wait=0.,
+                  letterbox=True).detect(_frame(1), timeout=5)
+    self.assertEqual(detector.letterbox, [False, True])
+
+  def test_close_finishes_queued_frames(self):
+    gate = threading.Event()
+    detector = _FakeDetector(gate)
+    batcher = micro_batcher.MicroBatcher(detector, max_wait=0.)
+    results = [batcher.submit(_frame(1))]
+    self.assertTrue(detector.entered.wait(5))
+    results.extend(batcher.submit(_frame(value)) for value in (2, 3))
+    closing = threading.Thread(target=batcher.close)
+    closing.start()
+    gate.set()
+    closing.join(5)
+    self.assertFalse(closing.is_alive())
+    self.assertEqual([_score(r.result(0)) for r in results], [1, 2, 3])
+    with self.assertRaises(RuntimeError):
+      batcher.submit(_frame(4))
+
+
+@unittest.skipIf(inference_usbCam_face is None, 'requires tensorflow')
+class DetectorRunBatchTest(unittest.TestCase):
+  """TensoflowFaceDector.run_batch, with the session replaced by a fake."""
+
+  def setUp(self):
+    detector_class = inference_usbCam_face.TensoflowFaceDector
+    self.detector = detector_class.__new__(detector_class)
+    self.detector._buffers = threading.local()  # pylint: disable=protected-access
+    self.detector._run_callable = self._run_callable  # pylint: disable=protected-access
+    self.batch_shapes = []
+
+  def _run_callable(self, image_batch):
+    self.batch_shapes.append(image_batch.shape)
+    n = len(image_batch)
+    boxes = np.zeros((n, 100, 4), dtype=np.float32)
+    boxes[:, 0] = [0., 0., .5, .5]
+    scores = np.zeros((n, 100), dtype=np.float32)
+    # The first pixel of each image, to match the results to the frames.
+    scores[:, 0] = image_batch[:, 0, 0, 0] / 255.
+    return (boxes, scores, np.ones((n, 100), dtype=np.float32),
+            np.ones((n,), dtype=np.float32))
+
+  def test_groups_frames_by_resolution(self):
+    frames = [_frame(1), _frame(2, (8, 8, 3)), _frame(3), _frame(4)]
+    results = self.detector.run_batch(frames, batch_size=2)
+    self.assertEqual([_score(r) for r in results], [1, 2, 3, 4])
+    self.assertEqual(sorted(self.batch_shapes),
+                     [(1, 4, 6, 3), (1, 8, 8, 3), (2, 4, 6, 3)])
+
+  def test_letterbox(self):
+    frames = [_frame(1), _frame(2, (8, 8, 3))]
+    results = self.detector.run_batch(frames, letterbox=True)
+    self.assertEqual(self.batch_shapes, [(2, 8, 8, 3)])
+    self.assertEqual([_score(r) for r in results], [1, 2])
+    # The canvas box [0, 0, .5, .5] covers the whole 4x6 frame, clipped.
+    np.testing.assert_allclose(results[0][0][0, 0], [0., 0., 1., 2. / 3])
+    np.testing.assert_allclose(results[1][0][0, 0], [0., 0., .5, .5])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,147 @@
+"""Optimized, cached copy of the frozen detection graph.
+
+The frozen graph exported by the object detection API still holds nodes the
+detector never runs, and constant subgraphs that TensorFlow re-evaluates on
+the first inference.  prepare() strips the graph down to what the detection
+outputs need and folds its constants once, ahead of time, and writes the
+result next to the original model:
+
+  frozen_inference_graph_face.pb             the original model
+  frozen_inference_graph_face.optimized.pb   the optimized graph
+  frozen_inference_graph_face.optimized.json fingerprint of both files
+
+resolve_model_path() returns the optimized graph when it is fresh, i.e. it
+was built from the current model file by the current TensorFlow version, and
+falls back to the original model otherwise.
+"""
+
+import json
+import logging
+import os
+
+import tensorflow as tf
+
+from utils.fingerprint import model_fingerprint
+
+
+INPUT_NAMES = ('image_tensor',)
+OUTPUT_NAMES = ('detection_boxes', 'detection_scores', 'detection_classes',
+                'num_detections')
+
+TRANSFORMS = (
+    'strip_unused_nodes(type=uint8, shape="-1,-1,-1,3")',
+    'remove_device',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order',
+)
+
+
+def optimized_path(model_path):
+  """Returns the path of the optimized graph built from model_path."""
+  return os.path.splitext(model_path)[0] + '.optimized.pb'
+
+
+def _metadata_path(artifact_path):
+  return os.path.splitext(artifact_path)[0] + '.json'
+
+
+def _file_stamp(path):
+  stat = os.stat(path)
+  return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_graph_def(path):
+  """Reads a serialized GraphDef."""
+  graph_def = tf.GraphDef()
+  with tf.gfile.GFile(path, 'rb') as f:
+    graph_def.ParseFromString(f.read())
+  return graph_def
+
+
+def optimize_graph_def(graph_def, transforms=TRANSFORMS):
+  """Returns graph_def stripped to the detection outputs, constants folded."""
+  # Only shipped with full TensorFlow builds, import it where it is needed.
+  from tensorflow.tools.graph_transforms import TransformGraph  # pylint: disable=g-import-not-at-top
+  return TransformGraph(graph_def, list(INPUT_NAMES), list(OUTPUT_NAMES),
+                        list(transforms))
+
+
+def prepare(model_path, output_path=None, transforms=TRANSFORMS):
+  """Builds the optimized graph of model_path and records its fingerprint.
+
+  Args:
+    model_path: the frozen graph.
+    output_path: where to write the optimized graph, optimized_path() by
+      default.
+    transforms: graph transforms to apply, see TRANSFORMS.
+
+  Returns:
+    the metadata written next to the optimized graph, a dict.
+  """
+  if output_path is None:
+    output_path = optimized_path(model_path)
+  graph_def = load_graph_def(model_path)
+  optimized = optimize_graph_def(graph_def, transforms)
+
+  tmp_path = output_path + '.tmp'
+  with tf.gfile.GFile(tmp_path, 'wb') as f:
+    f.write(optimized.SerializeToString())
+  os.rename(tmp_path, output_path)
+
+  metadata = {
+      'source': os.path.abspath(model_path),
+      'source_stamp': _file_stamp(model_path),
+      'source_fingerprint': model_fingerprint(model_path),
+      'artifact_stamp': _file_stamp(output_path),
+      'artifact_fingerprint': model_fingerprint(output_path),
+      'tensorflow': tf.__version__,
+      'transforms': list(transforms),
+      'source_nodes': len(graph_def.node),
+      'artifact_nodes': len(optimized.node),
+  }
+  with open(_metadata_path(output_path), 'w') as f:
+    json.dump(metadata, f, indent=2, sort_keys=True)
+  return metadata
+
+
+def is_fresh(model_path, artifact_path=None):
+  """Returns whether the optimized graph matches model_path and TensorFlow.
+
+  Files whose size and modification time are unchanged are trusted, others
+  are compared by content, so that a copied or touched model still matches.
+  """
+  if artifact_path is None:
+    artifact_path = optimized_path(model_path)
+  metadata_path = _metadata_path(artifact_path)
+  if not (os.path.exists(artifact_path) and os.path.exists(metadata_path)):
+    return False
+  try:
+    with open(metadata_path) as f:
+      metadata = json.load(f)
+  except (IOError, ValueError):
+    # Truncated or corrupt, e.g. by an interrupted prepare().
+    return False
+  if not isinstance(metadata, dict):
+    return False
+  if metadata.get('tensorflow') != tf.__version__:
+    return False
+  for path, stamp, fingerprint in (
+      (model_path, 'source_stamp', 'source_fingerprint'),
+      (artifact_path, 'artifact_stamp', 'artifact_fingerprint')):
+    if (_file_stamp(path) != metadata.get(stamp) and
+        model_fingerprint(path) != metadata.get(fingerprint)):
+      return False
+  return True
+
+
+def resolve_model_path(model_path):
+  """Returns the optimized graph of model_path if fresh, else model_path."""
+  artifact_path = optimized_path(model_path)
+  if is_fresh(model_path, artifact_path):
+    return artifact_path
+  if os.path.exists(artifact_path):
+    logging.warning('%s is stale, loading %s; run prepare_model_face.py to '
+                    'rebuild it', artifact_path, model_path)
+  return model_path
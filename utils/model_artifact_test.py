@@ -0,0 +1,54 @@
+"""Tests for utils.model_artifact."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from utils import model_artifact
+except ImportError:  # TensorFlow is not installed.
+  model_artifact = None
+
+
+@unittest.skipIf(model_artifact is None, 'requires tensorflow')
+class IsFreshTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.model_path = os.path.join(self.directory, 'model.pb')
+    self.artifact_path = model_artifact.optimized_path(self.model_path)
+    for path, contents in ((self.model_path, b'graph'),
+                           (self.artifact_path, b'optimized')):
+      with open(path, 'wb') as f:
+        f.write(contents)
+    self.metadata_path = os.path.splitext(self.artifact_path)[0] + '.json'
+
+  def _write_metadata(self, contents):
+    with open(self.metadata_path, 'w') as f:
+      f.write(contents)
+
+  def test_fresh(self):
+    self._write_metadata(json.dumps({
+        'source_fingerprint':
+            model_artifact.model_fingerprint(self.model_path),
+        'artifact_fingerprint':
+            model_artifact.model_fingerprint(self.artifact_path),
+        'tensorflow': model_artifact.tf.__version__,
+    }))
+    self.assertTrue(model_artifact.is_fresh(self.model_path))
+    self.assertEqual(model_artifact.resolve_model_path(self.model_path),
+                     self.artifact_path)
+
+  def test_corrupt_metadata_is_stale(self):
+    for contents in ('', '{"tensorflow": "1.', '[]'):
+      self._write_metadata(contents)
+      self.assertFalse(model_artifact.is_fresh(self.model_path))
+      self.assertEqual(model_artifact.resolve_model_path(self.model_path),
+                       self.model_path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+"""Motion gate that skips inference on static frames.
+
+Many camera feeds show the same static scene for long periods.  The gate
+compares a tiny grayscale thumbnail of every frame against the thumbnail of
+the last frame that went through the detector, and reuses the previous
+detections as long as the mean absolute difference stays under a threshold.
+"""
+
+import cv2
+
+from utils import metrics
+
+
+_GATED_FRAMES = metrics.counter('face_motion_gated_frames_total',
+                                'Frames whose detections were reused.')
+
+
+class MotionGatedDetector(object):
+  """Wraps a detector, only running it when the frame has changed.
+
+  run() keeps the interface of TensoflowFaceDector.run.
+  """
+
+  def __init__(self,
+               detector,
+               threshold=3.0,
+               refresh_every=150,
+               thumbnail_size=(64, 36)):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible run().
+      threshold: mean absolute gray level difference (0-255) between the
+        thumbnails of the current frame and of the last inferred frame above
+        which the detector is run again.
+      refresh_every: run the detector at least once every refresh_every
+        frames, even if nothing has changed.  None disables the refresh.
+      thumbnail_size: (width, height) of the thumbnails that are compared.
+    """
+    self._detector = detector
+    self._threshold = threshold
+    self._refresh_every = refresh_every
+    self._thumbnail_size = tuple(thumbnail_size)
+
+    self._reference = None
+    self._detections = None
+    self._frames_since_inference = 0
+
+    self.inferred_frames = 0
+    self.gated_frames = 0
+
+  def run(self, image):
+    """image: bgr image
+    return (boxes, scores, classes, num_detections)
+    """
+    thumbnail = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),
+                           self._thumbnail_size, interpolation=cv2.INTER_AREA)
+    if (self._detections is not None and
+        (self._refresh_every is None or
+         self._frames_since_inference + 1 < self._refresh_every) and
+        cv2.absdiff(thumbnail, self._reference).mean() <= self._threshold):
+      self._frames_since_inference += 1
+      self.gated_frames += 1
+      _GATED_FRAMES.inc()
+      return self._detections
+
+    self._detections = self._detector.run(image)
+    self._reference = thumbnail
+    self._frames_since_inference = 0
+    self.inferred_frames += 1
+    return self._detections
+
+  def run_batch(self, frames, batch_size=None):
+    """Runs run() on each frame in order; gating compares consecutive frames."""
+    del batch_size  # Frames have to be processed one after the other.
+    return [self.run(frame) for frame in frames]
+
+  def stats(self):
+    """Returns a dict with the number of inferred and gated frames."""
+    total = self.inferred_frames + self.gated_frames
+    return {
+        'inferred_frames': self.inferred_frames,
+        'gated_frames': self.gated_frames,
+        'gated_ratio': self.gated_frames / float(total) if total else 0.0,
+    }
@@ -0,0 +1,121 @@
+"""Frame-range sharding of a long video with resumable checkpoints.
+
+A long recording is split into shards of consecutive frames.  Every shard is
+processed on its own (typically by a separate worker process that seeks to
+the shard's first frame) into its own output files, and a checkpoint file
+records which shards are complete.  After a crash or restart only the
+missing shards are processed again.  Once all shards are done their outputs
+are merged, in frame order, into the final outputs.
+"""
+
+import json
+import os
+
+import cv2
+
+
+_CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def plan_shards(total_frames, shard_frames):
+  """Splits [0, total_frames) into (shard_id, start_frame, end_frame) ranges."""
+  if shard_frames < 1:
+    raise ValueError('shard_frames must be >= 1')
+  return [(shard_id, start, min(start + shard_frames, total_frames))
+          for shard_id, start in enumerate(range(0, total_frames,
+                                                 shard_frames))]
+
+
+class ShardCheckpoint(object):
+  """Records the completed shards of one job in a json file.
+
+  The checkpoint remembers the job parameters it was created for, and refuses
+  to resume a job with different ones, since shard boundaries would not line
+  up anymore.
+  """
+
+  def __init__(self, work_dir, job):
+    """Constructor.
+
+    Args:
+      work_dir: directory holding the checkpoint and the shard outputs,
+        created if needed.
+      job: a json serializable dict of the parameters defining the shards,
+        e.g. input path, frame count and shard size.
+
+    Raises:
+      ValueError: if work_dir holds a checkpoint of a different job.
+    """
+    if not os.path.isdir(work_dir):
+      os.makedirs(work_dir)
+    self._path = os.path.join(work_dir, _CHECKPOINT_FILE)
+    self._job = job
+    self._completed = set()
+    if os.path.exists(self._path):
+      with open(self._path) as f:
+        state = json.load(f)
+      if state['job'] != job:
+        raise ValueError(
+            '{} holds the checkpoint of another job: {}'.format(
+                work_dir, state['job']))
+      self._completed.update(state['completed'])
+
+  def is_completed(self, shard_id):
+    return shard_id in self._completed
+
+  def mark_completed(self, shard_id):
+    """Records a completed shard, atomically replacing the checkpoint."""
+    self._completed.add(shard_id)
+    with open(self._path + '.tmp', 'w') as f:
+      json.dump({'job': self._job, 'completed': sorted(self._completed)}, f)
+    os.rename(self._path + '.tmp', self._path)
+
+  @property
+  def completed(self):
+    return sorted(self._completed)
+
+
+def shard_path(work_dir, shard_id, suffix):
+  """Returns the path of one output of a shard, e.g. suffix '.avi'."""
+  return os.path.join(work_dir, 'shard_{:06d}{}'.format(shard_id, suffix))
+
+
+def merge_videos(shard_paths, output_path, fourcc=0, fps=25.0):
+  """Concatenates shard videos, in the given order, into one video.
+
+  Missing shard videos, i.e. shards that had no frames, are skipped.
+  """
+  out = None
+  try:
+    for path in shard_paths:
+      if not os.path.exists(path):
+        continue
+      cap = cv2.VideoCapture(path)
+      while True:
+        ret, image = cap.read()
+        if not ret:
+          break
+        if out is None:
+          [h, w] = image.shape[:2]
+          out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
+        out.write(image)
+      cap.release()
+  finally:
+    if out is not None:
+      out.release()
+
+
+def merge_files(shard_paths, output_path, chunk_size=1 << 20):
+  """Concatenates shard files byte by byte, in the given order.
+
+  Both json lines and binary detection files (see utils.detection_sinks) are
+  made of self-contained records, so their shards concatenate directly.
+  Missing shard files are skipped.
+  """
+  with open(output_path, 'wb') as out:
+    for path in shard_paths:
+      if not os.path.exists(path):
+        continue
+      with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+          out.write(chunk)
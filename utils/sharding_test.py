@@ -0,0 +1,73 @@
+"""Tests for utils.sharding."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import sharding
+
+
+class PlanShardsTest(unittest.TestCase):
+
+  def test_covers_all_frames(self):
+    self.assertEqual(sharding.plan_shards(10, 4),
+                     [(0, 0, 4), (1, 4, 8), (2, 8, 10)])
+
+  def test_exact_multiple(self):
+    self.assertEqual(sharding.plan_shards(8, 4), [(0, 0, 4), (1, 4, 8)])
+
+  def test_no_frames(self):
+    self.assertEqual(sharding.plan_shards(0, 4), [])
+
+  def test_invalid_shard_size(self):
+    with self.assertRaises(ValueError):
+      sharding.plan_shards(10, 0)
+
+
+class ShardCheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.job = {'input': 'a.mp4', 'total_frames': 10, 'shard_frames': 4}
+
+  def test_resume(self):
+    work_dir = os.path.join(self.directory, 'work')
+    checkpoint = sharding.ShardCheckpoint(work_dir, self.job)
+    checkpoint.mark_completed(2)
+    checkpoint.mark_completed(0)
+    checkpoint = sharding.ShardCheckpoint(work_dir, self.job)
+    self.assertEqual(checkpoint.completed, [0, 2])
+    self.assertTrue(checkpoint.is_completed(2))
+    self.assertFalse(checkpoint.is_completed(1))
+
+  def test_refuses_another_job(self):
+    sharding.ShardCheckpoint(self.directory, self.job).mark_completed(0)
+    job = dict(self.job, shard_frames=5)
+    with self.assertRaises(ValueError):
+      sharding.ShardCheckpoint(self.directory, job)
+
+
+class MergeFilesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_concatenates_in_order_and_skips_missing_shards(self):
+    paths = [sharding.shard_path(self.directory, shard_id, '.jsonl')
+             for shard_id in range(3)]
+    self.assertEqual(os.path.basename(paths[1]), 'shard_000001.jsonl')
+    with open(paths[0], 'wb') as f:
+      f.write(b'a\n')
+    with open(paths[2], 'wb') as f:
+      f.write(b'c\n' * 3)
+    output_path = os.path.join(self.directory, 'merged.jsonl')
+    sharding.merge_files(paths, output_path, chunk_size=3)
+    with open(output_path, 'rb') as f:
+      self.assertEqual(f.read(), b'a\nc\nc\nc\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,273 @@
+"""Runs several video streams through one shared detector.
+
+Every stream gets its own decoder thread and bounded frame queue.  A pool of
+worker threads shares a single detector (and therefore a single loaded graph
+and tf.Session) and serves the streams in round-robin order, one small batch
+at a time, so that a long or fast-decoding stream cannot starve the others.
+Each stream writes its annotated frames, in order, next to its input.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import cv2
+from six.moves import queue
+
+from utils import metrics
+
+
+# Marks the end of a stream on its frame queue.
+_END_OF_STREAM = None
+
+_FRAMES_IN = metrics.counter('face_frames_in_total',
+                             'Frames read from the input.')
+_FRAMES_OUT = metrics.counter('face_frames_out_total',
+                              'Frames written to the output.')
+
+
+def default_output_path(input_path):
+  """Returns the output path written next to input_path."""
+  root, _ = os.path.splitext(input_path)
+  return root + '_out.avi'
+
+
+class _StreamStopped(Exception):
+  """Raised inside a thread when the supervisor is shutting down."""
+
+
+class _Stream(object):
+  """Per-stream state: frame queue, ordered writer and progress counters."""
+
+  def __init__(self, input_path, output_path, queue_size):
+    self.input_path = input_path
+    self.output_path = output_path
+    self.frames = queue.Queue(maxsize=queue_size)
+    self.cap = cv2.VideoCapture(input_path)
+    self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+    self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    self.frames_written = 0
+    self.start_time = None
+    self.end_time = None
+
+    self._lock = threading.Lock()
+    self._pending = {}
+    self._out = None
+
+    metrics.gauge('face_stream_queue_depth',
+                  'Number of decoded frames waiting per stream.',
+                  labels={'stream': input_path}).set_function(self.frames.qsize)
+
+  def deliver(self, index, image, fourcc):
+    """Hands over a rendered frame, writes every frame that is now in order."""
+    with self._lock:
+      self._pending[index] = image
+      while self.frames_written in self._pending:
+        image = self._pending.pop(self.frames_written)
+        if self._out is None:
+          [h, w] = image.shape[:2]
+          self._out = cv2.VideoWriter(self.output_path, fourcc, self.fps,
+                                      (w, h))
+        self._out.write(image)
+        self.frames_written += 1
+        _FRAMES_OUT.inc()
+
+  def close(self):
+    self.cap.release()
+    if self._out is not None:
+      self._out.release()
+
+  def progress(self):
+    """Returns a dict with the stream's progress and throughput."""
+    elapsed = ((self.end_time or time.time()) - self.start_time
+               if self.start_time is not None else 0.0)
+    return {
+        'input': self.input_path,
+        'output': self.output_path,
+        'frames_written': self.frames_written,
+        'total_frames': self.total_frames,
+        'fps': self.frames_written / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+class StreamSupervisor(object):
+  """Spreads the frames of several videos over a pool of shared workers."""
+
+  def __init__(self,
+               detector,
+               input_paths,
+               render_fn,
+               output_paths=None,
+               num_workers=2,
+               batch_size=4,
+               queue_size=16,
+               fourcc=0,
+               max_frames=None,
+               report_interval=5.0):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, shared by all workers.
+      input_paths: list of input video paths.
+      render_fn: callable(image, detections) drawing detections onto the bgr
+        image in place.
+      output_paths: list of output paths, one per input.  If None, each output
+        is written next to its input, see default_output_path().
+      num_workers: number of worker threads sharing the detector.
+      batch_size: maximum number of frames a worker takes from one stream
+        before moving on to the next stream.
+      queue_size: capacity of each stream's decoded frame queue.
+      fourcc: fourcc code handed to cv2.VideoWriter.
+      max_frames: stop each stream after this many frames.  If None, read the
+        whole input.
+      report_interval: seconds between two progress log lines.  If None,
+        progress is not logged.
+    """
+    if output_paths is None:
+      output_paths = [default_output_path(path) for path in input_paths]
+    if len(output_paths) != len(input_paths):
+      raise ValueError('Expected one output path per input path.')
+    self._detector = detector
+    self._render_fn = render_fn
+    self._num_workers = num_workers
+    self._batch_size = batch_size
+    self._fourcc = fourcc
+    self._max_frames = max_frames
+    self._report_interval = report_interval
+
+    self._streams = [_Stream(input_path, output_path, queue_size)
+                     for input_path, output_path in zip(input_paths,
+                                                        output_paths)]
+    self._active = list(self._streams)
+    self._cursor = 0
+    self._schedule_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._error = None
+
+  def progress(self):
+    """Returns a list of per-stream progress dicts, in input order."""
+    return [stream.progress() for stream in self._streams]
+
+  def run(self):
+    """Processes all streams to the end.
+
+    Returns:
+      the list of per-stream progress dicts.
+
+    Raises:
+      the first exception raised by a decoder or worker thread.
+    """
+    decoders = [threading.Thread(target=self._guard,
+                                 args=(self._decode, stream))
+                for stream in self._streams]
+    workers = [threading.Thread(target=self._guard, args=(self._work,))
+               for _ in range(self._num_workers)]
+    for thread in decoders + workers:
+      thread.daemon = True
+      thread.start()
+
+    last_report = time.time()
+    while any(worker.is_alive() for worker in workers):
+      workers[0].join(0.1)
+      now = time.time()
+      if (self._report_interval is not None and
+          now - last_report >= self._report_interval):
+        last_report = now
+        self._log_progress()
+    self._stop.set()
+    for thread in decoders + workers:
+      thread.join()
+    for stream in self._streams:
+      stream.close()
+    self._log_progress()
+
+    if self._error is not None:
+      raise self._error
+    return self.progress()
+
+  def _log_progress(self):
+    for p in self.progress():
+      logging.info('%s: %d/%d frames, %.1f fps', p['input'],
+                   p['frames_written'], p['total_frames'], p['fps'])
+
+  def _guard(self, target, *args):
+    try:
+      target(*args)
+    except _StreamStopped:
+      pass
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('stream supervisor thread failed')
+      if self._error is None:
+        self._error = e
+      self._stop.set()
+
+  def _decode(self, stream):
+    stream.start_time = time.time()
+    index = 0
+    while self._max_frames is None or index < self._max_frames:
+      ret, image = stream.cap.read()
+      if not ret:
+        break
+      _FRAMES_IN.inc()
+      self._put(stream.frames, (index, image))
+      index += 1
+    self._put(stream.frames, _END_OF_STREAM)
+
+  def _put(self, frames, item):
+    while True:
+      if self._stop.is_set():
+        raise _StreamStopped()
+      try:
+        frames.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def _next_batch(self):
+    """Takes up to batch_size frames from the next stream that has any.
+
+    Returns:
+      (stream, [(index, image), ...]), (None, []) if no stream has a frame
+      ready right now, or None once every stream is exhausted.
+    """
+    with self._schedule_lock:
+      if not self._active:
+        return None
+      for _ in range(len(self._active)):
+        self._cursor %= len(self._active)
+        stream = self._active[self._cursor]
+        batch = []
+        while len(batch) < self._batch_size:
+          try:
+            item = stream.frames.get_nowait()
+          except queue.Empty:
+            break
+          if item is _END_OF_STREAM:
+            stream.end_time = time.time()
+            self._active.remove(stream)
+            # The next stream slides into this position, do not skip it.
+            self._cursor -= 1
+            break
+          batch.append(item)
+        self._cursor += 1
+        if batch:
+          return stream, batch
+        if not self._active:
+          return None
+      return None, []
+
+  def _work(self):
+    while not self._stop.is_set():
+      picked = self._next_batch()
+      if picked is None:
+        return
+      stream, batch = picked
+      if not batch:
+        time.sleep(0.005)
+        continue
+      detections = self._detector.run_batch(
+          [image for _, image in batch], batch_size=self._batch_size)
+      for (index, image), frame_detections in zip(batch, detections):
+        self._render_fn(image, frame_detections)
+        stream.deliver(index, image, self._fourcc)
@@ -0,0 +1,153 @@
+"""Tiled inference for high resolution frames.
+
+The SSD resizes its whole input to a fixed internal resolution, so small faces
+in a 4K frame shrink to a few pixels and disappear.  Tiling splits the frame
+into overlapping tiles of a moderate size, sends all tiles through the
+detector in a single batch, maps the tile detections back into frame
+coordinates and merges duplicates from overlapping tiles with non-maximum
+suppression.
+"""
+
+import numpy as np
+
+
+def tile_origins(length, tile_length, overlap):
+  """Returns the start offsets of tiles covering [0, length).
+
+  All tiles have length tile_length (or length, if that is smaller), adjacent
+  tiles overlap by at least overlap pixels and the last tile ends exactly at
+  length.
+  """
+  if tile_length >= length:
+    return [0]
+  stride = max(tile_length - overlap, 1)
+  num_tiles = int(np.ceil(float(length - tile_length) / stride)) + 1
+  return [int(round(v))
+          for v in np.linspace(0, length - tile_length, num_tiles)]
+
+
+def compute_tiles(height, width, tile_size, overlap):
+  """Returns a list of (top, left, bottom, right) tiles covering an image.
+
+  Args:
+    height: image height in pixels.
+    width: image width in pixels.
+    tile_size: (tile_height, tile_width) in pixels.
+    overlap: overlap between adjacent tiles in pixels.  It should be at least
+      the size of the largest face expected to be cut by a tile border.
+  """
+  tile_height = min(tile_size[0], height)
+  tile_width = min(tile_size[1], width)
+  return [(top, left, top + tile_height, left + tile_width)
+          for top in tile_origins(height, tile_height, overlap)
+          for left in tile_origins(width, tile_width, overlap)]
+
+
+def non_max_suppression(boxes, scores, iou_threshold=.5, max_output_size=100):
+  """Greedy non-maximum suppression.
+
+  Args:
+    boxes: a numpy array of shape [N, 4]: (ymin, xmin, ymax, xmax).
+    scores: a numpy array of shape [N].
+    iou_threshold: boxes overlapping a higher scoring box by more than this
+      intersection over union are suppressed.
+    max_output_size: maximum number of boxes to keep.
+
+  Returns:
+    the indices of the kept boxes, by decreasing score.
+  """
+  order = np.argsort(-scores, kind='mergesort')
+  areas = (np.maximum(boxes[:, 2] - boxes[:, 0], 0) *
+           np.maximum(boxes[:, 3] - boxes[:, 1], 0))
+  keep = []
+  while order.size and len(keep) < max_output_size:
+    i = order[0]
+    keep.append(i)
+    rest = order[1:]
+    ymin = np.maximum(boxes[i, 0], boxes[rest, 0])
+    xmin = np.maximum(boxes[i, 1], boxes[rest, 1])
+    ymax = np.minimum(boxes[i, 2], boxes[rest, 2])
+    xmax = np.minimum(boxes[i, 3], boxes[rest, 3])
+    intersection = np.maximum(ymax - ymin, 0) * np.maximum(xmax - xmin, 0)
+    union = areas[i] + areas[rest] - intersection
+    iou = np.where(union > 0, intersection / np.maximum(union, 1e-12), 0.)
+    order = rest[iou <= iou_threshold]
+  return np.array(keep, dtype=np.int64)
+
+
+class TiledDetector(object):
+  """Wraps a detector, running it on overlapping tiles of each frame.
+
+  run() keeps the interface of TensoflowFaceDector.run and returns boxes
+  normalized to the full frame, padded to max_detections rows.
+  """
+
+  def __init__(self,
+               detector,
+               tile_size=(720, 720),
+               overlap=128,
+               iou_threshold=.5,
+               min_score=.05,
+               max_detections=100):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible
+        run_batch().
+      tile_size: (tile_height, tile_width) in pixels.  Frames smaller than a
+        tile are sent whole.
+      overlap: overlap between adjacent tiles in pixels.
+      iou_threshold: intersection over union above which detections from
+        overlapping tiles are merged.
+      min_score: detections scoring below this are dropped before merging.
+      max_detections: number of rows of the returned arrays.
+    """
+    self._detector = detector
+    self._tile_size = tuple(tile_size)
+    self._overlap = overlap
+    self._iou_threshold = iou_threshold
+    self._min_score = min_score
+    self._max_detections = max_detections
+
+  def run(self, image):
+    """image: bgr image
+    return (boxes, scores, classes, num_detections)
+    """
+    [h, w] = image.shape[:2]
+    tiles = compute_tiles(h, w, self._tile_size, self._overlap)
+    # All tiles have the same shape, so they go through one sess.run.
+    results = self._detector.run_batch(
+        [image[top:bottom, left:right] for top, left, bottom, right in tiles],
+        batch_size=len(tiles))
+
+    all_boxes, all_scores, all_classes = [], [], []
+    for (top, left, bottom, right), (boxes, scores, classes, _) in zip(
+        tiles, results):
+      keep = scores[0] > self._min_score
+      tile_boxes = boxes[0, keep] * np.array(
+          [bottom - top, right - left, bottom - top, right - left],
+          dtype=np.float32)
+      tile_boxes += np.array([top, left, top, left], dtype=np.float32)
+      all_boxes.append(tile_boxes / np.array([h, w, h, w], dtype=np.float32))
+      all_scores.append(scores[0, keep])
+      all_classes.append(classes[0, keep])
+    boxes = np.concatenate(all_boxes).astype(np.float32)
+    scores = np.concatenate(all_scores).astype(np.float32)
+    classes = np.concatenate(all_classes).astype(np.float32)
+
+    keep = non_max_suppression(boxes, scores, self._iou_threshold,
+                               self._max_detections)
+    num = len(keep)
+    out_boxes = np.zeros((1, self._max_detections, 4), dtype=np.float32)
+    out_scores = np.zeros((1, self._max_detections), dtype=np.float32)
+    out_classes = np.zeros((1, self._max_detections), dtype=np.float32)
+    out_boxes[0, :num] = boxes[keep]
+    out_scores[0, :num] = scores[keep]
+    out_classes[0, :num] = classes[keep]
+    return (out_boxes, out_scores, out_classes,
+            np.array([num], dtype=np.float32))
+
+  def run_batch(self, frames, batch_size=None):
+    """Runs run() on each frame; the tiles of one frame form one batch."""
+    del batch_size  # Batches are made of the tiles of a single frame.
+    return [self.run(frame) for frame in frames]
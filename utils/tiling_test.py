@@ -0,0 +1,107 @@
+"""Tests for utils.tiling."""
+
+import unittest
+
+import numpy as np
+
+from utils import tiling
+from utils.detections import Detections
+
+
+class _FakeDetector(object):
+  """Returns one face per tile, at the same place in every tile."""
+
+  def __init__(self, box, score=.9):
+    self.box = box
+    self.score = score
+    self.batch_sizes = []
+
+  def run_batch(self, frames, batch_size=None):
+    self.batch_sizes.append(batch_size)
+    return [Detections([self.box], [self.score], [1]).to_raw()
+            for _ in frames]
+
+
+class TileTest(unittest.TestCase):
+
+  def test_tile_origins_cover_the_length(self):
+    origins = tiling.tile_origins(1000, 300, 50)
+    self.assertEqual(origins[0], 0)
+    self.assertEqual(origins[-1], 700)
+    for previous, current in zip(origins, origins[1:]):
+      self.assertGreaterEqual(previous + 300 - current, 50)
+
+  def test_tile_origins_of_a_short_length(self):
+    self.assertEqual(tiling.tile_origins(200, 300, 50), [0])
+
+  def test_compute_tiles_clips_the_tile_size(self):
+    tiles = tiling.compute_tiles(480, 2000, (720, 720), 128)
+    self.assertTrue(all(bottom - top == 480 for top, _, bottom, _ in tiles))
+    self.assertEqual(tiles[-1][3], 2000)
+
+
+class NonMaxSuppressionTest(unittest.TestCase):
+
+  def test_suppresses_overlapping_boxes(self):
+    boxes = np.array([[0, 0, 10, 10],
+                      [1, 1, 11, 11],
+                      [20, 20, 30, 30],
+                      [0, 0, 10, 9]], dtype=np.float32)
+    scores = np.array([.8, .9, .7, .6], dtype=np.float32)
+    keep = tiling.non_max_suppression(boxes, scores, iou_threshold=.5)
+    self.assertEqual(keep.tolist(), [1, 2])
+
+  def test_keeps_boxes_below_the_threshold(self):
+    boxes = np.array([[0, 0, 10, 10], [0, 5, 10, 15]], dtype=np.float32)
+    scores = np.array([.5, .9], dtype=np.float32)
+    keep = tiling.non_max_suppression(boxes, scores, iou_threshold=.5)
+    self.assertEqual(keep.tolist(), [1, 0])
+
+  def test_max_output_size(self):
+    boxes = np.array([[i * 20, 0, i * 20 + 10, 10] for i in range(5)],
+                     dtype=np.float32)
+    scores = np.linspace(.5, .9, 5).astype(np.float32)
+    keep = tiling.non_max_suppression(boxes, scores, max_output_size=2)
+    self.assertEqual(keep.tolist(), [4, 3])
+
+  def test_empty_and_degenerate_boxes(self):
+    keep = tiling.non_max_suppression(np.zeros((0, 4), dtype=np.float32),
+                                      np.zeros((0,), dtype=np.float32))
+    self.assertEqual(keep.shape, (0,))
+    boxes = np.array([[5, 5, 5, 5], [5, 5, 5, 5]], dtype=np.float32)
+    keep = tiling.non_max_suppression(boxes, np.array([.9, .8]))
+    self.assertEqual(keep.tolist(), [0, 1])
+
+
+class TiledDetectorTest(unittest.TestCase):
+
+  def test_maps_tile_boxes_to_the_frame(self):
+    detector = _FakeDetector([.25, .25, .5, .5])
+    tiled = tiling.TiledDetector(detector, tile_size=(100, 100), overlap=0,
+                                 max_detections=10)
+    boxes, scores, _, num = tiled.run(np.zeros((100, 200, 3), np.uint8))
+    self.assertEqual(detector.batch_sizes, [2])
+    self.assertEqual(int(num[0]), 2)
+    self.assertEqual(boxes.shape, (1, 10, 4))
+    np.testing.assert_allclose(
+        sorted(boxes[0, :2].tolist()),
+        [[.25, .125, .5, .25], [.25, .625, .5, .75]], atol=1e-6)
+    np.testing.assert_allclose(scores[0, 2:], 0)
+
+  def test_merges_duplicates_of_overlapping_tiles(self):
+    # With full overlap both tiles see the face at the same frame position.
+    detector = _FakeDetector([.2, .2, .6, .6])
+    tiled = tiling.TiledDetector(detector, tile_size=(100, 100), overlap=99)
+    _, _, _, num = tiled.run(np.zeros((100, 101, 3), np.uint8))
+    self.assertEqual(detector.batch_sizes, [2])
+    self.assertEqual(int(num[0]), 1)
+
+  def test_drops_low_scores(self):
+    detector = _FakeDetector([.2, .2, .6, .6], score=.01)
+    tiled = tiling.TiledDetector(detector, tile_size=(100, 100))
+    _, _, _, num = tiled.run(np.zeros((100, 100, 3), np.uint8))
+    self.assertEqual(int(num[0]), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,166 @@
+"""Detect-every-K-frames mode with optical flow box tracking in between.
+
+Faces move little between consecutive frames of a 25-30 fps feed, so the
+full detector only has to run on key frames.  On the frames in between the
+boxes of the last key frame are propagated with sparse Lucas-Kanade optical
+flow, which costs a small fraction of an SSD inference.  A new key frame is
+forced as soon as a box loses too many of its tracked points.
+"""
+
+import cv2
+import numpy as np
+
+
+class TrackingDetector(object):
+  """Wraps a detector, running it every K frames and tracking in between.
+
+  run() keeps the interface of TensoflowFaceDector.run: every frame yields a
+  (boxes, scores, classes, num_detections) tuple of the same shapes, with the
+  boxes of tracked faces moved to their estimated position.
+  """
+
+  def __init__(self,
+               detector,
+               detect_every=5,
+               min_score_thresh=.5,
+               min_track_confidence=.6,
+               max_points_per_box=20):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything with a compatible run().
+      detect_every: run the detector on every detect_every-th frame.  1 runs
+        it on every frame and disables tracking.
+      min_score_thresh: only detections scoring above this are tracked.
+      min_track_confidence: fraction of a box's points that must be tracked
+        successfully; below it a new key frame is forced.
+      max_points_per_box: number of feature points tracked per box.
+    """
+    if detect_every < 1:
+      raise ValueError('detect_every must be >= 1')
+    self._detector = detector
+    self._detect_every = detect_every
+    self._min_score_thresh = min_score_thresh
+    self._min_track_confidence = min_track_confidence
+    self._max_points_per_box = max_points_per_box
+
+    self._frames_since_detection = 0
+    self._prev_gray = None
+    self._detections = None
+    # Rows of the detections being tracked, and their boxes in pixels.
+    self._tracked_rows = np.zeros((0,), dtype=np.int64)
+    self._pixel_boxes = np.zeros((0, 4), dtype=np.float32)
+    self._points = []
+
+    self.detected_frames = 0
+    self.tracked_frames = 0
+
+  def run(self, image):
+    """image: bgr image
+    return (boxes, scores, classes, num_detections)
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if (self._detections is None or
+        self._frames_since_detection + 1 >= self._detect_every or
+        gray.shape != self._prev_gray.shape or
+        not self._track(gray)):
+      self._detect(image, gray)
+    else:
+      self._frames_since_detection += 1
+      self.tracked_frames += 1
+    self._prev_gray = gray
+    return self._output()
+
+  def run_batch(self, frames, batch_size=None):
+    """Runs run() on each frame in order; tracking is inherently sequential."""
+    del batch_size  # Frames have to be processed one after the other.
+    return [self.run(frame) for frame in frames]
+
+  def _detect(self, image, gray):
+    self._detections = [np.copy(a) for a in self._detector.run(image)]
+    self._frames_since_detection = 0
+    self.detected_frames += 1
+
+    (boxes, scores, _, _) = self._detections
+    self._tracked_rows = np.flatnonzero(scores[0] > self._min_score_thresh)
+    [h, w] = gray.shape[:2]
+    self._pixel_boxes = boxes[0, self._tracked_rows] * np.array(
+        [h, w, h, w], dtype=np.float32)
+    self._points = [self._seed_points(gray, box) for box in self._pixel_boxes]
+
+  def _seed_points(self, gray, box):
+    """Returns [N, 1, 2] float32 points to track inside a pixel box."""
+    [h, w] = gray.shape[:2]
+    top, left, bottom, right = [int(round(v)) for v in box]
+    top, left = max(top, 0), max(left, 0)
+    bottom, right = min(bottom, h), min(right, w)
+    if bottom - top < 2 or right - left < 2:
+      return np.zeros((0, 1, 2), dtype=np.float32)
+    mask = np.zeros_like(gray)
+    mask[top:bottom, left:right] = 255
+    points = cv2.goodFeaturesToTrack(gray, self._max_points_per_box, 0.01, 3,
+                                     mask=mask)
+    if points is None:
+      # Texture-less face: fall back to a regular grid over the box.
+      ys, xs = np.meshgrid(np.linspace(top, bottom - 1, 4),
+                           np.linspace(left, right - 1, 4), indexing='ij')
+      points = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape(-1, 1, 2)
+    return points.astype(np.float32)
+
+  def _track(self, gray):
+    """Moves every tracked box along the optical flow of its points.
+
+    Returns:
+      False if any box lost too many points and a key frame is needed.
+    """
+    if not len(self._pixel_boxes):
+      return True
+    counts = [len(points) for points in self._points]
+    if not all(counts):
+      return False
+    prev_points = np.concatenate(self._points)
+    next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+        self._prev_gray, gray, prev_points, None)
+    status = status.ravel().astype(bool)
+
+    new_boxes = np.empty_like(self._pixel_boxes)
+    new_points = []
+    start = 0
+    for i, count in enumerate(counts):
+      ok = status[start:start + count]
+      old = prev_points[start:start + count][ok].reshape(-1, 2)
+      new = next_points[start:start + count][ok].reshape(-1, 2)
+      start += count
+      if len(old) < 2 or len(old) < self._min_track_confidence * count:
+        return False
+      # Median translation, and median change of the spread around the
+      # centroid as the scale change.
+      shift = np.median(new - old, axis=0)
+      old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+      new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+      valid = old_spread > 1e-3
+      scale = np.median(new_spread[valid] / old_spread[valid]) if np.any(
+          valid) else 1.0
+
+      top, left, bottom, right = self._pixel_boxes[i]
+      center_y = (top + bottom) / 2. + shift[1]
+      center_x = (left + right) / 2. + shift[0]
+      half_h = (bottom - top) * scale / 2.
+      half_w = (right - left) * scale / 2.
+      new_boxes[i] = (center_y - half_h, center_x - half_w,
+                      center_y + half_h, center_x + half_w)
+      new_points.append(new.reshape(-1, 1, 2))
+
+    self._pixel_boxes = new_boxes
+    self._points = new_points
+    return True
+
+  def _output(self):
+    (boxes, scores, classes, num_detections) = self._detections
+    if self._frames_since_detection and len(self._tracked_rows):
+      [h, w] = self._prev_gray.shape[:2]
+      boxes = np.copy(boxes)
+      boxes[0, self._tracked_rows] = np.clip(
+          self._pixel_boxes / np.array([h, w, h, w], dtype=np.float32),
+          0.0, 1.0)
+    return (boxes, scores, classes, num_detections)
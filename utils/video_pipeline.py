@@ -0,0 +1,345 @@
+"""Staged decode / inference / render / encode pipeline for video files.
+
+The pipeline runs four kinds of stages in parallel, joined by bounded queues:
+
+  decoder thread -> inference thread -> render workers -> writer thread
+
+Bounded queues give backpressure: a slow stage blocks the stages in front of
+it instead of letting frames pile up in memory.  Render workers may finish
+frames out of order, the writer puts them back into their original order
+before encoding.
+
+In headless mode (no output_path and no render_fn) the render and encode
+stages are skipped altogether: frames are dropped right after inference and
+only their detections are handed, in order, to a detection sink.
+
+A crop exporter, if given, receives every frame right after inference,
+before anything is drawn onto it.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+import cv2
+from six.moves import queue
+
+from utils import metrics
+
+
+# Marks the end of the stream on every queue.
+_END_OF_STREAM = None
+
+_FRAMES_IN = metrics.counter('face_frames_in_total',
+                             'Frames read from the input.')
+_FRAMES_OUT = metrics.counter('face_frames_out_total',
+                              'Frames written to the output.')
+
+
+def _stage_seconds(stage):
+  return metrics.histogram('face_stage_seconds',
+                           'Wall time per pipeline stage.',
+                           labels={'stage': stage})
+
+
+class _PipelineStopped(Exception):
+  """Raised inside a stage when another stage has failed."""
+
+
+class VideoPipeline(object):
+  """Runs detection over a video file with overlapping pipeline stages."""
+
+  def __init__(self,
+               detector,
+               input_path,
+               output_path,
+               render_fn,
+               fourcc=0,
+               fps=None,
+               sink=None,
+               crop_exporter=None,
+               start_frame=0,
+               exact_seek=False,
+               max_frames=None,
+               queue_size=32,
+               batch_size=8,
+               num_render_workers=2,
+               report_interval=5.0):
+    """Constructor.
+
+    Args:
+      detector: a TensoflowFaceDector, or anything providing a compatible
+        run_batch(frames) method.
+      input_path: path or device id handed to cv2.VideoCapture.
+      output_path: path of the encoded output video, or None to skip encoding.
+      render_fn: callable(image, detections) drawing detections onto the bgr
+        image in place.  detections is a (boxes, scores, classes,
+        num_detections) tuple as returned by the detector.  None skips
+        rendering, and requires output_path to be None as well.
+      fourcc: fourcc code handed to cv2.VideoWriter.
+      fps: frame rate of the output video.  If None, the input frame rate is
+        used, falling back to 25.
+      sink: optional detection sink (see utils.detection_sinks), receiving
+        write(frame_index, timestamp, detections) for every frame, in order.
+      crop_exporter: optional utils.crop_export.CropExporter, receiving every
+        frame in order before rendering, and closed at the end.
+      start_frame: index of the first frame to process; the input is seeked
+        there before decoding starts, and frame indices handed to the sink
+        count from the start of the input.
+      exact_seek: reach start_frame by decoding the input from its start,
+        instead of seeking.  Seeking is fast, but not frame accurate for every
+        codec and container, so a seek that does not land on start_frame
+        falls back to decoding from the start; a seek that only reports the
+        requested position while landing elsewhere can still shift the
+        processed range by a few frames.
+      max_frames: stop after this many frames.  If None, read the whole input.
+      queue_size: capacity of each inter-stage queue.
+      batch_size: maximum number of frames per inference call.
+      num_render_workers: number of render threads.
+      report_interval: seconds between two queue depth log lines.  If None,
+        queue depths are not logged.
+
+    Raises:
+      ValueError: if output_path is given without a render_fn, or if none of
+        an output_path, a sink or a crop_exporter is given.
+    """
+    if output_path is not None and render_fn is None:
+      raise ValueError('An output video requires a render_fn.')
+    if output_path is None and sink is None and crop_exporter is None:
+      raise ValueError('An output_path, a sink or a crop_exporter is required.')
+    self._detector = detector
+    self._input_path = input_path
+    self._output_path = output_path
+    self._render_fn = render_fn
+    self._fourcc = fourcc
+    self._fps = fps
+    self._sink = sink
+    self._crop_exporter = crop_exporter
+    self._start_frame = start_frame
+    self._exact_seek = exact_seek
+    self._max_frames = max_frames
+    self._batch_size = batch_size
+    # Headless: inference feeds the writer directly.
+    self._num_render_workers = num_render_workers if render_fn else 0
+    self._report_interval = report_interval
+
+    self._queues = collections.OrderedDict(
+        (name, queue.Queue(maxsize=queue_size))
+        for name in ('decoded', 'inferred', 'rendered'))
+    for name, q in self._queues.items():
+      metrics.gauge('face_pipeline_queue_depth',
+                    'Number of frames waiting in a pipeline queue.',
+                    labels={'queue': name}).set_function(q.qsize)
+    self._stop = threading.Event()
+    self._error = None
+    self._frames_written = 0
+
+  @property
+  def headless(self):
+    return self._render_fn is None
+
+  def queue_depths(self):
+    """Returns a dict of queue name -> (current size, capacity)."""
+    return dict((name, (q.qsize(), q.maxsize))
+                for name, q in self._queues.items())
+
+  @property
+  def frames_written(self):
+    return self._frames_written
+
+  def run(self):
+    """Runs the pipeline until the input is exhausted.
+
+    Returns:
+      the number of frames written to the output video or the sink.
+
+    Raises:
+      the first exception raised by any stage.
+    """
+    cap = cv2.VideoCapture(self._input_path)
+    if self._start_frame:
+      self._seek(cap)
+    if self._fps is None:
+      self._fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+
+    threads = [threading.Thread(target=self._guard, args=(self._decode, cap)),
+               threading.Thread(target=self._guard, args=(self._infer,))]
+    threads.extend(threading.Thread(target=self._guard, args=(self._render,))
+                   for _ in range(self._num_render_workers))
+    threads.append(threading.Thread(target=self._guard, args=(self._write,)))
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    start_time = time.time()
+    last_report = start_time
+    while any(thread.is_alive() for thread in threads):
+      threads[-1].join(0.1)
+      now = time.time()
+      if (self._report_interval is not None and
+          now - last_report >= self._report_interval):
+        last_report = now
+        logging.info('frames written: %d (%.1f fps), queue depths: %s',
+                     self._frames_written,
+                     self._frames_written / (now - start_time),
+                     self._format_queue_depths())
+    for thread in threads:
+      thread.join()
+    cap.release()
+
+    if self._error is not None:
+      raise self._error
+    return self._frames_written
+
+  def _seek(self, cap):
+    """Positions cap so that the next frame read is start_frame."""
+    if not self._exact_seek:
+      cap.set(cv2.CAP_PROP_POS_FRAMES, self._start_frame)
+      position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+      if position == self._start_frame:
+        return
+      logging.warning('seeking to frame %d landed on frame %d, decoding from '
+                      'the start instead', self._start_frame, position)
+      cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(self._start_frame):
+      if not cap.grab():
+        break
+
+  def _format_queue_depths(self):
+    return ', '.join('{} {}/{}'.format(name, size, capacity)
+                     for name, (size, capacity) in self.queue_depths().items())
+
+  def _guard(self, stage, *args):
+    try:
+      stage(*args)
+    except _PipelineStopped:
+      pass
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('video pipeline stage failed')
+      if self._error is None:
+        self._error = e
+      self._stop.set()
+
+  def _put(self, name, item):
+    while True:
+      if self._stop.is_set():
+        raise _PipelineStopped()
+      try:
+        self._queues[name].put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def _get(self, name):
+    while True:
+      if self._stop.is_set():
+        raise _PipelineStopped()
+      try:
+        return self._queues[name].get(timeout=0.1)
+      except queue.Empty:
+        pass
+
+  def _decode(self, cap):
+    decode_seconds = _stage_seconds('decode')
+    index = 0
+    while self._max_frames is None or index < self._max_frames:
+      with decode_seconds.time():
+        ret, image = cap.read()
+      if not ret:
+        break
+      _FRAMES_IN.inc()
+      timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.
+      self._put('decoded', (index, timestamp, image))
+      index += 1
+    self._put('decoded', _END_OF_STREAM)
+
+  def _infer(self):
+    try:
+      self._infer_frames()
+    except BaseException:
+      if self._crop_exporter is not None:
+        # Do not let a crop write error hide the one already propagating.
+        try:
+          self._crop_exporter.close()
+        except Exception:  # pylint: disable=broad-except
+          logging.exception('closing the crop exporter failed')
+      raise
+    if self._crop_exporter is not None:
+      self._crop_exporter.close()
+
+  def _infer_frames(self):
+    # In headless mode there are no render workers, and the single inference
+    # thread keeps the frames in order for the writer.
+    target = 'rendered' if self.headless else 'inferred'
+    done = False
+    while not done:
+      batch = [self._get('decoded')]
+      # Top the batch up with whatever is already decoded, without waiting.
+      while batch[-1] is not _END_OF_STREAM and len(batch) < self._batch_size:
+        try:
+          batch.append(self._queues['decoded'].get_nowait())
+        except queue.Empty:
+          break
+      if batch[-1] is _END_OF_STREAM:
+        batch.pop()
+        done = True
+      if batch:
+        detections = self._detector.run_batch(
+            [image for _, _, image in batch], batch_size=self._batch_size)
+        for (index, timestamp, image), frame_detections in zip(batch,
+                                                               detections):
+          if self._crop_exporter is not None:
+            self._crop_exporter.add(self._start_frame + index, image,
+                                    frame_detections)
+          if self.headless:
+            image = None
+          self._put(target, (index, timestamp, image, frame_detections))
+    for _ in range(max(self._num_render_workers, 1)):
+      self._put(target, _END_OF_STREAM)
+
+  def _render(self):
+    render_seconds = _stage_seconds('render')
+    while True:
+      item = self._get('inferred')
+      if item is _END_OF_STREAM:
+        break
+      with render_seconds.time():
+        self._render_fn(item[2], item[3])
+      self._put('rendered', item)
+    self._put('rendered', _END_OF_STREAM)
+
+  def _write(self):
+    write_seconds = _stage_seconds('write')
+    out = None
+    pending = {}
+    next_index = 0
+    finished_workers = 0
+    try:
+      while finished_workers < max(self._num_render_workers, 1):
+        item = self._get('rendered')
+        if item is _END_OF_STREAM:
+          finished_workers += 1
+          continue
+        pending[item[0]] = item
+        while next_index in pending:
+          _, timestamp, image, detections = pending.pop(next_index)
+          with write_seconds.time():
+            if self._output_path is not None:
+              if out is None:
+                [h, w] = image.shape[:2]
+                out = cv2.VideoWriter(self._output_path, self._fourcc,
+                                      self._fps, (w, h))
+              out.write(image)
+            if self._sink is not None:
+              self._sink.write(self._start_frame + next_index, timestamp,
+                               detections)
+          _FRAMES_OUT.inc()
+          next_index += 1
+          self._frames_written = next_index
+    finally:
+      if out is not None:
+        out.release()
+      if self._sink is not None:
+        self._sink.close()
+
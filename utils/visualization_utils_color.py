@@ -20,13 +20,15 @@ The functions do not return a value, instead they modify the image itself.
 
 """
 import collections
+import threading
+
+import cv2
 import numpy as np
 import PIL.Image as Image
 import PIL.ImageColor as ImageColor
 import PIL.ImageDraw as ImageDraw
 import PIL.ImageFont as ImageFont
 import six
-import tensorflow as tf
 
 
 _TITLE_LEFT_MARGIN = 10
@@ -58,6 +60,144 @@ STANDARD_COLORS = [
 ]
 
 
+_RGB_CACHE = {}
+
+
+def _color_to_rgb(color):
+  """Returns the (r, g, b) tuple of a color name, memoized."""
+  rgb = _RGB_CACHE.get(color)
+  if rgb is None:
+    rgb = _RGB_CACHE[color] = ImageColor.getrgb(color)[:3]
+  return rgb
+
+
+_FONT_CACHE = {}
+_FONT_CACHE_LOCK = threading.Lock()
+
+
+def get_font(font_name='arial.ttf', font_size=24):
+  """Returns a PIL font, loading each (font_name, font_size) only once.
+
+  Falls back to PIL's default font if font_name cannot be loaded; the
+  fallback is cached as well, so a missing font costs one failed lookup in
+  total instead of one per box.
+
+  Args:
+    font_name: name or path of a TrueType font.
+    font_size: font size in points.
+
+  Returns:
+    a PIL.ImageFont font.
+  """
+  key = (font_name, font_size)
+  font = _FONT_CACHE.get(key)
+  if font is None:
+    with _FONT_CACHE_LOCK:
+      font = _FONT_CACHE.get(key)
+      if font is None:
+        try:
+          font = ImageFont.truetype(font_name, font_size)
+        except IOError:
+          font = ImageFont.load_default()
+        _FONT_CACHE[key] = font
+  return font
+
+
+class LabelSpriteCache(object):
+  """LRU cache of pre-rasterized label sprites.
+
+  Detection labels come from a small set of strings ("face: 97%", ...), so
+  instead of measuring and rasterizing the text of every label of every
+  frame, each distinct label is rasterized once and the resulting sprite is
+  pasted onto the frame afterwards.  The least recently used sprites are
+  evicted once max_entries is reached.
+  """
+
+  def __init__(self, rasterize_fn, max_entries=512):
+    """Constructor.
+
+    Args:
+      rasterize_fn: callable(*key) returning the sprite for a cache key.
+      max_entries: maximum number of sprites kept in the cache.
+    """
+    self._rasterize_fn = rasterize_fn
+    self._max_entries = max_entries
+    self._sprites = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self._sprites)
+
+  def get(self, *key):
+    """Returns the sprite for key, rasterizing it on a cache miss."""
+    with self._lock:
+      sprite = self._sprites.pop(key, None)
+      if sprite is not None:
+        self.hits += 1
+        self._sprites[key] = sprite
+        return sprite
+    sprite = self._rasterize_fn(*key)
+    with self._lock:
+      self.misses += 1
+      self._sprites[key] = sprite
+      while len(self._sprites) > self._max_entries:
+        self._sprites.popitem(last=False)
+    return sprite
+
+  def clear(self):
+    with self._lock:
+      self._sprites.clear()
+
+
+def _rasterize_pil_label(display_str, color, font_name, font_size):
+  """Renders display_str in black on a color filled PIL image.
+
+  Returns:
+    (sprite, text_height, margin)
+  """
+  font = get_font(font_name, font_size)
+  text_width, text_height = font.getsize(display_str)
+  margin = int(np.ceil(0.05 * text_height))
+  sprite = Image.new('RGB', (text_width + 1, text_height + 2 * margin + 1),
+                     color)
+  ImageDraw.Draw(sprite).text((margin, margin), display_str, fill='black',
+                              font=font)
+  return sprite, text_height, margin
+
+
+def _rasterize_cv2_label(display_str, color, font_scale):
+  """Renders display_str in black on a color filled uint8 array."""
+  font = cv2.FONT_HERSHEY_SIMPLEX
+  (text_width, text_height), baseline = cv2.getTextSize(
+      display_str, font, font_scale, 1)
+  margin = int(np.ceil(0.05 * text_height))
+  sprite = np.empty((text_height + baseline + 2 * margin, text_width + 1, 3),
+                    dtype=np.uint8)
+  sprite[:] = _color_to_rgb(color)
+  cv2.putText(sprite, display_str,
+              (margin, text_height + margin), font, font_scale, (0, 0, 0), 1,
+              cv2.LINE_AA)
+  return sprite
+
+
+PIL_LABEL_SPRITES = LabelSpriteCache(_rasterize_pil_label)
+CV2_LABEL_SPRITES = LabelSpriteCache(_rasterize_cv2_label)
+
+
+def _paste_sprite(image, sprite, top, left):
+  """Copies a [h, w, 3] sprite into image at (top, left), clipped to image."""
+  im_height, im_width = image.shape[:2]
+  sprite_height, sprite_width = sprite.shape[:2]
+  y0, x0 = max(top, 0), max(left, 0)
+  y1 = min(top + sprite_height, im_height)
+  x1 = min(left + sprite_width, im_width)
+  if y0 >= y1 or x0 >= x1:
+    return
+  image[y0:y1, x0:x1] = sprite[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
 def save_image_array_as_png(image, output_path):
   """Saves an image (represented as a numpy array) to PNG.
 
@@ -66,7 +206,7 @@ def save_image_array_as_png(image, output_path):
     output_path: path to which image should be written.
   """
   image_pil = Image.fromarray(np.uint8(image)).convert('RGB')
-  with tf.gfile.Open(output_path, 'w') as fid:
+  with open(output_path, 'wb') as fid:
     image_pil.save(fid, 'PNG')
 
 
@@ -156,25 +296,16 @@ def draw_bounding_box_on_image(image,
     (left, right, top, bottom) = (xmin, xmax, ymin, ymax)
   draw.line([(left, top), (left, bottom), (right, bottom),
              (right, top), (left, top)], width=thickness, fill=color)
-  try:
-    font = ImageFont.truetype('arial.ttf', 24)
-  except IOError:
-    font = ImageFont.load_default()
 
   text_bottom = top
   # Reverse list and print from bottom to top.
   for display_str in display_str_list[::-1]:
-    text_width, text_height = font.getsize(display_str)
-    margin = np.ceil(0.05 * text_height)
-    draw.rectangle(
-        [(left, text_bottom - text_height - 2 * margin), (left + text_width,
-                                                          text_bottom)],
-        fill=color)
-    draw.text(
-        (left + margin, text_bottom - text_height - margin),
-        display_str,
-        fill='black',
-        font=font)
+    # The label is rasterized once per distinct string and color, and pasted
+    # from the sprite cache afterwards.
+    sprite, text_height, margin = PIL_LABEL_SPRITES.get(
+        display_str, color, 'arial.ttf', 24)
+    image.paste(sprite, (int(round(left)),
+                         int(round(text_bottom - text_height - 2 * margin))))
     text_bottom -= text_height - 2 * margin
 
 
@@ -241,6 +372,68 @@ def draw_bounding_boxes_on_image(image,
                                boxes[i, 3], color, thickness, display_str_list)
 
 
+def draw_labeled_boxes_on_image_array(image,
+                                      boxes,
+                                      colors,
+                                      thickness=4,
+                                      display_str_list_list=(),
+                                      use_normalized_coordinates=True,
+                                      font_scale=0.6):
+  """Draws all boxes and their labels straight onto an image (numpy array).
+
+  Unlike draw_bounding_box_on_image_array, which wraps the whole frame into a
+  PIL image and copies it back for every single box, this draws every box
+  and label with OpenCV directly into the uint8 array, in one pass and
+  without any full-frame copy, so its cost does not grow with the frame size
+  times the number of boxes.
+
+  Channels are written in the same order as the PIL path, so both renderers
+  produce the same colors on the same array.
+
+  Args:
+    image: uint8 numpy array with shape [height, width, 3], modified in place.
+    boxes: a numpy array (or sequence) of shape [N, 4]:
+      (ymin, xmin, ymax, xmax).
+    colors: a color name per box, or a single color name for all boxes.
+    thickness: line thickness. Default value is 4.
+    display_str_list_list: list of list of strings, one list per box
+      (each string to be shown on its own line above the box).
+    use_normalized_coordinates: If True (default), treat coordinates as
+      relative to the image.  Otherwise treat coordinates as absolute.
+    font_scale: scale of the OpenCV Hershey font used for labels.  Labels
+      are rasterized once and then pasted from CV2_LABEL_SPRITES.
+
+  Raises:
+    ValueError: if boxes is not a [N, 4] array
+  """
+  boxes = np.asarray(boxes, dtype=np.float32)
+  if not boxes.size:
+    return
+  if boxes.ndim != 2 or boxes.shape[1] != 4:
+    raise ValueError('Input must be of size [N, 4]')
+  if use_normalized_coordinates:
+    im_height, im_width = image.shape[:2]
+    boxes = boxes * np.array([im_height, im_width, im_height, im_width],
+                             dtype=np.float32)
+  # (top, left, bottom, right) in pixels for every box at once.
+  pixel_boxes = np.rint(boxes).astype(np.int32)
+  if isinstance(colors, six.string_types):
+    colors = [colors] * len(pixel_boxes)
+
+  for i, (top, left, bottom, right) in enumerate(pixel_boxes.tolist()):
+    color = _color_to_rgb(colors[i])
+    cv2.rectangle(image, (left, top), (right, bottom), color, thickness)
+    if not display_str_list_list:
+      continue
+    text_bottom = top
+    # Reverse list and print from bottom to top.
+    for display_str in display_str_list_list[i][::-1]:
+      sprite = CV2_LABEL_SPRITES.get(display_str, colors[i], font_scale)
+      text_top = text_bottom - sprite.shape[0]
+      _paste_sprite(image, sprite, text_top, left)
+      text_bottom = text_top
+
+
 def draw_keypoints_on_image_array(image,
                                   keypoints,
                                   color='red',
@@ -294,30 +487,85 @@ def draw_mask_on_image_array(image, mask, color='red', alpha=0.7):
   """Draws mask on an image.
 
   Args:
-    image: uint8 numpy array with shape (img_height, img_height, 3)
-    mask: a float numpy array of shape (img_height, img_height) with
+    image: uint8 numpy array with shape (img_height, img_width, 3)
+    mask: a float numpy array of shape (img_height, img_width) with
       values between 0 and 1
     color: color to draw the keypoints with. Default is red.
     alpha: transparency value between 0 and 1. (default: 0.7)
 
+  Raises:
+    ValueError: On incorrect data type for image or masks.
+  """
+  draw_masks_on_image_array(image, [mask], color=color, alpha=alpha)
+
+
+def draw_masks_on_image_array(image,
+                              masks,
+                              color='red',
+                              alpha=0.7,
+                              boxes=None,
+                              use_normalized_coordinates=False):
+  """Draws the masks of several instances on an image, in order.
+
+  The image is only blended inside the bounding region of the pixels each
+  mask covers, with integer arithmetic, so the cost of drawing grows with the
+  area the masks cover rather than with the image size times the number of
+  instances.  The result is identical to compositing the masks one after the
+  other through PIL.  With boxes, each mask is clipped to its box: only the
+  mask pixels inside the box are searched and drawn.
+
+  Args:
+    image: uint8 numpy array with shape (img_height, img_width, 3)
+    masks: a sequence of float32 numpy arrays of shape (img_height,
+      img_width), or one array of shape (num_instances, img_height,
+      img_width), with values between 0 and 1
+    color: color to draw the masks with. Default is red.
+    alpha: transparency value between 0 and 1. (default: 0.7)
+    boxes: optional sequence of (ymin, xmin, ymax, xmax) boxes, one per mask,
+      to clip the masks to.
+    use_normalized_coordinates: whether boxes are normalized coordinates or
+      pixels.
+
   Raises:
     ValueError: On incorrect data type for image or masks.
   """
   if image.dtype != np.uint8:
     raise ValueError('`image` not of type np.uint8')
-  if mask.dtype != np.float32:
-    raise ValueError('`mask` not of type np.float32')
-  if np.any(np.logical_or(mask > 1.0, mask < 0.0)):
-    raise ValueError('`mask` elements should be in [0, 1]')
-  rgb = ImageColor.getrgb(color)
-  pil_image = Image.fromarray(image)
-
-  solid_color = np.expand_dims(
-      np.ones_like(mask), axis=2) * np.reshape(list(rgb), [1, 1, 3])
-  pil_solid_color = Image.fromarray(np.uint8(solid_color)).convert('RGBA')
-  pil_mask = Image.fromarray(np.uint8(255.0*alpha*mask)).convert('L')
-  pil_image = Image.composite(pil_solid_color, pil_image, pil_mask)
-  np.copyto(image, np.array(pil_image.convert('RGB')))
+  [im_height, im_width] = image.shape[:2]
+  rgb = np.array(_color_to_rgb(color), dtype=np.uint16)
+  for i, mask in enumerate(masks):
+    if mask.dtype != np.float32:
+      raise ValueError('`mask` not of type np.float32')
+    if mask.size and (mask.max() > 1.0 or mask.min() < 0.0):
+      raise ValueError('`mask` elements should be in [0, 1]')
+    top, left, bottom, right = 0, 0, im_height, im_width
+    if boxes is not None:
+      ymin, xmin, ymax, xmax = boxes[i]
+      if use_normalized_coordinates:
+        ymin, ymax = ymin * im_height, ymax * im_height
+        xmin, xmax = xmin * im_width, xmax * im_width
+      # Every pixel the box touches, and one more for rounding.
+      top = min(max(int(np.floor(ymin)), 0), im_height)
+      left = min(max(int(np.floor(xmin)), 0), im_width)
+      bottom = min(max(int(np.ceil(ymax)) + 1, top), im_height)
+      right = min(max(int(np.ceil(xmax)) + 1, left), im_width)
+    mask = mask[top:bottom, left:right]
+    if not mask.size:
+      continue
+    # Rows and columns holding at least one pixel of non-zero opacity.
+    rows = np.flatnonzero(np.uint8(255.0 * alpha * mask.max(axis=1)))
+    if not rows.size:
+      continue
+    y0, y1 = rows[0], rows[-1] + 1
+    cols = np.flatnonzero(np.uint8(255.0 * alpha * mask[y0:y1].max(axis=0)))
+    x0, x1 = cols[0], cols[-1] + 1
+    opacity = np.uint8(255.0 * alpha * mask[y0:y1, x0:x1]).astype(np.uint16)
+    opacity = opacity[:, :, np.newaxis]
+    region = image[top + y0:top + y1, left + x0:left + x1]
+    # Rounded (region * (255 - opacity) + rgb * opacity) / 255, as in PIL.
+    blended = region * (255 - opacity) + rgb * opacity + 127
+    blended //= 255
+    region[...] = blended
 
 
 def visualize_boxes_and_labels_on_image_array(image,
@@ -331,7 +579,9 @@ def visualize_boxes_and_labels_on_image_array(image,
                                               max_boxes_to_draw=20,
                                               min_score_thresh=.7,
                                               agnostic_mode=False,
-                                              line_thickness=4):
+                                              line_thickness=4,
+                                              renderer='pil',
+                                              clip_masks_to_boxes=False):
   """Overlay labeled boxes on an image with formatted scores and label names.
 
   This function groups boxes that correspond to the same location
@@ -361,7 +611,18 @@ def visualize_boxes_and_labels_on_image_array(image,
       class-agnostic mode or not.  This mode will display scores but ignore
       classes.
     line_thickness: integer (default: 4) controlling line width of the boxes.
+    renderer: 'pil' (default) draws each box through a PIL image, 'cv2' draws
+      all boxes and labels in one pass straight onto the array, see
+      draw_labeled_boxes_on_image_array.
+    clip_masks_to_boxes: whether to only draw the part of each instance mask
+      inside its box, which skips most of the mask for small boxes.  Default
+      is False, every pixel of the masks is drawn.
+
+  Raises:
+    ValueError: if renderer is not one of 'pil' or 'cv2'.
   """
+  if renderer not in ('pil', 'cv2'):
+    raise ValueError('Unknown renderer: {}'.format(renderer))
   # Create a display string (and color) for every box location, group any boxes
   # that correspond to the same location.
   box_to_display_str_map = collections.defaultdict(list)
@@ -397,16 +658,25 @@ def visualize_boxes_and_labels_on_image_array(image,
           box_to_color_map[box] = STANDARD_COLORS[
               classes[i] % len(STANDARD_COLORS)]
 
+  if renderer == 'cv2':
+    _draw_box_maps_in_one_pass(image, box_to_color_map, box_to_display_str_map,
+                               box_to_instance_masks_map, box_to_keypoints_map,
+                               instance_masks, keypoints,
+                               use_normalized_coordinates, line_thickness,
+                               clip_masks_to_boxes)
+    return
+
   # Draw all boxes onto image.
   for box, color in box_to_color_map.items():
     color = 'Violet'
     ymin, xmin, ymax, xmax = box
     if instance_masks is not None:
-      draw_mask_on_image_array(
+      draw_masks_on_image_array(
           image,
-          box_to_instance_masks_map[box],
-          color=color
-      )
+          [box_to_instance_masks_map[box]],
+          color=color,
+          boxes=[box] if clip_masks_to_boxes else None,
+          use_normalized_coordinates=use_normalized_coordinates)
     draw_bounding_box_on_image_array(
         image,
         ymin,
@@ -424,3 +694,114 @@ def visualize_boxes_and_labels_on_image_array(image,
           color=color,
           radius=line_thickness / 2,
           use_normalized_coordinates=use_normalized_coordinates)
+
+
+def _draw_box_maps_in_one_pass(image, box_to_color_map, box_to_display_str_map,
+                               box_to_instance_masks_map, box_to_keypoints_map,
+                               instance_masks, keypoints,
+                               use_normalized_coordinates, line_thickness,
+                               clip_masks_to_boxes):
+  """The 'cv2' renderer of visualize_boxes_and_labels_on_image_array."""
+  boxes = list(box_to_color_map.keys())
+  if not boxes:
+    return
+  color = 'Violet'
+  if instance_masks is not None:
+    draw_masks_on_image_array(
+        image, [box_to_instance_masks_map[box] for box in boxes], color=color,
+        boxes=boxes if clip_masks_to_boxes else None,
+        use_normalized_coordinates=use_normalized_coordinates)
+  draw_labeled_boxes_on_image_array(
+      image,
+      boxes,
+      color,
+      thickness=line_thickness,
+      display_str_list_list=[box_to_display_str_map[box] for box in boxes],
+      use_normalized_coordinates=use_normalized_coordinates)
+  if keypoints is not None:
+    for box in boxes:
+      draw_keypoints_on_image_array(
+          image,
+          box_to_keypoints_map[box],
+          color=color,
+          radius=line_thickness / 2,
+          use_normalized_coordinates=use_normalized_coordinates)
+
+
+def visualize_detections_on_image_array(image,
+                                        detections,
+                                        category_index,
+                                        max_boxes_to_draw=20,
+                                        min_score_thresh=.7,
+                                        agnostic_mode=False,
+                                        line_thickness=4,
+                                        renderer='pil'):
+  """Overlay a Detections on an image with formatted scores and label names.
+
+  The score threshold, the top-K selection and the conversion to pixels are
+  applied to whole arrays at once instead of box by box.  For detections
+  sorted by decreasing score, as the detector returns them, the output is the
+  one of visualize_boxes_and_labels_on_image_array with normalized
+  coordinates, with one difference: boxes at identical locations are drawn
+  one over the other, each with its own label, instead of as one box with a
+  multi-line label.
+
+  Args:
+    image: uint8 numpy array with shape (img_height, img_width, 3), modified
+      in place.
+    detections: a utils.detections.Detections with normalized boxes.
+    category_index: a dict containing category dictionaries (each holding
+      category index `id` and category name `name`) keyed by category indices.
+    max_boxes_to_draw: maximum number of boxes to visualize, the best scoring
+      ones.  If None, draw all boxes.
+    min_score_thresh: minimum score threshold for a box to be visualized
+    agnostic_mode: boolean (default: False) controlling whether to evaluate in
+      class-agnostic mode or not.  This mode will display scores but ignore
+      classes.
+    line_thickness: integer (default: 4) controlling line width of the boxes.
+    renderer: 'pil' (default) or 'cv2', see
+      visualize_boxes_and_labels_on_image_array.
+
+  Raises:
+    ValueError: if renderer is not one of 'pil' or 'cv2'.
+  """
+  if renderer not in ('pil', 'cv2'):
+    raise ValueError('Unknown renderer: {}'.format(renderer))
+  detections = detections.filter(min_score_thresh)
+  if max_boxes_to_draw:
+    detections = detections.top_k(max_boxes_to_draw)
+  if not len(detections):
+    return
+  percents = (100 * detections.scores).astype(np.int32).tolist()
+  if agnostic_mode:
+    display_strs = ['score: {}%'.format(p) for p in percents]
+  else:
+    display_strs = [
+        '{}: {}%'.format(category_index[c]['name'] if c in category_index
+                         else 'N/A', p)
+        for c, p in zip(detections.classes.tolist(), percents)]
+
+  color = 'Violet'
+  if renderer == 'cv2':
+    im_height, im_width = image.shape[:2]
+    draw_labeled_boxes_on_image_array(
+        image,
+        detections.to_pixels(im_height, im_width),
+        color,
+        thickness=line_thickness,
+        display_str_list_list=[[s] for s in display_strs],
+        use_normalized_coordinates=False)
+    return
+  # PIL draws at sub-pixel precision, keep the normalized coordinates.
+  for (ymin, xmin, ymax, xmax), display_str in zip(detections.boxes.tolist(),
+                                                   display_strs):
+    draw_bounding_box_on_image_array(
+        image,
+        ymin,
+        xmin,
+        ymax,
+        xmax,
+        color=color,
+        thickness=line_thickness,
+        display_str_list=[display_str],
+        use_normalized_coordinates=True)
@@ -0,0 +1,164 @@
+"""Tests for utils.visualization_utils_color."""
+
+import unittest
+
+import numpy as np
+import PIL.Image as Image
+import PIL.ImageColor as ImageColor
+
+from utils import visualization_utils_color as vis_util
+from utils.detections import Detections
+
+_CATEGORY_INDEX = {1: {'id': 1, 'name': 'face'}, 2: {'id': 2, 'name': 'other'}}
+
+
+def _draw_mask_with_pil(image, mask, color='red', alpha=0.7):
+  """The PIL compositing the numpy blending has to reproduce exactly."""
+  rgb = ImageColor.getrgb(color)
+  pil_image = Image.fromarray(image)
+  solid_color = np.expand_dims(
+      np.ones_like(mask), axis=2) * np.reshape(list(rgb), [1, 1, 3])
+  pil_solid_color = Image.fromarray(np.uint8(solid_color)).convert('RGBA')
+  pil_mask = Image.fromarray(np.uint8(255.0 * alpha * mask)).convert('L')
+  pil_image = Image.composite(pil_solid_color, pil_image, pil_mask)
+  np.copyto(image, np.array(pil_image.convert('RGB')))
+
+
+class DrawMasksTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rng = np.random.RandomState(0)
+
+  def _random_instances(self, height, width, num_instances):
+    masks = np.zeros((num_instances, height, width), dtype=np.float32)
+    boxes = []
+    for mask in masks:
+      ymin, xmin = self.rng.randint(0, height - 4), self.rng.randint(0,
+                                                                     width - 4)
+      ymax = self.rng.randint(ymin + 1, height + 1)
+      xmax = self.rng.randint(xmin + 1, width + 1)
+      mask[ymin:ymax, xmin:xmax] = self.rng.rand(ymax - ymin, xmax - xmin)
+      boxes.append((ymin / float(height), xmin / float(width),
+                    (ymax - 1) / float(height), (xmax - 1) / float(width)))
+    return masks, boxes
+
+  def test_matches_pil(self):
+    for _ in range(20):
+      height, width = self.rng.randint(8, 64, size=2)
+      image = self.rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+      masks, boxes = self._random_instances(height, width, 3)
+      expected = image.copy()
+      for mask in masks:
+        _draw_mask_with_pil(expected, mask, 'Violet', alpha=.6)
+      unbounded = image.copy()
+      vis_util.draw_masks_on_image_array(unbounded, list(masks), 'Violet',
+                                         alpha=.6)
+      np.testing.assert_array_equal(unbounded, expected)
+      bounded = image.copy()
+      vis_util.draw_masks_on_image_array(bounded, masks, 'Violet', alpha=.6,
+                                         boxes=boxes,
+                                         use_normalized_coordinates=True)
+      np.testing.assert_array_equal(bounded, expected)
+
+  def test_single_mask_matches_pil(self):
+    image = self.rng.randint(0, 256, (16, 24, 3)).astype(np.uint8)
+    mask = self.rng.rand(16, 24).astype(np.float32)
+    expected = image.copy()
+    _draw_mask_with_pil(expected, mask)
+    vis_util.draw_mask_on_image_array(image, mask)
+    np.testing.assert_array_equal(image, expected)
+
+  def test_boxes_clip_the_masks(self):
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    mask = np.ones((10, 10), dtype=np.float32)
+    vis_util.draw_masks_on_image_array(image, [mask], boxes=[(4, 4, 6, 6)])
+    drawn = image.any(axis=2)
+    self.assertEqual(drawn.sum(), 9)
+    self.assertTrue(drawn[4:7, 4:7].all())
+
+  def test_whole_mask_is_validated_with_boxes(self):
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    mask = np.ones((10, 10), dtype=np.float32)
+    mask[0, 0] = 2.
+    with self.assertRaises(ValueError):
+      vis_util.draw_masks_on_image_array(image, [mask], boxes=[(4, 4, 6, 6)])
+
+  def test_renderers_clip_masks_only_when_asked(self):
+    image = self.rng.randint(0, 256, (20, 30, 3)).astype(np.uint8)
+    boxes = np.array([[.2, .2, .4, .4], [.5, .5, .9, .9]], dtype=np.float32)
+    masks = self.rng.rand(2, 20, 30).astype(np.float32)
+    classes, scores = np.array([1, 1]), np.array([.9, .8], dtype=np.float32)
+    outputs = {}
+    for renderer in ('pil', 'cv2'):
+      for clip in (False, True):
+        output = image.copy()
+        vis_util.visualize_boxes_and_labels_on_image_array(
+            output, boxes, classes, scores, _CATEGORY_INDEX,
+            instance_masks=masks, use_normalized_coordinates=True,
+            line_thickness=1, renderer=renderer, clip_masks_to_boxes=clip)
+        outputs[renderer, clip] = output
+    for renderer in ('pil', 'cv2'):
+      # The corner is far from both boxes and their labels.
+      self.assertFalse(np.array_equal(outputs[renderer, False][19, 0],
+                                      image[19, 0]))
+      np.testing.assert_array_equal(outputs[renderer, True][19, 0],
+                                    image[19, 0])
+    expected = image.copy()
+    for mask in masks:
+      _draw_mask_with_pil(expected, mask, 'Violet')
+    np.testing.assert_array_equal(outputs['pil', False][15:, :5],
+                                  expected[15:, :5])
+
+  def test_empty_box(self):
+    image = np.zeros((10, 10, 3), dtype=np.uint8)
+    mask = np.ones((10, 10), dtype=np.float32)
+    vis_util.draw_masks_on_image_array(image, [mask], boxes=[(12, 0, 14, 5)])
+    self.assertFalse(image.any())
+
+  def test_invalid_inputs(self):
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    with self.assertRaises(ValueError):
+      vis_util.draw_masks_on_image_array(image.astype(np.float32),
+                                         [np.zeros((4, 4), np.float32)])
+    with self.assertRaises(ValueError):
+      vis_util.draw_masks_on_image_array(image, [np.zeros((4, 4), np.uint8)])
+    with self.assertRaises(ValueError):
+      vis_util.draw_masks_on_image_array(image,
+                                         [np.full((4, 4), 1.5, np.float32)])
+
+
+class VisualizeDetectionsTest(unittest.TestCase):
+
+  def _random_detections(self, rng, num_boxes):
+    ys, xs = rng.rand(num_boxes, 2), rng.rand(num_boxes, 2)
+    boxes = np.stack([ys.min(axis=1), xs.min(axis=1), ys.max(axis=1),
+                      xs.max(axis=1)], axis=1).astype(np.float32)
+    scores = np.sort(rng.rand(num_boxes).astype(np.float32))[::-1]
+    classes = rng.randint(1, 4, num_boxes)
+    return boxes, scores, classes
+
+  def test_matches_visualize_boxes_and_labels(self):
+    rng = np.random.RandomState(0)
+    for num_boxes in (0, 1, 5, 30):
+      boxes, scores, classes = self._random_detections(rng, num_boxes)
+      image = rng.randint(0, 256, (120, 160, 3)).astype(np.uint8)
+      for renderer in ('pil', 'cv2'):
+        expected = image.copy()
+        vis_util.visualize_boxes_and_labels_on_image_array(
+            expected, boxes, classes, scores, _CATEGORY_INDEX,
+            use_normalized_coordinates=True, renderer=renderer)
+        drawn = image.copy()
+        vis_util.visualize_detections_on_image_array(
+            drawn, Detections(boxes, scores, classes), _CATEGORY_INDEX,
+            renderer=renderer)
+        np.testing.assert_array_equal(drawn, expected)
+
+  def test_unknown_renderer(self):
+    with self.assertRaises(ValueError):
+      vis_util.visualize_detections_on_image_array(
+          np.zeros((4, 4, 3), np.uint8), Detections([], [], []),
+          _CATEGORY_INDEX, renderer='gl')
+
+
+if __name__ == '__main__':
+  unittest.main()